@@ -0,0 +1,93 @@
+import os, yaml
+from types import MappingProxyType
+
+from .utils import read_stage_table, mstar_table, cosmology
+
+# run contexts of this process, by (config, dconfig) : input files,
+# their signature and the context. Built once by the main process
+# before the tiles are dispatched, the (forked) tile workers
+# inherit them
+_run_contexts = {}
+
+# survey level inputs of the context (in this order)
+CONTEXT_KEYS = ('tiles', 'zpslices', 'gbkg', 'data_cls')
+
+
+def build_run_context(config, dconfig):
+    """
+    Parses the config files and reads the survey level inputs shared
+    by all the tiles (tiles, zp slices, global bkg, cluster catalog
+    if already produced). The mstar table and the cosmology are
+    loaded in their caches.
+    The context is stored for this process and returned as a read
+    only mapping (the tile functions copy what they update locally).
+    It is rebuilt by get_run_context when one of these inputs is
+    (re)computed, e.g. before pmem once the clusters are detected.
+    """
+    with open(config) as fstream:
+        param_cfg = yaml.load(fstream)
+    with open(dconfig) as fstream:
+        param_data = yaml.load(fstream)
+
+    survey, ref_filter  = param_cfg['survey'], param_cfg['ref_filter']
+    workdir = param_cfg['out_paths']['workdir']
+    wazp_cfg = param_cfg['wazp_cfg']
+
+    cats = {
+        'tiles':os.path.join(
+            workdir, param_cfg['admin']['tiling']['tiles_filename']
+        ),
+        'zpslices':os.path.join(workdir, wazp_cfg['zpslices_filename']),
+        'gbkg':os.path.join(workdir, 'gbkg', wazp_cfg['gbkg_filename']),
+        'data_cls':param_data['clcat'][param_cfg['clusters']]['cat']
+    }
+    # signature taken before reading : a file rewritten meanwhile
+    # triggers a new build
+    files = [config, dconfig] + [cats[key] for key in CONTEXT_KEYS]
+    signature = files_signature(files)
+    ctx = {'param_cfg':param_cfg, 'param_data':param_data}
+    for key in CONTEXT_KEYS:
+        ctx[key] = read_if_exists(cats[key])
+
+    # warm the caches
+    mstar_table(param_data['magstar_file'][survey][ref_filter])
+    cosmology(param_cfg['cosmo_params'])
+
+    ctx = MappingProxyType(ctx)
+    _run_contexts[(config, dconfig)] = (files, signature, ctx)
+    return ctx
+
+
+def get_run_context(config, dconfig, required=()):
+    """
+    Run context of (config, dconfig), inherited from the main
+    process or built here (e.g. queue workers started on other nodes).
+    It is rebuilt if one of its input files (configs, tiles, slices,
+    global bkg, clusters) changed (mtime / size) since it was built,
+    or if one of the required inputs was not yet produced.
+    """
+    if (config, dconfig) not in _run_contexts:
+        return build_run_context(config, dconfig)
+    files, signature, ctx = _run_contexts[(config, dconfig)]
+    if files_signature(files) != signature or \
+       any(ctx[key] is None for key in required):
+        return build_run_context(config, dconfig)
+    return ctx
+
+
+def files_signature(files):
+    # (mtime, size) of each file, None if missing
+    signature = []
+    for filename in files:
+        try:
+            st = os.stat(filename)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def read_if_exists(cat):
+    if not os.path.isfile(cat):
+        return None
+    return read_stage_table(cat)
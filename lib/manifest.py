@@ -0,0 +1,162 @@
+import numpy as np
+import os, json, hashlib, fcntl, time
+from astropy.table import Table
+
+# config keys that only drive the execution (not the results)
+EXEC_KEYS = ('nthreads_slices', 'slices_parallel_mode', 'nthreads_clusters', 
+             'nthreads_read', 'path_mr_filter')
+
+
+def file_hash(filename):
+    """
+    sha1 of the content of a file ('missing' if it does not exist).
+    Used for the small input files of a stage (slices, gbkg,
+    mstar file, cluster catalog...) that may be rewritten with
+    the same content at each run.
+    """
+    if not os.path.isfile(filename):
+        return 'missing'
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as fstream:
+        for block in iter(lambda: fstream.read(1024*1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def dir_signature(dirname):
+    # changes when files are added / removed / renamed in dirname
+    if not os.path.isdir(dirname):
+        return 'missing'
+    return str(os.stat(dirname).st_mtime_ns)
+
+
+def config_section(cfg):
+    # config section without the execution only keys (at any depth)
+    if not isinstance(cfg, dict):
+        return cfg
+    return {k:config_section(v) for k, v in cfg.items() if k not in EXEC_KEYS}
+
+
+def stage_hash(*items):
+    """
+    Hash of the parameters / input signatures a stage depends on.
+    Items must be json serializable (numpy scalars are converted).
+    Execution only keys of config dicts are ignored.
+    """
+    return hashlib.sha1(
+        json.dumps(
+            [config_section(item) for item in items], 
+            sort_keys=True, default=str
+        ).encode()
+    ).hexdigest()
+
+
+def manifest_filename(directory):
+    return os.path.join(directory, 'manifest.json')
+
+
+def read_manifest(directory):
+    if not os.path.isfile(manifest_filename(directory)):
+        return {}
+    with open(manifest_filename(directory)) as fstream:
+        return json.load(fstream)
+
+
+def stage_done(directory, stage, shash):
+    """
+    True if stage was committed in the manifest of directory with
+    the same hash, i.e. its outputs are complete and up to date.
+    """
+    entry = read_manifest(directory).get(stage)
+    return entry is not None and entry['hash'] == shash
+
+
+def commit_stage(directory, stage, shash):
+    """
+    Records stage as completed with hash shash. To be called once
+    all outputs of the stage are written (see atomic_path).
+    The manifest is locked during the update (slices / clusters
+    of a tile may commit from several processes) and replaced
+    atomically.
+    """
+    mfile = manifest_filename(directory)
+    with open(mfile+'.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = read_manifest(directory)
+        manifest[stage] = {'hash':shash, 'time':time.time()}
+        with open(mfile+'.tmp', 'w') as outfile:
+            json.dump(manifest, outfile, indent=1)
+        os.replace(mfile+'.tmp', mfile)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    return
+
+
+def atomic_path(filename):
+    """
+    Temporary name of filename in the same directory (same extension
+    for the writers that rely on it). Outputs are written there and
+    moved with os.replace(atomic_path(f), f) so that a crash never
+    leaves a partial file under the final name.
+    """
+    root, ext = os.path.splitext(filename)
+    return root+'.tmp'+str(os.getpid())+ext
+
+
+def save_npy(filename, data):
+    # atomic np.save
+    np.save(atomic_path(filename), data)
+    os.replace(atomic_path(filename), filename)
+    return
+
+
+def write_table(filename, table, artifact=False):
+    """
+    Atomic astropy Table.write of a Table or structured array (not
+    copied). With artifact, the .npy twin of the table is also
+    written (see save_artifact), after the fits file.
+    """
+    if not isinstance(table, Table):
+        table = Table(table, copy=False)
+    table.write(atomic_path(filename), overwrite=True)
+    os.replace(atomic_path(filename), filename)
+    if artifact:
+        save_artifact(artifact_filename(filename), table.as_array())
+    return
+
+
+def artifact_filename(filename):
+    # .npy twin of a fits output
+    return os.path.splitext(filename)[0]+'.npy'
+
+
+def save_artifact(filename, data):
+    """
+    Intermediate product handed to the next stages : fixed schema
+    structured array (no object columns), written once (atomic) as
+    .npy and memory mapped by the consumers (load_artifact).
+    """
+    data = np.asarray(data)
+    if data.dtype.hasobject:
+        raise TypeError('artifact '+filename+' has object columns')
+    np.save(atomic_path(filename), data, allow_pickle=False)
+    os.replace(atomic_path(filename), filename)
+    return
+
+
+def load_artifact(filename):
+    # memory mapped (copy on write : consumers may update it locally)
+    return np.load(filename, mmap_mode='c', allow_pickle=False)
+
+
+def fresh_artifact(filename):
+    """
+    .npy twin of the fits file filename if it exists and is not older
+    than filename (i.e. filename was not rewritten without its twin),
+    None otherwise (or if filename was removed).
+    """
+    twin = artifact_filename(filename)
+    if not (os.path.isfile(twin) and os.path.isfile(filename)):
+        return None
+    if os.stat(twin).st_mtime_ns < os.stat(filename).st_mtime_ns:
+        return None
+    return twin
@@ -0,0 +1,265 @@
+import numpy as np
+import healpy as hp
+import os, json, shutil
+from astropy.table import Table
+
+from .utils import read_FitsCat, dist_ang
+from .manifest import atomic_path, write_table
+
+# indexes of the stores read by this process, by store directory
+_store_indexes = {}
+
+
+def native_array(arr):
+    # native byte order copy of a fits column (strings kept as bytes)
+    arr = np.asarray(arr)
+    if arr.dtype.kind == 'U':
+        return arr.astype('S'+str(arr.dtype.itemsize//4))
+    return arr.astype(arr.dtype.newbyteorder('='))
+
+
+def save_columns(filename, data, columns, rows=None):
+    # compressed columnar chunk (one npz entry / column), atomic
+    np.savez_compressed(
+        atomic_path(filename),
+        **{c:native_array(
+            data[c] if rows is None else data[c][rows]
+        ) for c in columns}
+    )
+    os.replace(atomic_path(filename), filename)
+    return
+
+
+def write_members_store(members_file, richness_file, store_dir, clkeys,
+                        store_cfg):
+    """
+    Writes the survey members and richnesses as a store partitioned
+    by HEALPix pixel (store_cfg Nside / nest) of the cluster centers:
+    store_dir/<hpix>/richness.npz and members_<k>.npz, row chunks of
+    store_cfg['chunk_nrows'] members, one compressed array / column.
+    In a pixel, the clusters are sorted by id and the members of a
+    cluster are contiguous. index.fits gives for each cluster id its
+    pixel, its richness row and the range of its member rows.
+    The members file is read memory mapped, one chunk at a time.
+    The store is built in store_dir.tmp and replaces store_dir at the 
+    end (readers never see a partial store).
+    """
+    nside, nest = store_cfg['Nside'], store_cfg['nest']
+    chunk_nrows = int(store_cfg['chunk_nrows'])
+
+    richness = np.copy(read_FitsCat(richness_file))
+    ids = richness[clkeys['key_id']]
+    hpix = hp.ang2pix(
+        nside, richness[clkeys['key_ra']], richness[clkeys['key_dec']],
+        nest, lonlat=True
+    )
+    corder = np.lexsort((ids, hpix)) # clusters by pixel, then id
+    rank = np.empty(len(corder), dtype='i8')
+    rank[corder] = np.arange(len(corder))
+
+    # members => rank of their cluster
+    members = read_FitsCat(members_file)
+    id_sort = np.argsort(ids)
+    mkey = np.empty(len(members), dtype='i8')
+    for i0 in range(0, len(members), chunk_nrows):
+        id_cl = native_array(members['id_cl'][i0:i0+chunk_nrows])
+        pos = np.clip(np.searchsorted(ids[id_sort], id_cl), 0, len(ids)-1)
+        icl = id_sort[pos]
+        mkey[i0:i0+chunk_nrows] = np.where(
+            ids[icl] == id_cl, rank[icl], len(ids) # unknown cluster
+        )
+    if np.any(mkey == len(ids)):
+        print ('.....members without richness row ignored : ',
+               np.count_nonzero(mkey == len(ids)))
+    morder = np.argsort(mkey, kind='stable')
+    mkey_sorted = mkey[morder]
+    mcount = np.bincount(mkey, minlength=len(ids)+1)[:len(ids)]
+
+    final_dir, store_dir = store_dir, store_dir+'.tmp'
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.makedirs(store_dir)
+
+    index = Table()
+    index['id'] = ids[corder]
+    index['hpix'] = hpix[corder]
+    index['ra'] = richness[clkeys['key_ra']][corder]
+    index['dec'] = richness[clkeys['key_dec']][corder]
+    index['rich_row'] = np.zeros(len(corder), dtype='i8')
+    index['row0'] = np.zeros(len(corder), dtype='i8')
+    index['row1'] = np.zeros(len(corder), dtype='i8')
+
+    hpu, first, count = np.unique(
+        index['hpix'], return_index=True, return_counts=True
+    )
+    for h, r0, n in zip(hpu, first, count):
+        pdir = os.path.join(store_dir, str(h))
+        os.mkdir(pdir)
+        save_columns(
+            os.path.join(pdir, 'richness.npz'), richness,
+            richness.dtype.names, corder[r0:r0+n]
+        )
+        index['rich_row'][r0:r0+n] = np.arange(n)
+        nmem = mcount[r0:r0+n]
+        index['row1'][r0:r0+n] = np.cumsum(nmem)
+        index['row0'][r0:r0+n] = index['row1'][r0:r0+n] - nmem
+
+        m0, m1 = np.searchsorted(mkey_sorted, [r0, r0+n])
+        for k, i0 in enumerate(range(m0, m1, chunk_nrows)):
+            save_columns(
+                os.path.join(pdir, 'members_'+str(k)+'.npz'), members,
+                members.dtype.names, morder[i0:min(m1, i0+chunk_nrows)]
+            )
+
+    write_table(os.path.join(store_dir, 'index.fits'), index)
+    meta = {'Nside':nside, 'nest':nest, 'chunk_nrows':chunk_nrows,
+            'members_columns':list(members.dtype.names),
+            'members_dtype':native_array(members[:0]).dtype.descr,
+            'richness_columns':list(richness.dtype.names)}
+    with open(os.path.join(store_dir, 'store.json'), 'w') as outfile:
+        json.dump(meta, outfile, indent=1)
+
+    # swap with the previous store
+    if os.path.exists(final_dir):
+        os.rename(final_dir, final_dir+'.old')
+    os.rename(store_dir, final_dir)
+    if os.path.exists(final_dir+'.old'):
+        shutil.rmtree(final_dir+'.old')
+    return
+
+
+def read_store_index(store_dir):
+    """
+    Meta data and cluster index of a members store (kept for the
+    process until index.fits changes).
+    """
+    ifile = os.path.join(store_dir, 'index.fits')
+    signature = os.stat(ifile).st_mtime_ns
+    if store_dir in _store_indexes and \
+       _store_indexes[store_dir][0] == signature:
+        return _store_indexes[store_dir][1]
+    with open(os.path.join(store_dir, 'store.json')) as fstream:
+        meta = json.load(fstream)
+    index = np.copy(read_FitsCat(ifile))
+    index = index[np.argsort(index['id'], kind='stable')] # for searchsorted
+    _store_indexes[store_dir] = (signature, (meta, index))
+    return meta, index
+
+
+def stack_columns(arrays, columns):
+    # structured array from a dict of columns
+    out = np.empty(
+        len(arrays[columns[0]]),
+        dtype=[(c, arrays[c].dtype, arrays[c].shape[1:]) for c in columns]
+    )
+    for c in columns:
+        out[c] = arrays[c]
+    return out
+
+
+def chunk_range(meta, row0, row1):
+    # ids of the member chunks covering rows [row0, row1[
+    if row1 <= row0:
+        return range(0)
+    return range(row0 // meta['chunk_nrows'], 
+                  (row1-1) // meta['chunk_nrows'] + 1)
+
+
+def load_pixel_chunks(store_dir, hpix, chunk_ids, columns):
+    # member chunks of pixel hpix, each decompressed once
+    chunks = {}
+    for k in sorted(set(chunk_ids)):
+        with np.load(os.path.join(
+                store_dir, str(hpix), 'members_'+str(k)+'.npz'
+        )) as chunk:
+            chunks[k] = {c:chunk[c] for c in columns}
+    return chunks
+
+
+def slice_chunks(meta, chunks, row0, row1, columns):
+    # member rows [row0, row1[ from the loaded chunks
+    if row1 <= row0:
+        dtype = np.dtype([tuple(d) for d in meta['members_dtype']])
+        return np.zeros(0, dtype=[(c, dtype[c]) for c in columns])
+    chunk_nrows = meta['chunk_nrows']
+    parts = {c:[] for c in columns}
+    for k in chunk_range(meta, row0, row1):
+        i0 = max(row0 - k*chunk_nrows, 0)
+        i1 = min(row1 - k*chunk_nrows, chunk_nrows)
+        for c in columns:
+            parts[c].append(chunks[k][c][i0:i1])
+    return stack_columns(
+        {c:np.concatenate(parts[c]) for c in columns}, columns
+    )
+
+
+def read_pixel_members(store_dir, meta, hpix, row0, row1, columns):
+    # member rows [row0, row1[ of pixel hpix, from the chunks covering them
+    chunks = load_pixel_chunks(
+        store_dir, hpix, chunk_range(meta, row0, row1), columns
+    )
+    return slice_chunks(meta, chunks, row0, row1, columns)
+
+
+def read_pixel_richness(store_dir, hpix, rows, columns):
+    with np.load(os.path.join(store_dir, str(hpix), 'richness.npz')) as dat:
+        return stack_columns({c:dat[c][rows] for c in columns}, columns)
+
+
+def read_cluster_members(store_dir, cluster_id, columns=None):
+    """
+    Members of cluster cluster_id read from a members store
+    (None if the id is not in the store).
+    """
+    meta, index = read_store_index(store_dir)
+    columns = meta['members_columns'] if columns is None else list(columns)
+    cluster_id = np.asarray(cluster_id, dtype=index['id'].dtype)
+    i = np.searchsorted(index['id'], cluster_id)
+    if i == len(index) or index['id'][i] != cluster_id:
+        return None
+    cl = index[i]
+    return read_pixel_members(
+        store_dir, meta, cl['hpix'], cl['row0'], cl['row1'], columns
+    )
+
+
+def read_clusters_in_disc(store_dir, ra, dec, radius_deg,
+                          columns=None, rich_columns=None):
+    """
+    Richnesses and members of the clusters of a members store with
+    center within radius_deg of (ra, dec). Only the pixels of the
+    store that overlap the disc are read, and each member chunk
+    of these pixels at most once.
+    """
+    meta, index = read_store_index(store_dir)
+    columns = meta['members_columns'] if columns is None else list(columns)
+    rich_columns = meta['richness_columns'] if rich_columns is None \
+                   else list(rich_columns)
+    pixels = hp.query_disc(
+        meta['Nside'], hp.ang2vec(ra, dec, lonlat=True),
+        np.radians(radius_deg), inclusive=True, nest=meta['nest']
+    )
+    sel = index[np.isin(index['hpix'], pixels)]
+    sel = sel[np.degrees(dist_ang(sel['ra'], sel['dec'], ra, dec)) <= \
+              radius_deg]
+    list_rich, list_members = [], []
+    for h in np.unique(sel['hpix']):
+        cls = sel[sel['hpix'] == h]
+        list_rich.append(
+            read_pixel_richness(
+                store_dir, h, np.sort(cls['rich_row']), rich_columns
+            )
+        )
+        cls = cls[np.argsort(cls['row0'])]
+        chunks = load_pixel_chunks(
+            store_dir, h, [k for cl in cls 
+                           for k in chunk_range(meta, cl['row0'], cl['row1'])],
+            columns
+        )
+        for cl in cls:
+            list_members.append(slice_chunks(
+                meta, chunks, cl['row0'], cl['row1'], columns
+            ))
+    if len(list_rich) == 0:
+        return None, None
+    return np.hstack(list_rich), np.hstack(list_members)
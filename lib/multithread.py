@@ -1,9 +1,13 @@
 import numpy as np 
 import astropy.io.fits as fits
-import os
+import os, time, traceback, socket, threading, glob, uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.optimize import nnls
 
 from .utils import read_FitsCat, hpx_split_survey
 from .utils import add_key_to_fits
+from .manifest import write_table
 
 
 def split_equal_nr_of_tiles_in_threads(n_threads, ntiles):
@@ -49,8 +53,8 @@ def split_equal_nr_of_tiles_in_threads(n_threads, ntiles):
 
 
 
-def split_equal_area_in_threads(n_threads, tiles_filename):
-
+def split_equal_area_in_threads(n_threads, tiles_filename, tile_costs=None):
+    # tile_costs replaces the eff. area as a proxy of the work if given
     tiles = read_FitsCat(tiles_filename)
     ntiles = len(tiles)
 
@@ -64,11 +68,14 @@ def split_equal_area_in_threads(n_threads, tiles_filename):
 
     if ntiles > n_threads:
 
-        eff_area = tiles['eff_area_deg2']
+        if tile_costs is None:
+            eff_area = tiles['eff_area_deg2']
+        else:
+            eff_area = np.asarray(tile_costs, dtype=float)
         area_thread = np.sum(eff_area)/float(n_threads)        
         thread_ids = np.zeros(ntiles)
         area_per_thread = np.zeros(n_threads)
-        for j in np.argsort(-eff_area):
+        for j in np.argsort(-eff_area, kind='stable'):
             i = np.argmin(area_per_thread)
             thread_ids[j]=i
             area_per_thread[i] += eff_area[j]
@@ -83,20 +90,540 @@ def split_equal_area_in_threads(n_threads, tiles_filename):
     return n_threads, thread_idsf.astype(int)
 
 
-def split_survey(survey_footprint, footprint, admin, tiles_filename):
+def split_survey(survey_footprint, footprint, admin, tiles_filename, 
+                 cost_file=None):
 
     if not os.path.isfile(tiles_filename):
-        ntiles = hpx_split_survey(
+        hpx_split_survey(
             survey_footprint, footprint, admin['tiling'], tiles_filename
         )
-        n_threads, thread_ids = split_equal_area_in_threads(
-            admin['nthreads_max'], tiles_filename
-        )
-        add_key_to_fits(tiles_filename, thread_ids, 'thread_id', 'int')
-        all_tiles = read_FitsCat(tiles_filename)
-    else:
-        all_tiles = read_FitsCat(tiles_filename)
-        ntiles, n_threads = len(all_tiles), np.amax(all_tiles['thread_id']) 
+    all_tiles = read_FitsCat(tiles_filename)
+    ntiles = len(all_tiles)
 
-    print ('Ntiles / Nthreads = ', ntiles, ' / ', n_threads)
+    if admin['parallel_mode'] == 'serial':
+        # static thread groups are only used by the serial loops 
+        if 'thread_id' not in all_tiles.dtype.names:
+            n_threads, thread_ids = split_equal_area_in_threads(
+                admin['nthreads_max'], tiles_filename, 
+                predict_tile_costs(all_tiles, cost_file)
+            )
+            add_key_to_fits(tiles_filename, thread_ids, 'thread_id', 'int')
+            all_tiles = read_FitsCat(tiles_filename)
+        n_threads = np.amax(all_tiles['thread_id']) 
+        print ('Ntiles / Nthreads = ', ntiles, ' / ', n_threads)
+    else:
+        print ('Ntiles / Nprocesses = ', ntiles, ' / ', 
+               admin['nthreads_max'], ' (dynamic scheduling)')
     return all_tiles
+
+
+def tile_cost_features(tiles_info):
+    # linear cost model : cst + Ngal + Nslices + Npeaks + Nclusters 
+    return np.column_stack((
+        np.ones(len(tiles_info)), 
+        tiles_info['Ngal'], tiles_info['Nslices'], 
+        tiles_info['Npeaks'], tiles_info['Nclusters']
+    )).astype(float)
+
+
+def pmem_cost_features(tiles_info):
+    # linear pmem cost model : cst + Nclusters 
+    return np.column_stack((
+        np.ones(len(tiles_info)), tiles_info['Nclusters']
+    )).astype(float)
+
+
+def timed_tiles(tiles_info):
+    # records fully computed in their run (usable wall times)
+    ok = (~np.asarray(tiles_info['resumed'], dtype=bool)) & \
+         (tiles_info['wall_time_s'] > 0.)
+    if 'Npeaks' in tiles_info.dtype.names:
+        ok &= (tiles_info['Npeaks'] >= 0)
+    return ok
+
+
+def fit_tile_cost_model(tiles_info, features_fct=tile_cost_features):
+    """
+    Non negative least squares fit of the tile wall time as a 
+    linear function of the tile statistics recorded in tile_info. 
+    Tiles resumed from intermediate products are not used. 
+    Returns None if there are not enough timed tiles. 
+    """
+    ok = timed_tiles(tiles_info)
+    features = features_fct(tiles_info[ok])
+    if np.count_nonzero(ok) <= features.shape[1]:
+        return None
+    coeffs, rnorm = nnls(features, tiles_info['wall_time_s'][ok])
+    print ('.....cost model fitted on ', np.count_nonzero(ok), 
+           ' tiles / rms residual (s) = ', 
+           np.round(rnorm / np.count_nonzero(ok)**0.5, 1))
+    return coeffs
+
+
+def predict_tile_costs(all_tiles, cost_file):
+    """
+    Predicts the cost of each tile from the tile_info records of 
+    a previous run (cost_file, see wazp_tiles_info). 
+    Tiles without record are scaled from their effective area. 
+    Falls back on the effective area if no usable record exists, and 
+    on a constant cost (tiles kept in input order) if no tile with 
+    record has a positive area to scale from. 
+    """
+    costs = np.array(all_tiles['eff_area_deg2'], dtype=float)
+    if cost_file is None or not os.path.isfile(cost_file):
+        return costs
+    tiles_info = read_FitsCat(cost_file)
+    if 'wall_time_s' not in tiles_info.dtype.names:
+        return costs
+    coeffs = fit_tile_cost_model(tiles_info)
+    if coeffs is None:
+        return costs
+
+    tiles_info = tiles_info[tiles_info['Npeaks'] >= 0]
+    predicted = np.dot(tile_cost_features(tiles_info), coeffs)
+    known = np.isin(all_tiles['id'], tiles_info['id'])
+    if np.count_nonzero(known) == 0:
+        return costs
+    isort = np.argsort(tiles_info['id'])
+    ipred = isort[np.searchsorted(
+        tiles_info['id'], all_tiles['id'][known], sorter=isort
+    )]
+    area = costs[known]
+    if np.count_nonzero(area > 0.) == 0:
+        return np.ones(len(costs))
+    scale = np.median(predicted[ipred][area > 0.] / area[area > 0.])
+    costs[~known] *= scale
+    costs[known] = predicted[ipred]
+    return costs
+
+
+def predict_pmem_tile_costs(ncls, cost_file):
+    """
+    Predicts the pmem cost of tiles with ncls clusters from the pmem 
+    tile records of a previous run (cost_file, see pmem_tiles_info). 
+    Falls back on ncls if no usable record exists. 
+    """
+    costs = np.array(ncls, dtype=float)
+    if cost_file is None or not os.path.isfile(cost_file):
+        return costs
+    coeffs = fit_tile_cost_model(
+        read_FitsCat(cost_file), pmem_cost_features
+    )
+    if coeffs is None:
+        return costs
+    return coeffs[0] + coeffs[1]*costs
+
+
+def native_records(list_data, dtype):
+    # copy of fits / npy records in one native array (by column, 
+    # fits logical columns converted to bool) 
+    records = np.zeros(sum(len(data) for data in list_data), dtype=dtype)
+    i0 = 0
+    for data in list_data:
+        for name in dtype.names:
+            records[name][i0:i0+len(data)] = data[name]
+        i0 += len(data)
+    return records
+
+
+def merge_tiles_info(list_info, outfile):
+    """
+    Writes the tile records of a run (list of tile_info) to outfile 
+    (cost file of the next run). For a tile whose new record is not 
+    fully computed (resumed, unknown stats), the timed record already 
+    in outfile is kept, so that re-entries do not erase the usable 
+    timings. 
+    """
+    dtype = np.dtype([
+        (name, list_info[0].dtype[name].newbyteorder('=') \
+         if name != 'resumed' else 'bool') 
+        for name in list_info[0].dtype.names
+    ])
+    tiles_info = native_records(list_info, dtype)
+    if os.path.isfile(outfile):
+        previous = read_FitsCat(outfile)
+        if set(previous.dtype.names) == set(dtype.names):
+            previous = native_records([previous], dtype)
+            new_ok = timed_tiles(tiles_info)
+            keep = timed_tiles(previous) & \
+                   ~np.isin(previous['id'], tiles_info['id'][new_ok])
+            new = new_ok | ~np.isin(tiles_info['id'], previous['id'][keep])
+            tiles_info = np.hstack((tiles_info[new], previous[keep]))
+            tiles_info = tiles_info[np.argsort(tiles_info['id'])]
+    write_table(outfile, tiles_info)
+    return tiles_info
+
+
+def order_tiles_by_cost(tile_ids, tile_costs):
+    """
+    Returns the tile ids sorted by decreasing estimated cost 
+    (largest first). Ties keep the input order. 
+    """
+    tile_ids = np.asarray(tile_ids)
+    if tile_costs is None:
+        return tile_ids
+    return tile_ids[np.argsort(-np.asarray(tile_costs), kind='stable')]
+
+
+def run_1tile(tile_fct, config, dconfig, tile_id):
+    """
+    Runs tile_fct(config, dconfig, tile_id) on a single tile. 
+    Any exception is caught and returned so that a failing tile 
+    does not stop the other ones. 
+    """
+    t0 = time.time()
+    try:
+        tile_fct(config, dconfig, tile_id)
+        status, message = 'done', ''
+    except Exception:
+        status, message = 'failed', traceback.format_exc()
+    return tile_id, status, time.time() - t0, message
+
+
+def run_tiles_in_pool(tile_fct, config, dconfig, tile_ids, nthreads, 
+                      tile_costs=None):
+    """
+    Dynamic scheduler : tiles are put in a single queue ordered by 
+    decreasing estimated cost (tile_costs, same order as tile_ids) 
+    and each of the nthreads processes pulls the next tile of the 
+    queue as soon as it is idle. 
+
+    Returns a per tile report (id, status, wall time in s)
+    """
+    tile_ids = [int(t) for t in order_tiles_by_cost(tile_ids, tile_costs)]
+    report = np.zeros(
+        len(tile_ids), 
+        dtype={'names':('id', 'status', 'wall_time_s'),
+               'formats':('i8', 'U8', 'f8')}
+    )
+    report['id'] = tile_ids
+    report['status'] = 'failed'
+    if len(tile_ids) == 0:
+        return report
+
+    nworkers = max(1, min(int(nthreads), len(tile_ids)))
+    print ('.....', len(tile_ids), ' tiles dispatched on ', 
+           nworkers, ' processes')
+    # fork : the workers inherit the run context of the main process
+    with ProcessPoolExecutor(
+            max_workers=nworkers, 
+            mp_context=multiprocessing.get_context('fork')
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_1tile, tile_fct, config, dconfig, tile_id
+            ):tile_id for tile_id in tile_ids
+        }
+        for future in as_completed(futures):
+            tile_id = futures[future]
+            try:
+                tile_id, status, wall_time, message = future.result()
+            except Exception:
+                # worker died (e.g. killed by the system) 
+                status, wall_time = 'failed', 0.
+                message = traceback.format_exc()
+            i = tile_ids.index(tile_id)
+            report['status'][i] = status
+            report['wall_time_s'][i] = wall_time
+            if status != 'done':
+                print ('..... Tile ', tile_id, ' failed \n', message)
+
+    print_tiles_report(report)
+    return report
+
+
+def print_tiles_report(report):
+    failed = report['id'][report['status'] != 'done']
+    print ('..... Ntiles done / failed = ', 
+           len(report) - len(failed), ' / ', len(failed))
+    if len(failed) > 0:
+        print ('..... failed tiles : ', failed)
+    return
+
+
+def queue_dir(workdir):
+    return os.path.join(workdir, 'tiles', 'queue')
+
+
+def queue_file(workdir, stage, tile_id, ext):
+    # lock / done / failed marker of a tile for a given stage 
+    return os.path.join(
+        queue_dir(workdir), stage+'_tile_'+str(int(tile_id)).zfill(3)+ext
+    )
+
+
+def queue_list_file(workdir, stage, run_id):
+    # ordered tile list of a stage, stamped with the run id
+    return os.path.join(queue_dir(workdir), stage+'_tiles_'+run_id+'.npy')
+
+
+def current_run_id(workdir):
+    # run id of the last coordinator start (None if no run yet)
+    try:
+        with open(os.path.join(queue_dir(workdir), 'run_id')) as fstream:
+            return fstream.readline().strip()
+    except FileNotFoundError:
+        return None
+
+
+def reset_queue(workdir):
+    """
+    Called by the coordinator at start : starts a new run id and 
+    removes the tile lists, locks and done / failed markers of a 
+    previous run. Tiles already computed with the same parameters 
+    and inputs are skipped by their stage manifest, not by the queue. 
+    Workers still processing a tile of a previous run lose their 
+    lease and do not mark it. Returns the run id. 
+    """
+    if not os.path.exists(queue_dir(workdir)):
+        os.makedirs(queue_dir(workdir))
+    run_id = uuid.uuid4().hex[:12]
+    run_file = os.path.join(queue_dir(workdir), 'run_id')
+    with open(run_file+'.tmp', 'w') as outfile:
+        outfile.write(run_id+'\n')
+    os.replace(run_file+'.tmp', run_file)
+    for pattern in ('*_tiles_*.npy', '*_tiles.npy', '*.lock', '*.done', 
+                    '*.failed', '*.stale.*'):
+        for f in glob.glob(os.path.join(queue_dir(workdir), pattern)):
+            try:
+                os.remove(f)
+            except FileNotFoundError:
+                pass
+    return run_id
+
+
+def publish_queue(workdir, stage, tile_ids):
+    # ordered list of the tiles of a stage, written atomically 
+    qfile = queue_list_file(workdir, stage, current_run_id(workdir))
+    np.save(qfile+'.tmp.npy', np.asarray(tile_ids, dtype=int))
+    os.replace(qfile+'.tmp.npy', qfile)
+    return
+
+
+def wait_for_queue(workdir, stage, poll_s, timeout_s):
+    """
+    Waits for the tile list of a stage published for the current run. 
+    Returns the run id and the tile list (None, None if timeout). 
+    """
+    t0 = time.time()
+    while True:
+        run_id = current_run_id(workdir)
+        if run_id is not None:
+            try:
+                return run_id, np.load(queue_list_file(workdir, stage, run_id))
+            except FileNotFoundError:
+                pass
+        if time.time() - t0 > timeout_s:
+            return None, None
+        time.sleep(poll_s)
+
+
+def worker_token():
+    # unique owner token of a worker, written in its locks
+    return socket.gethostname()+'_'+str(os.getpid())+'_'+\
+        uuid.uuid4().hex[:8]
+
+
+def read_lock(lock):
+    # owner token of a lock (None if there is no lock)
+    try:
+        with open(lock) as fstream:
+            return fstream.readline().strip()
+    except FileNotFoundError:
+        return None
+
+
+def claim_tile(workdir, stage, tile_id, lease_s, token):
+    """
+    Atomically claims a tile by creating its lock file (O_EXCL) with 
+    the owner token of the worker. 
+    A lock that was not renewed for more than lease_s seconds 
+    (dead worker) is renamed away and the claim is attempted again. 
+    If the renamed lock is not the expired one (taken over meanwhile 
+    by another worker), it is put back and the claim fails. 
+    Returns True if the tile is claimed by this worker. 
+    """
+    lock = queue_file(workdir, stage, tile_id, '.lock')
+    if os.path.isfile(queue_file(workdir, stage, tile_id, '.done')) or \
+       os.path.isfile(queue_file(workdir, stage, tile_id, '.failed')):
+        return False
+    for attempt in range(0, 2):
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, (token+'\n').encode())
+            os.close(fd)
+            return True
+        except FileExistsError:
+            holder = read_lock(lock)
+            try:
+                expired = time.time() - os.path.getmtime(lock) > lease_s
+            except FileNotFoundError:
+                continue
+            if not expired or holder is None:
+                return False
+            stale = lock+'.stale.'+token
+            try:
+                os.rename(lock, stale)
+            except FileNotFoundError:
+                return False
+            if read_lock(stale) != holder:
+                # live lock of another worker : put it back 
+                try:
+                    os.link(stale, lock)
+                except FileExistsError:
+                    pass
+                os.remove(stale)
+                return False
+            print ('..... expired lease on tile ', tile_id, ' reclaimed')
+            os.remove(stale)
+    return False
+
+
+def renew_lease(lock, token, lease_s, stop, lost):
+    # heartbeat : touch the lock file while the tile is processed, 
+    # lost is set if the lock vanished or was taken over
+    while not stop.wait(lease_s / 4.):
+        if read_lock(lock) != token:
+            lost.set()
+            return
+        try:
+            os.utime(lock, None)
+        except FileNotFoundError:
+            lost.set()
+            return
+    return
+
+
+def release_tile(workdir, stage, tile_id, token, status, wall_time, 
+                 message):
+    """
+    Writes the done / failed marker of a tile and removes its lock, 
+    only if the lock is still owned by token. 
+    Returns False if the lease was lost (nothing written). 
+    """
+    lock = queue_file(workdir, stage, tile_id, '.lock')
+    if read_lock(lock) != token:
+        return False
+    marker = queue_file(workdir, stage, tile_id, '.'+status)
+    with open(marker+'.tmp', 'w') as outfile:
+        outfile.write(token+' '+str(wall_time)+'\n'+message)
+    os.replace(marker+'.tmp', marker)
+    if read_lock(lock) == token:
+        try:
+            os.remove(lock)
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def queue_report(workdir, stage, tile_ids):
+    # per tile report of a stage built from the done / failed markers
+    report = np.zeros(
+        len(tile_ids), 
+        dtype={'names':('id', 'status', 'wall_time_s'),
+               'formats':('i8', 'U8', 'f8')}
+    )
+    report['id'] = tile_ids
+    report['status'] = 'pending'
+    for i in range(0, len(tile_ids)):
+        for status in ('done', 'failed'):
+            marker = queue_file(workdir, stage, tile_ids[i], '.'+status)
+            try:
+                with open(marker) as fstream:
+                    report['wall_time_s'][i] = float(
+                        fstream.readline().split()[1]
+                    )
+                report['status'][i] = status
+            except FileNotFoundError:
+                pass
+    return report
+
+
+def next_pending_tile(workdir, stage, tile_ids, tile_id):
+    # next tile after tile_id in the queue order not claimed yet
+    i0 = list(tile_ids).index(tile_id) + 1
+    for next_id in tile_ids[i0:]:
+        if not any([os.path.exists(queue_file(workdir, stage, next_id, ext))
+                    for ext in ('.lock', '.done', '.failed')]):
+            return next_id
+    return None
+
+
+def run_queue_worker(tile_fct, config, dconfig, workdir, stage, queue_cfg,
+                     prefetch_fct=None):
+    """
+    Worker of the shared filesystem queue : claims the tiles of a 
+    stage in the published order, processes them with 
+    tile_fct(config, dconfig, tile_id) and marks them done / failed. 
+    Returns when no tile of the stage is left pending, i.e. when 
+    all tiles are done or failed (including by other workers). 
+    Any number of workers, on any node seeing workdir, can run 
+    this function concurrently. A tile whose lease was lost during 
+    its processing (taken over by another worker, new run) is not 
+    marked. If the coordinator starts a new run, the worker joins 
+    the stage of the new run. 
+    If given, prefetch_fct(config, dconfig, tile_id) is called with 
+    the next pending tile before a tile is processed, to read its 
+    data in background (used if this worker claims it next). 
+    """
+    run_id, tile_ids = wait_for_queue(
+        workdir, stage, queue_cfg['poll_s'], queue_cfg['wait_s']
+    )
+    if tile_ids is None:
+        print ('..... no queue published for stage ', stage)
+        return None
+    token = worker_token()
+    print ('..... worker ', token, ' joins stage ', stage, 
+           ' of run ', run_id, ' (', len(tile_ids), ' tiles)')
+    lease_s = queue_cfg['lease_s']
+    while True:
+        nclaimed = 0
+        for tile_id in tile_ids:
+            if current_run_id(workdir) != run_id:
+                break
+            if not claim_tile(workdir, stage, tile_id, lease_s, token):
+                continue
+            nclaimed += 1
+            lock = queue_file(workdir, stage, tile_id, '.lock')
+            stop, lost = threading.Event(), threading.Event()
+            heartbeat = threading.Thread(
+                target=renew_lease, args=(lock, token, lease_s, stop, lost), 
+                daemon=True
+            )
+            heartbeat.start()
+            next_id = next_pending_tile(workdir, stage, tile_ids, tile_id)
+            if prefetch_fct is not None and next_id is not None:
+                try:
+                    prefetch_fct(config, dconfig, next_id)
+                except Exception:
+                    print ('..... prefetch of tile ', next_id, ' failed \n', 
+                           traceback.format_exc())
+            tile_id, status, wall_time, message = run_1tile(
+                tile_fct, config, dconfig, tile_id
+            )
+            stop.set()
+            heartbeat.join()
+            if status != 'done':
+                print ('..... Tile ', tile_id, ' failed \n', message)
+            if lost.is_set() or not release_tile(
+                    workdir, stage, tile_id, token, status, wall_time, 
+                    message
+            ):
+                print ('..... lease on tile ', tile_id, ' lost : ', 
+                       status, ' not recorded')
+
+        if current_run_id(workdir) != run_id:
+            print ('..... new run started : worker joins it')
+            return run_queue_worker(
+                tile_fct, config, dconfig, workdir, stage, queue_cfg, 
+                prefetch_fct
+            )
+        report = queue_report(workdir, stage, tile_ids)
+        if np.all(report['status'] != 'pending'):
+            break
+        if nclaimed == 0:
+            # remaining tiles are processed by other workers
+            time.sleep(queue_cfg['poll_s'])
+
+    print_tiles_report(report)
+    return report
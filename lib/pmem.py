@@ -3,7 +3,6 @@ import numpy as np
 import matplotlib.pyplot as plt
 import astropy.io.fits as fits
 import os, yaml
-from astropy.cosmology.core import FlatLambdaCDM as flat
 from astropy import units as u
 from astropy.convolution import convolve,Gaussian1DKernel
 import healpy as hp
@@ -14,6 +13,8 @@ from scipy import interpolate
 import math
 import logging 
 import time 
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from .utils import mad, gaussian, dist_ang, _mstar_, join_struct_arrays
 from .utils import all_hpx_in_annulus, hpx_in_annulus
@@ -21,9 +22,16 @@ from .utils import cond_in_disc, cond_in_hpx_disc
 from .utils import get_gaussian_kernel_1d, create_directory
 from .utils import read_mosaicFitsCat_in_disc, read_FitsCat, add_hpx_to_cat
 from .utils import create_tile_specs, concatenate_clusters
-from .utils import concatenate_members
+from .utils import concatenate_members, concatenate_fits_stream
 from .utils import read_mosaicFootprint_in_disc, filter_hpx_tile
 from .utils import filter_disc_tile, area_ann_deg2
+from .utils import prefetch_tile_data, prefetch_next_tile
+from .utils import cosmology, read_stage_table
+from .utils import lut_rows, footprint_lut, as_footprint_lut
+from .context import get_run_context
+from .multithread import merge_tiles_info
+from .manifest import stage_done, commit_stage, stage_hash, config_section
+from .manifest import file_hash, dir_signature, write_table
 
 
 def tile_dir_name(workdir, tile_nr):
@@ -977,7 +985,7 @@ def build_my_cluster (index_cl, data_cluster, clcat_analysis_keys,
     if richness_specs['external_radius']:
         ext_radius = data_cluster[clcat_analysis_keys['key_radius']]
 
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
     conv_factor = cosmo.angular_diameter_distance(zcl)# radian*conv=mpc    
 
     mstar = _mstar_ (mstar_filename, zcl)
@@ -1110,8 +1118,8 @@ def footprint_with_cl_masks (my_cluster, data_cls, clcat_keys,
     The healpix map is derived from the original visibility map with additional 
     holes at the position of neighbouring clusters 
     """
-    hpix_map, frac_map = data_fp[hpx_meta['key_pixel']],\
-                         data_fp[hpx_meta['key_frac']]
+    fp_lut = as_footprint_lut(data_fp, hpx_meta)
+    hpix_map, frac_map = fp_lut['pixels'], fp_lut['frac']
     conv_factor = my_cluster['conv_factor']
 
     cl_mask_radius_mpc = periphery_specs['radius_msk_mpc']
@@ -1134,9 +1142,10 @@ def footprint_with_cl_masks (my_cluster, data_cls, clcat_keys,
             hpix_clmask = hpix_in_discs(
                 racl_out, deccl_out, radius_clmask_deg, hpx_meta
             )
-            ind_out = (np.isin(
-                hpix_map, hpix_clmask, invert=True
-            ))     # galaxies in bkg region and not in outside clusters 
+            # galaxies in bkg region and not in outside clusters 
+            ind_out = np.ones(len(hpix_map), dtype=bool)
+            rows_clmask = lut_rows(fp_lut, hpix_clmask)
+            ind_out[rows_clmask[rows_clmask>=0]] = False
             hpix_map_with_clmask = hpix_map[ind_out]
             frac_map_with_clmask = frac_map[ind_out]
         else:
@@ -1199,7 +1208,7 @@ def compute_r200_n200(my_cluster, data_gal, galcat_keys, bkg_mpc2,
     conv_factor = my_cluster['conv_factor']
     mstar = my_cluster['mstar']
     zpmin, zpmax = my_cluster['zpmin'], my_cluster['zpmax']
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
 
     lradb = np.linspace(np.log10(radial_bin_specs['radius_min_mpc']),\
                         np.log10(radial_bin_specs['radius_max_mpc']),\
@@ -2181,7 +2190,6 @@ def pmem_tile(pmem_cfg, data_cls_analysis, data_cls_all, clcat_keys,
               sig_dz0, cosmo_params, mstar_filename, out_paths, verbose):
 
     workdir = out_paths['workdir_loc'] 
-    path = out_paths['pmem']
     photoz_support = pmem_cfg['photoz_support']    
     galcat_keys = galcat['keys']
 
@@ -2196,169 +2204,223 @@ def pmem_tile(pmem_cfg, data_cls_analysis, data_cls_all, clcat_keys,
     data_richness = init_richness_output(
         data_cls_analysis, pmem_cfg['richness_specs'], clcat_keys
     )
-    data_members, data_members_tile = None, None 
-    flag_init_members = 0
-    data_for_calib = None
-    flag_init_calib = 0
 
+    # footprint lookup table shared by all clusters 
+    clusters_out = pmem_tile_clusters(
+        len(data_cls_analysis), 
+        (pmem_cfg, data_cls_analysis, data_cls_all, clcat_keys,
+         footprint_lut(data_fp, hpx_meta), hpx_meta, data_gal, galcat, 
+         sig_dz0, cosmo_params, mstar_filename, out_paths, 
+         data_richness, verbose), 
+        pmem_cfg
+    )
+
+    # merge in cluster order 
+    list_members, list_calib = [], []
     for i in range(0, len(data_cls_analysis)):
+        richness_row, data_members, data_for_calib = clusters_out[i]
+        data_richness[i] = richness_row[0]
+        if data_members is not None:
+            list_members.append(data_members)
+        if data_for_calib is not None:
+            list_calib.append(data_for_calib)
 
-        data_cluster = data_cls_analysis[i]
-        idcl =  data_cluster[clcat_keys['key_id']]
-        racl =  data_cluster[clcat_keys['key_ra']]
-        deccl = data_cluster[clcat_keys['key_dec']]
-        zcl =   data_cluster[clcat_keys['key_zp']]
+    data_members_tile = None
+    if len(list_members) > 0:
+        data_members_tile = np.hstack(list_members)
 
-        if verbose>=1:
-            print ('')
-            print ('( '+str(i+1)+'/'+str(len(data_cls_analysis))+\
-                   ' )   Cluster ID = '+str(idcl)+\
-                   '      ra = '+str(round(racl,3))+\
-                   '      dec = '+str(round(deccl,3))+\
-                   '      zcl = '+str(round(zcl,3)))
+    # write calib file 
+    if len(list_calib) > 0:
+        write_table(
+            os.path.join(
+                workdir, 
+                pmem_cfg['calib_dz']['filename']
+            ), Table (np.hstack(list_calib))
+        )
 
-        if (zcl < pmem_cfg['global_conditions']['zcl_min'] or 
-            zcl > pmem_cfg['global_conditions']['zcl_max']):
-            data_richness['flag_pmem'][i] = 1
-            continue
+    return data_richness, data_members_tile
 
-        # build "my_cluster" dictionary that describes the useful cl ppties. 
-        my_cluster = build_my_cluster (
-            i, data_cluster, clcat_keys, pmem_cfg['photoz_support'], sig_dz0, 
-            pmem_cfg['mag_bin_specs'], pmem_cfg['pmem_specs'], 
-            pmem_cfg['richness_specs'], mstar_filename, cosmo_params
-        )
 
-        # local working galcat & footprints 
-        data_lgal = local_galcat(
-            data_gal, galcat['keys'], hpx_meta, my_cluster, 
-            pmem_cfg['bkg_specs']['radius_min_mpc'], 
-            pmem_cfg['bkg_specs']['radius_max_mpc'], 
-            pmem_cfg['mag_bin_specs']
-        )
-        if verbose>=1:
-            print('    Nr. of galaxies in cluster field = '+str(len(data_lgal)))
-        if len(data_lgal) == 0:
-            data_richness['flag_pmem'][i] = 2
-            continue
-        data_lfp = local_footprint(
-            my_cluster, data_fp, hpx_meta, pmem_cfg['bkg_specs']
-        )
-        data_lfp_mask, ncl_masked = footprint_with_cl_masks(
-            my_cluster, data_cls_all, clcat_keys, 
-            pmem_cfg['periphery_specs'], data_lfp, hpx_meta
-        ) 
-        if verbose>=1:
-            print ('    Nr of masked clusters in periphery : ', ncl_masked)
+def pmem_tile_cluster(i, pmem_cfg, data_cls_analysis, data_cls_all, 
+                      clcat_keys, data_fp, hpx_meta, data_gal, galcat, 
+                      sig_dz0, cosmo_params, mstar_filename, out_paths, 
+                      data_richness, verbose):
+    """
+    pmem of the i-th cluster of a tile. 
+    Returns the updated richness row i (1-row array), the members 
+    and the galaxies selected for the calib_dz (None if not relevant)
+    """
+    workdir = out_paths['workdir_loc'] 
+    path = out_paths['pmem']
+
+    data_cluster = data_cls_analysis[i]
+    idcl =  data_cluster[clcat_keys['key_id']]
+    racl =  data_cluster[clcat_keys['key_ra']]
+    deccl = data_cluster[clcat_keys['key_dec']]
+    zcl =   data_cluster[clcat_keys['key_zp']]
+
+    if verbose>=1:
+        print ('')
+        print ('( '+str(i+1)+'/'+str(len(data_cls_analysis))+\
+               ' )   Cluster ID = '+str(idcl)+\
+               '      ra = '+str(round(racl,3))+\
+               '      dec = '+str(round(deccl,3))+\
+               '      zcl = '+str(round(zcl,3)))
+
+    if (zcl < pmem_cfg['global_conditions']['zcl_min'] or 
+        zcl > pmem_cfg['global_conditions']['zcl_max']):
+        data_richness['flag_pmem'][i] = 1
+        return data_richness[i:i+1], None, None
+
+    # build "my_cluster" dictionary that describes the useful cl ppties. 
+    my_cluster = build_my_cluster (
+        i, data_cluster, clcat_keys, pmem_cfg['photoz_support'], sig_dz0, 
+        pmem_cfg['mag_bin_specs'], pmem_cfg['pmem_specs'], 
+        pmem_cfg['richness_specs'], mstar_filename, cosmo_params
+    )
+
+    # local working galcat & footprints 
+    data_lgal = local_galcat(
+        data_gal, galcat['keys'], hpx_meta, my_cluster, 
+        pmem_cfg['bkg_specs']['radius_min_mpc'], 
+        pmem_cfg['bkg_specs']['radius_max_mpc'], 
+        pmem_cfg['mag_bin_specs']
+    )
+    if verbose>=1:
+        print('    Nr. of galaxies in cluster field = '+str(len(data_lgal)))
+    if len(data_lgal) == 0:
+        data_richness['flag_pmem'][i] = 2
+        return data_richness[i:i+1], None, None
+    # cluster field footprints (without / with cluster masks) and their
+    # lookup tables, built once and used by all the footprint tests of 
+    # the cluster
+    data_lfp = local_footprint(
+        my_cluster, data_fp, hpx_meta, pmem_cfg['bkg_specs']
+    )
+    lfp_lut = footprint_lut(data_lfp, hpx_meta)
+    data_lfp_mask, ncl_masked = footprint_with_cl_masks(
+        my_cluster, data_cls_all, clcat_keys, 
+        pmem_cfg['periphery_specs'], lfp_lut, hpx_meta
+    ) 
+    lfp_mask_lut = footprint_lut(data_lfp_mask, hpx_meta)
+    if verbose>=1:
+        print ('    Nr of masked clusters in periphery : ', ncl_masked)
  
-        # test cluster and bkg coverage
-        cl_cfc, cl_wcfc = compute_cl_coverfracs(
-            my_cluster, pmem_cfg['weighted_coverfrac_specs'], 
-            data_lfp, hpx_meta, cosmo_params
-        )
+    # test cluster and bkg coverage
+    cl_cfc, cl_wcfc = compute_cl_coverfracs(
+        my_cluster, pmem_cfg['weighted_coverfrac_specs'], 
+        lfp_lut, hpx_meta, cosmo_params
+    )
 
-        bkg_cfc, bkg_wmask_cfc, bkg_area_deg2 = compute_bkg_coverfracs(
-            pmem_cfg['bkg_specs'], my_cluster, 
-            data_lfp, data_lfp_mask, hpx_meta
+    bkg_cfc, bkg_wmask_cfc, bkg_area_deg2 = compute_bkg_coverfracs(
+        pmem_cfg['bkg_specs'], my_cluster, 
+        lfp_lut, lfp_mask_lut, hpx_meta
+    )
+
+    if verbose>=1: 
+        print (
+            '    Cluster coverage (%)    raw = '+\
+            str(round(100.*cl_cfc, 1))+\
+            "     weighted = "+str(round(100.*cl_wcfc, 1))
+        )
+        print (
+            '    Bkg     coverage (%)    raw = '+\
+            str(round(100.*bkg_cfc, 1))+\
+            " with cl.masks = "+str(round(100.*bkg_wmask_cfc, 1))
         )
 
-        if verbose>=1: 
-            print (
-                '    Cluster coverage (%)    raw = '+\
-                str(round(100.*cl_cfc, 1))+\
-                "     weighted = "+str(round(100.*cl_wcfc, 1))
-            )
-            print (
-                '    Bkg     coverage (%)    raw = '+\
-                str(round(100.*bkg_cfc, 1))+\
-                " with cl.masks = "+str(round(100.*bkg_wmask_cfc, 1))
+    # generate footprint plot 
+    if verbose >= 2:
+        plot_footprint(
+            my_cluster, data_lfp, hpx_meta, 
+            pmem_cfg['bkg_specs']['radius_min_mpc'], 
+            pmem_cfg['bkg_specs']['radius_max_mpc'], 
+            pmem_cfg['weighted_coverfrac_specs']['radius_mpc'], 
+            bkg_cfc, cl_cfc, cl_wcfc, 
+            os.path.join(
+                workdir, 
+                path['plots'], 
+                'footprint_cl'+str(idcl)+'.png'
             )
+        )
 
-        # generate footprint plot 
-        if verbose >= 2:
+        if ncl_masked > 0:
             plot_footprint(
-                my_cluster, data_lfp, hpx_meta, 
+                my_cluster, data_lfp_mask, hpx_meta, 
                 pmem_cfg['bkg_specs']['radius_min_mpc'], 
                 pmem_cfg['bkg_specs']['radius_max_mpc'], 
-                pmem_cfg['weighted_coverfrac_specs']['radius_mpc'], 
-                bkg_cfc, cl_cfc, cl_wcfc, 
+                pmem_cfg['weighted_coverfrac_specs']['radius_mpc'],
+                bkg_wmask_cfc, cl_cfc, cl_wcfc,
                 os.path.join(
                     workdir, 
                     path['plots'], 
-                    'footprint_cl'+str(idcl)+'.png'
+                    'footprint_with_clmask_cl'+str(idcl)+'.png'
                 )
             )
 
-            if ncl_masked > 0:
-                plot_footprint(
-                    my_cluster, data_lfp_mask, hpx_meta, 
-                    pmem_cfg['bkg_specs']['radius_min_mpc'], 
-                    pmem_cfg['bkg_specs']['radius_max_mpc'], 
-                    pmem_cfg['weighted_coverfrac_specs']['radius_mpc'],
-                    bkg_wmask_cfc, cl_cfc, cl_wcfc,
-                    os.path.join(
-                        workdir, 
-                        path['plots'], 
-                        'footprint_with_clmask_cl'+str(idcl)+'.png'
-                    )
-                )
-
-        # start feeding richness table 
-        data_richness['raw_coverfrac'][i] = round(100.*cl_cfc, 1)
-        data_richness['weighted_coverfrac'][i] = round(100.*cl_wcfc, 1)
-        data_richness['bkg_raw_coverfrac'][i] = round(100.*bkg_cfc, 1)
-        data_richness['bkg_coverfrac'][i] = round(100.*bkg_wmask_cfc, 1)
+    # start feeding richness table 
+    data_richness['raw_coverfrac'][i] = round(100.*cl_cfc, 1)
+    data_richness['weighted_coverfrac'][i] = round(100.*cl_wcfc, 1)
+    data_richness['bkg_raw_coverfrac'][i] = round(100.*bkg_cfc, 1)
+    data_richness['bkg_coverfrac'][i] = round(100.*bkg_wmask_cfc, 1)
 
-        if 100.*cl_wcfc < pmem_cfg['global_conditions']['cl_cover_min']:
-            data_richness['flag_pmem'][i] = 3
-            continue
+    if 100.*cl_wcfc < pmem_cfg['global_conditions']['cl_cover_min']:
+        data_richness['flag_pmem'][i] = 3
+        return data_richness[i:i+1], None, None
 
-        if 100.*bkg_wmask_cfc < pmem_cfg['global_conditions']['bkg_cover_min']:
-            data_richness['flag_pmem'][i] = 4
-            continue
+    if 100.*bkg_wmask_cfc < pmem_cfg['global_conditions']['bkg_cover_min']:
+        data_richness['flag_pmem'][i] = 4
+        return data_richness[i:i+1], None, None
 
+    data_richness, data_members = pmem_1cluster(
+        i, pmem_cfg, my_cluster, lfp_lut, lfp_mask_lut, hpx_meta, 
+        data_lgal, galcat, bkg_area_deg2, cosmo_params, out_paths, 
+        data_richness, verbose
+    )
 
-        data_richness, data_members = pmem_1cluster(
-            i, pmem_cfg, my_cluster, data_lfp, data_lfp_mask, hpx_meta, 
-            data_lgal, galcat, bkg_area_deg2, cosmo_params, out_paths, 
-            data_richness, verbose
+    # in calib_dz mode produce list of galaxies in 1Mpc cylinders around clusters with SNR>SNRlim
+    data_for_calib = None
+    if (pmem_cfg['calib_dz']['mode'] and 
+        my_cluster['snr_cl']>pmem_cfg['calib_dz']['snr_min']): 
+        data_for_calib = prepare_data_calib_dz(
+            my_cluster, pmem_cfg, hpx_meta, data_gal, galcat['keys']
         )
 
-        # concatenate data_members 
-        if data_members is not None:
-            if flag_init_members == 0:
-                data_members_tile  = np.copy(data_members)
-                flag_init_members = 1
-            else:
-                data_members_tile = np.hstack(
-                    (data_members_tile,  data_members)
-                )
+    return data_richness[i:i+1], data_members, data_for_calib
 
-        # in calib_dz mode produce list of galaxies in 1Mpc cylinders around clusters with SNR>SNRlim
-        if (pmem_cfg['calib_dz']['mode'] and 
-            my_cluster['snr_cl']>pmem_cfg['calib_dz']['snr_min']): 
-            data_for_calib = prepare_data_calib_dz(
-                my_cluster, pmem_cfg, hpx_meta, data_gal, galcat['keys']
-            )
-            if data_for_calib is not None:
-                if flag_init_calib == 0:
-                    data_for_calib_tile  = np.copy(data_for_calib)
-                    flag_init_calib = 1
-                else:
-                    data_for_calib_tile  = np.hstack(
-                        (data_for_calib_tile,  data_for_calib)
-                    )
-            # write calib file 
-            t = Table (data_for_calib_tile)
-            t.write(
-                os.path.join(
-                    workdir, 
-                    pmem_cfg['calib_dz']['filename']
-                ),
-                overwrite=True
-            )
 
-    return data_richness, data_members_tile
+# tile inputs shared by the forked cluster workers (set by pmem_tile_clusters)
+_cluster_args = None 
+
+
+def pmem_tile_cluster_forked(i):
+    return pmem_tile_cluster(i, *_cluster_args)
+
+
+def pmem_tile_clusters(ncls, cluster_args, pmem_cfg):
+    """
+    Runs pmem_tile_cluster on the ncls clusters of a tile, 
+    sequentially or on pmem_cfg['nthreads_clusters'] forked processes 
+    that share the tile galaxies / footprint read-only. 
+    Results are returned in cluster order. 
+    """
+    global _cluster_args
+    nworkers = min(int(pmem_cfg['nthreads_clusters']), ncls)
+    if nworkers <= 1:
+        return [pmem_tile_cluster(i, *cluster_args) for i in range(ncls)]
+
+    _cluster_args = cluster_args
+    try:
+        with ProcessPoolExecutor(
+                max_workers=nworkers, 
+                mp_context=multiprocessing.get_context('fork')
+        ) as executor:
+            clusters_out = list(
+                executor.map(pmem_tile_cluster_forked, range(ncls))
+            )
+    finally:
+        _cluster_args = None
+    return clusters_out
 
 
 def pmem_list(pmem_cfg, data_cls_analysis, data_cls_all, clcat_keys,
@@ -2448,23 +2510,26 @@ def pmem_list(pmem_cfg, data_cls_analysis, data_cls_all, clcat_keys,
             data_richness['flag_pmem'][i] = 3
             continue
         data_lfp = local_footprint(
-            my_cluster, data_fp, hpx_meta, pmem_cfg['bkg_specs'])
+            my_cluster, footprint_lut(data_fp, hpx_meta), hpx_meta, 
+            pmem_cfg['bkg_specs'])
+        lfp_lut = footprint_lut(data_lfp, hpx_meta)
         data_lfp_mask, ncl_masked = footprint_with_cl_masks(
             my_cluster, data_cls_all, clcat_keys, 
-            pmem_cfg['periphery_specs'], data_lfp, hpx_meta
+            pmem_cfg['periphery_specs'], lfp_lut, hpx_meta
         ) 
+        lfp_mask_lut = footprint_lut(data_lfp_mask, hpx_meta)
         if verbose>=1:
             print ('    Nr of masked clusters in periphery : ', ncl_masked)
  
         # test cluster and bkg coverage
         cl_cfc, cl_wcfc = compute_cl_coverfracs(
             my_cluster, pmem_cfg['weighted_coverfrac_specs'], 
-            data_lfp, hpx_meta, cosmo_params
+            lfp_lut, hpx_meta, cosmo_params
         )
 
         bkg_cfc, bkg_wmask_cfc, bkg_area_deg2 = compute_bkg_coverfracs(
             pmem_cfg['bkg_specs'], my_cluster, 
-            data_lfp, data_lfp_mask, hpx_meta
+            lfp_lut, lfp_mask_lut, hpx_meta
         )
 
         if verbose>=1: 
@@ -2516,7 +2581,7 @@ def pmem_list(pmem_cfg, data_cls_analysis, data_cls_all, clcat_keys,
             continue
 
         data_richness, data_members = pmem_1cluster(
-            i, pmem_cfg, my_cluster, data_lfp, data_lfp_mask, hpx_meta, 
+            i, pmem_cfg, my_cluster, lfp_lut, lfp_mask_lut, hpx_meta, 
             data_lgal, galcat, bkg_area_deg2, cosmo_params, out_paths, 
             data_richness, verbose
         )
@@ -2536,6 +2601,8 @@ def pmem_list(pmem_cfg, data_cls_analysis, data_cls_all, clcat_keys,
 def pmem_1cluster(cl_index, pmem_cfg, my_cluster, data_fp, data_fp_mask, 
                   footprint, data_gal, galcat, bkg_area_deg2,
                   cosmo_params, out_paths, data_richness, verbose):
+    # data_fp / data_fp_mask : footprint_lut of the cluster field 
+    # without / with the masks of the neighbouring clusters 
 
     workdir, path = out_paths['workdir_loc'], out_paths['pmem']
     data_members = None
@@ -2719,7 +2786,7 @@ def tile_radius_pmem(admin, pmem_cfg, cosmo_params):
 
     if not admin['target_mode']:
 
-        cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+        cosmo = cosmology(cosmo_params)
         frame_mpc = pmem_cfg['bkg_specs']['radius_max_mpc']
         zmin = pmem_cfg['global_conditions']['zcl_min']
         conv_factor = cosmo.angular_diameter_distance(zmin)# radian*conv=mpc    
@@ -2733,67 +2800,125 @@ def tile_radius_pmem(admin, pmem_cfg, cosmo_params):
     return tile_radius
 
 
-def eff_tiles_for_pmem(data_cls, clcat, tiles, admin):
-    flag = np.zeros(len(tiles))
+def nclusters_in_tiles(data_cls, clcat, tiles):
+    # nr of clusters handled by pmem in each tile 
+    ncls = np.zeros(len(tiles), dtype=int)
     for it in range(0, len(tiles)):
         #tile_radius_deg = tile_radius_pmem(admin['tiling'])
         #tile_specs = create_tile_specs(
         #    tiles[it], tile_radius_deg, admin, -1., -1., None, None
         #)
         data_cls_tile = filter_hpx_tile(data_cls, clcat, tiles[it]) #tile_specs)
-        if len(data_cls_tile)>0:
-            flag[it] = 1
-    return tiles[flag==1]
+        ncls[it] = len(data_cls_tile)
+    return ncls
+
+
+def pmem_tiles_info(out_paths, tiles, outfile):
+    # gather pmem tile recaps (timings) for the pmem cost model
+    # (merged per tile with the timed records already in outfile)
+    tiles_info = []
+    for it in range(0, len(tiles)):
+        info_file = os.path.join(
+            tile_dir_name(out_paths['workdir'], int(tiles['id'][it])), 
+            out_paths['pmem']['results'], "tile_info.fits"
+        )
+        if os.path.isfile(info_file):
+            tiles_info.append(read_stage_table(info_file))
+    if len(tiles_info) > 0:
+        merge_tiles_info(tiles_info, outfile)
+    return
+
+
+def eff_tiles_for_pmem(data_cls, clcat, tiles, admin):
+    ncls = nclusters_in_tiles(data_cls, clcat, tiles)
+    return tiles[ncls>0]
 
 
 def run_pmem_tile(config, dconfig, thread_id):
-    # read config file
-    with open(config) as fstream:
-        param_cfg = yaml.load(fstream)
-    with open(dconfig) as fstream:
-        param_data = yaml.load(fstream)
+    # all tiles of a static thread group
+    run_pmem_tiles(config, dconfig, 'thread_id', thread_id)
+    return
+
+
+def run_pmem_1tile(config, dconfig, tile_id):
+    # single tile - entry point of the tile pool 
+    run_pmem_tiles(config, dconfig, 'id', tile_id)
+    return
+
+
+def pmem_tile_tasks(param_cfg, param_data, tiles):
+    # read_tile_data arguments of pmem in tiles 
+    survey = param_cfg['survey']
+    tile_radius_deg = tile_radius_pmem(
+        param_cfg['admin'], param_cfg['pmem_cfg'], param_cfg['cosmo_params']
+    )
+    tasks = []
+    for it in range(0, len(tiles)):
+        tile_dir = tile_dir_name(
+            param_cfg['out_paths']['workdir'], int(tiles['id'][it])
+        )
+        create_directory(tile_dir)
+        tasks.append((param_data['galcat'][survey], 
+                      param_data['footprint'][survey], 
+                      tiles[it], tile_radius_deg, param_cfg['maglim_pmem'], 
+                      tile_dir, param_cfg['tile_cache']))
+    return tasks
+
+
+def prefetch_pmem_1tile(config, dconfig, tile_id):
+    # background read of a tile a queue worker will likely claim next
+    ctx = get_run_context(config, dconfig, required=('tiles', 'data_cls'))
+    admin = ctx['param_cfg']['admin']
+    if admin['prefetch']['ntiles'] <= 0:
+        return
+    tiles = ctx['tiles'][ctx['tiles']['id'] == int(tile_id)]
+    prefetch_next_tile(
+        pmem_tile_tasks(ctx['param_cfg'], ctx['param_data'], tiles)[0], 
+        admin['prefetch']['mem_budget_gb']
+    )
+    return
+
+
+def run_pmem_tiles(config, dconfig, tile_key, tile_value):
+    # configs + survey level inputs of the run 
+    ctx = get_run_context(
+        config, dconfig, required=('tiles', 'data_cls')
+    )
+    param_cfg, param_data = ctx['param_cfg'], ctx['param_data']
 
     survey, ref_filter  = param_cfg['survey'], param_cfg['ref_filter']
-    maglim = param_cfg['maglim_pmem']
     galcat = param_data['galcat'][survey]
     clcat = param_data['clcat'][param_cfg['clusters']]
-    out_paths = param_cfg['out_paths']
+    out_paths = dict(param_cfg['out_paths']) # locally updated 
     admin = param_cfg['admin']
     footprint = param_data['footprint'][survey]
     zp_metrics = param_data['zp_metrics'][survey][ref_filter]
     magstar_file = param_data['magstar_file'][survey][ref_filter]
     workdir = out_paths['workdir']
-    data_cls = read_FitsCat(param_data['clcat'][param_cfg['clusters']]['cat'])
-    all_tiles = read_FitsCat(
-        os.path.join(workdir, admin['tiling']['tiles_filename'])
+    data_cls = ctx['data_cls']
+    all_tiles = ctx['tiles']
+    tiles = all_tiles[(all_tiles[tile_key]==int(tile_value))]    
+    print (tile_key, ' = ', int(tile_value))
+    tile_pmem_hash = pmem_hash(param_cfg, param_data)
+
+    # only tiles with clusters are read (next ones in background)
+    tiles = tiles[nclusters_in_tiles(data_cls, clcat, tiles) > 0]
+    tile_radius_deg = tile_radius_pmem(
+        admin, param_cfg['pmem_cfg'], param_cfg['cosmo_params']
+    )
+    tiles_data = prefetch_tile_data(
+        pmem_tile_tasks(param_cfg, param_data, tiles), 
+        admin['prefetch']['ntiles'], admin['prefetch']['mem_budget_gb']
     )
-    tiles = all_tiles[(all_tiles['thread_id']==int(thread_id))]    
-    print ('THREAD ', int(thread_id))
 
-    # select correct magnitude 
     for it in range(0, len(tiles)):
-        tile_dir = os.path.join(
-            workdir, 
-            'tiles', 
-            'tile_'+str(int(tiles['id'][it])).zfill(3)
-        )
+        (data_gal_tile, data_fp_tile), read_time = next(tiles_data)
+        t0 = time.time() - read_time
+        tile_dir = tile_dir_name(workdir, int(tiles['id'][it]))
         print ('..... Tile ', int(tiles['id'][it]))
 
-        create_directory(tile_dir)
         create_pmem_directories(tile_dir, out_paths['pmem'])
         out_paths['workdir_loc'] = tile_dir # local update 
-        tile_radius_deg = tile_radius_pmem(
-            admin, param_cfg['pmem_cfg'], param_cfg['cosmo_params']
-        )
-        data_gal_tile = read_mosaicFitsCat_in_disc(
-            galcat, tiles[it], tile_radius_deg
-        )   
-        data_gal_tile = data_gal_tile\
-                        [data_gal_tile[galcat['keys']['key_mag']]<=maglim]
-
-        data_fp_tile = read_mosaicFootprint_in_disc(
-            footprint, tiles[it], tile_radius_deg
-        )
         tile_specs = create_tile_specs(
             tiles[it], 
             tile_radius_deg, admin, 
@@ -2813,13 +2938,10 @@ def run_pmem_tile(config, dconfig, thread_id):
         '''
 
         if len(data_cls_tile) > 0:
-            if not os.path.isfile(
-                    os.path.join(
-                        tile_dir, 
-                        out_paths['pmem']['results'], 
-                        "richness.fits"
-                    )
-            ):
+            out_paths['stage_hash'] = stage_hash(
+                tile_pmem_hash, int(tiles['id'][it])
+            )
+            if not stage_done(tile_dir, 'pmem', out_paths['stage_hash']):
                 data_richness, data_members = pmem_tile(
                     param_cfg['pmem_cfg'], 
                     data_cls_tile, data_cls, clcat['keys'], 
@@ -2830,25 +2952,62 @@ def run_pmem_tile(config, dconfig, thread_id):
                 )
 
                 # write outputs to fits
-                t = Table (data_richness)#, names=names)
-                t.write(
+                write_table(
                     os.path.join(
                         tile_dir, 
                         out_paths['pmem']['results'], 
                         "richness.fits"
-                    ),overwrite=True
+                    ), data_richness, artifact=True
                 )
-                t = Table (data_members)#, names=names)
-                t.write(
+                write_table(
                     os.path.join(
                         tile_dir, 
                         out_paths['pmem']['results'], 
                         "pmem.fits"
-                    ),overwrite=True
+                    ), data_members, artifact=True
+                )
+                # tile recap for the pmem cost model 
+                tile_info = np.zeros(
+                    1, dtype={'names':('id', 'Nclusters', 'Ngal', 
+                                       'resumed', 'wall_time_s'),
+                              'formats':('i8', 'i8', 'i8', 'bool', 'f8')}
                 )
+                tile_info['id'] = tiles['id'][it]
+                tile_info['Nclusters'] = len(data_cls_tile)
+                tile_info['Ngal'] = len(data_gal_tile)
+                tile_info['wall_time_s'] = time.time() - t0
+                write_table(
+                    os.path.join(
+                        tile_dir, 
+                        out_paths['pmem']['results'], 
+                        "tile_info.fits"
+                    ), tile_info
+                )
+                commit_stage(tile_dir, 'pmem', out_paths['stage_hash'])
     return
 
 
+def pmem_hash(param_cfg, param_data):
+    """
+    Hash of all parameters and inputs pmem in a tile depends on 
+    (execution only keys and verbosity excluded)
+    """
+    survey, ref_filter  = param_cfg['survey'], param_cfg['ref_filter']
+    galcat = param_data['galcat'][survey]
+    footprint = param_data['footprint'][survey]
+    clcat = param_data['clcat'][param_cfg['clusters']]
+    return stage_hash(
+        config_section(param_cfg['pmem_cfg']), param_cfg['cosmo_params'], 
+        param_cfg['admin']['tiling'], param_cfg['maglim_pmem'], 
+        clcat, galcat, footprint, 
+        param_data['zp_metrics'][survey][ref_filter],
+        file_hash(clcat['cat']), 
+        file_hash(param_data['magstar_file'][survey][ref_filter]), 
+        dir_signature(galcat['mosaic']['dir']), 
+        dir_signature(footprint['mosaic']['dir'])
+    )
+
+
 def run_pmem_list(data_cls, config, dconfig, thread_id):
     # read config file
     with open(config) as fstream:
@@ -2933,7 +3092,8 @@ def concatenate_calib_dz(all_tiles, pmem_cfg, workdir, calib_file):
     return data_calib
 
 
-def pmem_concatenate_tiles(all_tiles, out_paths, rich_file, pmem_file):
+def pmem_concatenate_tiles(all_tiles, out_paths, rich_file, pmem_file, 
+                           nthreads=1):
     # concatenate all tiles 
     print ('Concatenate Pmems')
     list_clusters = []
@@ -2948,16 +3108,22 @@ def pmem_concatenate_tiles(all_tiles, out_paths, rich_file, pmem_file):
         list_members.append(
             os.path.join(tile_dir, out_paths['pmem']['results'])
         )
-    data_richness = concatenate_clusters(
-        list_clusters, 'richness.fits', rich_file
-    ) 
-    data_members  = concatenate_clusters(
-        list_members, 'pmem.fits', pmem_file
+    # streamed to disk, the members are returned memory mapped
+    concatenate_fits_stream(
+        [os.path.join(d, 'richness.fits') for d in list_clusters], 
+        rich_file, nthreads
+    )
+    concatenate_fits_stream(
+        [os.path.join(d, 'pmem.fits') for d in list_members], 
+        pmem_file, nthreads
     )
+    data_richness = np.copy(read_FitsCat(rich_file))
+    data_members = read_FitsCat(pmem_file)
     return data_richness, data_members
 
 
-def pmem_concatenate_threads(all_tiles, out_paths, rich_file, pmem_file):
+def pmem_concatenate_threads(all_tiles, out_paths, rich_file, pmem_file, 
+                             nthreads=1):
     # concatenate all tiles 
     print ('Concatenate Pmems')
     list_clusters = []
@@ -2972,12 +3138,17 @@ def pmem_concatenate_threads(all_tiles, out_paths, rich_file, pmem_file):
         list_members.append(
             os.path.join(tile_dir, out_paths['pmem']['results'])
         )
-    data_richness = concatenate_clusters(
-        list_clusters, 'richness.fits', rich_file
-    ) 
-    data_members  = concatenate_clusters(
-        list_members, 'pmem.fits', pmem_file
-)
+    # streamed to disk, the members are returned memory mapped
+    concatenate_fits_stream(
+        [os.path.join(d, 'richness.fits') for d in list_clusters], 
+        rich_file, nthreads
+    )
+    concatenate_fits_stream(
+        [os.path.join(d, 'pmem.fits') for d in list_members], 
+        pmem_file, nthreads
+    )
+    data_richness = np.copy(read_FitsCat(rich_file))
+    data_members = read_FitsCat(pmem_file)
     return data_richness, data_members
 
 
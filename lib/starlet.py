@@ -0,0 +1,217 @@
+import numpy as np
+import math
+from functools import lru_cache
+from astropy.io import fits
+
+# intensities (events / pixel) of the few events detection levels,
+# gaussian levels above
+FEW_EVENTS_LAMBDA = np.logspace(-4., 3., 36)
+
+
+def b3_pass(image, step, axis):
+    # 1D B3 spline smoothing (1, 4, 6, 4, 1)/16 with 2**j - 1 holes along 
+    # axis (a trous algorithm) as 5 shifted sums, the holes of the kernel 
+    # are not multiplied, mirror border as ndi 'mirror' 
+    n = image.shape[axis]
+    pad = [(0, 0)]*image.ndim
+    pad[axis] = (2*step, 2*step)
+    ext = np.pad(image, pad, mode='reflect')
+    def shifted(k): # view
+        index = [slice(None)]*image.ndim
+        index[axis] = slice(k*step, k*step+n)
+        return ext[tuple(index)]
+    out = shifted(1) + shifted(3)
+    out *= 4.
+    out += shifted(0)
+    out += shifted(4)
+    out += 6.*shifted(2)
+    out /= 16.
+    return out
+
+
+def smooth_b3(image, j):
+    # B3 spline smoothing with 2**j - 1 holes (separable, mirror border)
+    return b3_pass(b3_pass(image, 2**j, -2), 2**j, -1)
+
+
+def starlet_transform(image, nscales):
+    """
+    Starlet transform of image : nscales-1 wavelet scales
+    w_j = c_j - c_j+1 (c_0 = image) and the last smoothed
+    image c_nscales-1. image = sum of all the planes.
+    """
+    planes = []
+    c = np.asarray(image)
+    for j in range(0, nscales-1):
+        c1 = smooth_b3(c, j)
+        planes.append(c - c1)
+        c = c1
+    planes.append(c)
+    return planes
+
+
+@lru_cache(maxsize=None)
+def starlet_wavelets(nscales):
+    # wavelet function of each scale (transform of a dirac)
+    n = 8 * 2**nscales + 1
+    dirac = np.zeros((n, n))
+    dirac[n//2, n//2] = 1.
+    return tuple(starlet_transform(dirac, nscales)[:-1])
+
+
+@lru_cache(maxsize=None)
+def starlet_norms(nscales):
+    # l2 norm of the wavelet function at each scale 
+    return tuple(math.sqrt(np.sum(p**2)) for p in starlet_wavelets(nscales))
+
+
+def few_events_level(psi, lam, nsig, npts=2**15):
+    """
+    Detection level of a wavelet coefficient for a Poisson intensity
+    lam (events / pixel) : the coefficient is a compound Poisson sum
+    of the values of the wavelet function psi (one per event), whose
+    distribution (autoconvolutions of the histogram of psi) is
+    computed on a lattice of npts values by FFT. Returns the level
+    above which a coefficient has the probability of a nsig gaussian
+    deviation. Falls back to the gaussian level nsig x sqrt(lam) x
+    norm when many events make the lattice too coarse and for
+    nsig > 5 (probabilities below the FFT precision).
+    """
+    psi = psi[psi != 0.]
+    sigma = math.sqrt(lam * np.sum(psi**2))
+    half = (nsig + 10.) * sigma + 3. * np.max(np.abs(psi))
+    dw = 2. * half / npts
+    if nsig > 5. or dw > np.max(np.abs(psi)) / 100.:
+        return nsig * sigma
+    hist = np.bincount(
+        np.round(psi / dw).astype(int) % npts, minlength=npts
+    )
+    pmf = np.fft.fftshift(np.real(np.fft.ifft(
+        np.exp(lam * (np.fft.fft(hist) - len(psi)))
+    )))
+    tail = np.cumsum(np.maximum(pmf, 0.)[::-1])[::-1] # P(w >= value)
+    values = (np.arange(npts) - npts//2) * dw
+    p = 0.5 * math.erfc(nsig / math.sqrt(2.))
+    return values[np.argmax(tail <= p)] - 0.5*dw
+
+
+@lru_cache(maxsize=None)
+def few_events_levels(nscales, nsig):
+    # levels of the wavelet scales on the FEW_EVENTS_LAMBDA grid
+    return tuple(
+        np.array([few_events_level(psi, lam, nsig_j) 
+                  for lam in FEW_EVENTS_LAMBDA])
+        for psi, nsig_j in zip(starlet_wavelets(nscales), nsig)
+    )
+
+
+def detection_level(c, j, nscales, nsig):
+    """
+    Detection levels of the coefficients of scale j given the local
+    intensity c (next smoothed plane) : few events levels interpolated
+    in log intensity up to the last FEW_EVENTS_LAMBDA, gaussian above.
+    """
+    lam = np.clip(c, FEW_EVENTS_LAMBDA[0], None)
+    level = np.interp(
+        np.log(lam), np.log(FEW_EVENTS_LAMBDA), 
+        few_events_levels(nscales, nsig)[j]
+    )
+    high = lam > FEW_EVENTS_LAMBDA[-1]
+    level[high] = nsig[j] * np.sqrt(lam[high]) * starlet_norms(nscales)[j]
+    return level.astype(c.dtype, copy=False)
+
+
+def starlet_nsigma(wazp_cfg, nscales):
+    """
+    Detection levels of the wavelet scales : scales finer than
+    scale_min_mpc get 10 sigma (i.e. practically removed) and the
+    others 3 sigma, as in the mr_filter -s options used by wazp.
+    """
+    smin = int(round(math.log10(
+        wazp_cfg['scale_min_mpc'] * float(wazp_cfg['resolution'])
+    )/math.log10(2.)))
+    nsig = [10.]*smin + [3., 3.]
+    return (nsig + [nsig[-1]]*nscales)[:nscales-1]
+
+
+def starlet_nscales(wazp_cfg):
+    # smax + 1 as for mr_filter -n
+    smax = int(round(math.log10(
+        wazp_cfg['scale_max_mpc'] * float(wazp_cfg['resolution'])
+    )/math.log10(2.)))
+    return smax + 1
+
+
+def starlet_filter(image, wazp_cfg, niter=3, dtype=float):
+    """
+    In memory equivalent of the mr_filter call of wazp
+    (-m 10 -i 3 -s ... -n smax+1 -f 3 -K -C 2 -p -e0 -A) :
+    - starlet transform with smax+1 scales,
+    - multiresolution support of the significant positive
+      coefficients. As for -m 10 (Poisson noise with few events), the
+      detection level of scale j at a pixel is the one of the
+      distribution of the coefficients for the local intensity lambda
+      given by the next smoothed plane (few_events_level, gaussian
+      nsig x sqrt(lambda) x norm_j for large lambda). Intensities
+      below 1.e-4 events / pixel take the level of 1.e-4 (-e0 : no
+      minimum number of events),
+    - niter iterations of the thresholded reconstruction of the
+      residual (-f 3 -i 3 -e0), positive solution (-p), last smooth
+      plane removed (-K).
+    Returns the filtered map with the orientation of image, computed
+    in dtype.
+    """
+    nscales = starlet_nscales(wazp_cfg)
+    nsig = tuple(starlet_nsigma(wazp_cfg, nscales))
+    image = np.asarray(image, dtype=dtype)
+
+    planes = starlet_transform(image, nscales)
+    support = []
+    c = image
+    for j in range(0, nscales-1):
+        c = c - planes[j] # c_j+1
+        support.append(planes[j] > detection_level(c, j, nscales, nsig))
+
+    solution = np.zeros_like(image)
+    for it in range(0, niter):
+        planes = starlet_transform(image - solution, nscales)
+        for j in range(0, nscales-1):
+            solution += planes[j] * support[j]
+        np.maximum(solution, 0., out=solution)
+    return solution
+
+
+def compare_with_mr_filter(xycat_fi_fitsname, wmap_fitsname, wazp_cfg,
+                           min_distance=8):
+    """
+    Regression of starlet_filter against an mr_filter output :
+    filters the input image of mr_filter (xycat_fi_<isl>.fits) and
+    compares with its wavelet map (wmap_<isl>.fits). Returns the
+    relative l2 difference of the maps, the fraction of the mr_filter
+    peaks above wmap_thresh found within 2 pixels and the fraction of
+    the starlet peaks with no mr_filter peak within 2 pixels.
+    """
+    from skimage.feature import peak_local_max
+
+    image = fits.getdata(xycat_fi_fitsname).astype(float)
+    ref = fits.getdata(wmap_fitsname, ignore_missing_end=True).astype(float)
+    wmap = starlet_filter(image, wazp_cfg, dtype=wazp_cfg['wavelet_dtype'])
+
+    rel_l2 = np.sqrt(np.sum((wmap-ref)**2) / max(np.sum(ref**2), 1.e-30))
+    peaks_ref = peak_local_max(ref, min_distance=min_distance)
+    peaks_ref = peaks_ref[
+        ref[peaks_ref[:, 0], peaks_ref[:, 1]] > wazp_cfg['wmap_thresh']
+    ]
+    peaks = peak_local_max(wmap, min_distance=min_distance)
+    peaks = peaks[wmap[peaks[:, 0], peaks[:, 1]] > wazp_cfg['wmap_thresh']]
+    if len(peaks_ref) == 0 or len(peaks) == 0:
+        return {'rel_l2':rel_l2, 'npeaks_ref':len(peaks_ref), 
+                'npeaks':len(peaks), 
+                'matched_frac':1. if len(peaks_ref) == 0 else 0.,
+                'spurious_frac':1. if len(peaks) > 0 else 0.}
+    d2 = np.sum((peaks_ref[:, None, :] - peaks[None, :, :])**2, axis=2)
+    matched = np.count_nonzero(np.min(d2, axis=1) <= 4)
+    spurious = np.count_nonzero(np.min(d2, axis=0) > 4)
+    return {'rel_l2':rel_l2, 'npeaks_ref':len(peaks_ref),
+            'npeaks':len(peaks), 'matched_frac':matched/len(peaks_ref),
+            'spurious_frac':spurious/len(peaks)}
@@ -2,7 +2,10 @@ import matplotlib
 import numpy as np
 import matplotlib.pyplot as plt
 import astropy.io.fits as fits
-import os, sys
+import os, sys, json, time, threading, zlib, shutil
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from astropy.cosmology.core import FlatLambdaCDM as flat
 from astropy import units as u
 from astropy.convolution import convolve,Gaussian1DKernel
@@ -12,6 +15,10 @@ from astropy.table import Table
 from scipy.optimize import least_squares
 from scipy import interpolate
 
+from .manifest import stage_hash, dir_signature, save_npy, write_table
+from .manifest import stage_done, commit_stage, atomic_path
+from .manifest import fresh_artifact, load_artifact
+
 
 
 def create_directory(dir):
@@ -25,21 +32,83 @@ def create_directory(dir):
     return
 
 
-def read_FitsCat(cat):
-    """_summary_
+def read_FitsCat(cat, columns=None):
+    """Reads the 1st extension of a fits table. If columns is given, 
+    only these columns are decoded from the memory mapped file into 
+    a (native byte order) structured array. 
 
     Args:
-        cat (_type_): _description_
+        cat (str): fits file
+        columns (list, optional): columns to read. Defaults to None (all).
 
     Returns:
-        _type_: _description_
+        FITS_rec or ndarray: table
     """
-    hdulist=fits.open(cat)
+    hdulist=fits.open(cat, memmap=True)
     dat=hdulist[1].data
+    if columns is not None:
+        fields = [dat.field(c) for c in columns]
+        out = np.empty(
+            len(dat), 
+            dtype=[(c, f.dtype.newbyteorder('='), f.shape[1:]) 
+                   for c, f in zip(columns, fields)]
+        )
+        for c, f in zip(columns, fields):
+            out[c] = f
+        dat = out
     hdulist.close()
     return dat
 
 
+def read_stage_table(cat):
+    """Reads a table written by a stage : its .npy artifact (memory 
+    mapped, see manifest.save_artifact) if it is up to date, else 
+    the fits file. 
+
+    Args:
+        cat (str): fits file
+
+    Returns:
+        ndarray or FITS_rec: table
+    """
+    twin = fresh_artifact(cat)
+    if twin is not None:
+        return load_artifact(twin)
+    return read_FitsCat(cat)
+
+
+def galcat_columns(galcat):
+    """Columns of the galaxy catalogs used by wazp / pmem
+
+    Args:
+        galcat (dict): galaxy catalog specs
+
+    Returns:
+        list: column names
+    """
+    keys = galcat['keys']
+    columns = [keys['key_id'], keys['key_ra'], keys['key_dec'], keys['key_zp']]
+    if isinstance(keys['key_mag'], dict): # before update_config
+        columns += list(keys['key_mag'].values())
+    else:
+        columns.append(keys['key_mag'])
+    return list(dict.fromkeys(columns))
+
+
+def footprint_columns(footprint):
+    """Columns of the footprint mosaics used by wazp / pmem
+
+    Args:
+        footprint (dict): footprint specs
+
+    Returns:
+        list: column names
+    """
+    if footprint['key_frac'] in (None, 'none', 'None'):
+        return [footprint['key_pixel']]
+    return [footprint['key_pixel'], footprint['key_frac']]
+
+
 def read_FitsFootprint(hpx_footprint, hpx_meta):
     """_summary_
 
@@ -62,6 +131,445 @@ def read_FitsFootprint(hpx_footprint, hpx_meta):
     return  hpix_map, frac_map
 
 
+def stream_FitsFootprint(hpx_footprint, hpx_meta, nrows):
+    """Same as read_FitsFootprint by chunks of nrows rows of the memory 
+    mapped file
+
+    Args:
+        hpx_footprint (str): survey footprint file
+        hpx_meta (dict): footprint specs
+        nrows (int): rows per chunk
+
+    Yields:
+        tuple: pixels and fracs of the chunk
+    """
+    with fits.open(hpx_footprint, memmap=True) as hdulist:
+        dat = hdulist[1].data
+        for i0 in range(0, len(dat), nrows):
+            chunk = dat[i0:i0+nrows]
+            hpix_map = chunk[hpx_meta['key_pixel']].astype(int)
+            if hpx_meta['key_frac'] == 'none':
+                frac_map = np.ones(len(hpix_map)).astype(float)
+            else:
+                frac_map = np.array(chunk[hpx_meta['key_frac']])
+            yield hpix_map, frac_map
+
+
+# mosaic indexes of this process, by mosaic directory
+_mosaic_indexes = {}
+
+
+def mosaic_file_entry(gdir, filename, hpix, Nside, nest):
+    """Index entry of a mosaic file : healpix pixel, nr. of rows, 
+    pixel center and radius, size, mtime and adler32 checksum
+
+    Args:
+        gdir (str): mosaic directory
+        filename (str): file name in gdir
+        hpix (int): healpix pixel of the file
+        Nside (int): Nside of the mosaic
+        nest (bool): nested ordering of the mosaic
+
+    Returns:
+        tuple: entry of the index
+    """
+    fullname = os.path.join(gdir, filename)
+    stat = os.stat(fullname)
+    checksum = 1
+    with open(fullname, 'rb') as fstream:
+        for block in iter(lambda: fstream.read(16*1024*1024), b''):
+            checksum = zlib.adler32(block, checksum)
+    ra, dec = hp.pix2ang(Nside, hpix, nest, lonlat=True)
+    return (
+        hpix, filename, fits.getheader(fullname, 1)['NAXIS2'], 
+        ra, dec, np.degrees(hp.max_pixrad(Nside)), 
+        stat.st_size, stat.st_mtime_ns, checksum
+    )
+
+
+def build_mosaic_index(mosaic, suffix, previous=None):
+    """Lists the files of a healpix mosaic (<hpix><suffix>.<ext>). 
+    Entries of previous with unchanged size / mtime are reused. 
+
+    Args:
+        mosaic (dict): galcat['mosaic'] or footprint['mosaic']
+        suffix (str): '' for galcats, '_footprint' for footprints
+        previous (ndarray, optional): previous index. Defaults to None.
+
+    Returns:
+        ndarray: index sorted by pixel
+    """
+    gdir = mosaic['dir']
+    known = {}
+    if previous is not None:
+        known = {
+            str(f):i for i, f in enumerate(previous['filename'])
+        }
+    entries = []
+    for filename in sorted(os.listdir(gdir)):
+        root = os.path.splitext(filename)[0]
+        if not root.endswith(suffix) or \
+           not root[:len(root)-len(suffix)].isdigit():
+            continue
+        stat = os.stat(os.path.join(gdir, filename))
+        if filename in known and \
+           previous['size'][known[filename]] == stat.st_size and \
+           previous['mtime_ns'][known[filename]] == stat.st_mtime_ns:
+            entries.append(tuple(previous[known[filename]]))
+        else:
+            entries.append(
+                mosaic_file_entry(
+                    gdir, filename, int(root[:len(root)-len(suffix)]), 
+                    mosaic['Nside'], mosaic['nest']
+                )
+            )
+    index = np.array(
+        entries, 
+        dtype={'names':('hpix', 'filename', 'nrows', 'ra', 'dec', 
+                        'radius_deg', 'size', 'mtime_ns', 'checksum'),
+               'formats':('i8', 'U256', 'i8', 'f8', 'f8', 
+                          'f8', 'i8', 'i8', 'i8')}
+    )
+    return index[np.argsort(index['hpix'], kind='stable')]
+
+
+def index_files_unchanged(gdir, index):
+    """True if the files of a mosaic index still have the size and 
+    mtime of their entries (a file rewritten in place does not change 
+    the directory signature, and its checksum must not be trusted) 
+
+    Args:
+        gdir (str): mosaic directory
+        index (ndarray): mosaic index
+
+    Returns:
+        bool: all the entries up to date
+    """
+    for entry in index:
+        try:
+            stat = os.stat(os.path.join(gdir, str(entry['filename'])))
+        except FileNotFoundError:
+            return False
+        if stat.st_size != entry['size'] or \
+           stat.st_mtime_ns != entry['mtime_ns']:
+            return False
+    return True
+
+
+def mosaic_index(mosaic, suffix=''):
+    """Index of the files of a healpix mosaic (see build_mosaic_index), 
+    used by all the mosaic readers instead of listing the directory. 
+    It is kept in memory and, if mosaic['index'] is given, stored in 
+    this file to be shared between processes and runs. 
+    It is refreshed when the mosaic directory changes (files added, 
+    removed or renamed) or when a file changes size / mtime (rewritten 
+    in place) : only the entries of the changed files are recomputed. 
+
+    Args:
+        mosaic (dict): galcat['mosaic'] or footprint['mosaic']
+        suffix (str, optional): file name suffix. Defaults to ''.
+
+    Returns:
+        ndarray: index sorted by pixel
+    """
+    gdir = mosaic['dir']
+    signature = dir_signature(gdir)
+    if gdir in _mosaic_indexes and \
+       _mosaic_indexes[gdir][0] == signature and \
+       index_files_unchanged(gdir, _mosaic_indexes[gdir][1]):
+        return _mosaic_indexes[gdir][1]
+
+    index_file = mosaic.get('index')
+    previous = None
+    if index_file is not None and os.path.isfile(index_file):
+        t = Table.read(index_file, character_as_bytes=False)
+        previous = t.as_array()
+        stored_dir, stored_signature = t.meta['MOSDIR'], t.meta['DIRSIG']
+        if stored_dir == os.path.abspath(gdir) and \
+           stored_signature == signature and \
+           index_files_unchanged(gdir, previous):
+            _mosaic_indexes[gdir] = (signature, previous)
+            return previous
+        if stored_dir != os.path.abspath(gdir):
+            previous = None
+
+    index = build_mosaic_index(mosaic, suffix, previous)
+    if index_file is not None:
+        t = Table(index)
+        t.meta['MOSDIR'] = os.path.abspath(gdir)
+        t.meta['DIRSIG'] = signature
+        write_table(index_file, t)
+    _mosaic_indexes[gdir] = (signature, index)
+    return index
+
+
+def mosaic_columns(cat):
+    # columns used by wazp / pmem of a galcat or footprint mosaic 
+    if 'key_pixel' in cat:
+        return footprint_columns(cat)
+    return galcat_columns(cat)
+
+
+def mosaic_suffix(cat):
+    # file name suffix of a galcat or footprint mosaic 
+    if 'key_pixel' in cat:
+        return '_footprint'
+    return ''
+
+
+def mosaic_centers(cat, dat):
+    # ra, dec of galaxies or of footprint pixels 
+    if 'key_pixel' in cat:
+        return hp.pix2ang(
+            cat['Nside'], dat[cat['key_pixel']], cat['nest'], lonlat=True
+        )
+    return dat[cat['keys']['key_ra']], dat[cat['keys']['key_dec']]
+
+
+def npy_dtype(cat, column, dtype):
+    """dtype of a column in the .npy cache : float32 for the 
+    magnitudes and photo-zs of galcats, native byte order otherwise
+
+    Args:
+        cat (dict): galcat or footprint specs
+        column (str): column name
+        dtype (dtype): dtype in the fits file
+
+    Returns:
+        dtype: cache dtype
+    """
+    if 'key_pixel' in cat:
+        return dtype.newbyteorder('=')
+    keys = cat['keys']
+    mags = keys['key_mag'].values() if isinstance(keys['key_mag'], dict) \
+           else [keys['key_mag']]
+    if column == keys['key_zp'] or column in mags:
+        return np.dtype('f4')
+    return dtype.newbyteorder('=')
+
+
+def npy_sort_nside(cat):
+    # Nside of the NEST index rows are sorted by in the cache (or None) 
+    nside = cat['mosaic'].get('npy_sort_nside')
+    if nside in (None, 'None'):
+        return None
+    return int(nside)
+
+
+def npy_file_dir(cat, entry):
+    # cache directory of a mosaic file (entry of mosaic_index)
+    return os.path.join(cat['mosaic']['npy_cache'], str(entry['hpix']))
+
+
+def npy_file_hash(cat, entry):
+    # the cache of a file depends on its content and on the sorting 
+    return stage_hash(int(entry['checksum']), npy_sort_nside(cat))
+
+
+def mosaic_file_to_npy(cat, entry):
+    """Converts a galcat / footprint mosaic file (entry of mosaic_index) 
+    into one .npy file per column. If cat['mosaic']['npy_sort_nside'] 
+    is given, rows are sorted by their NEST pixel at this Nside and 
+    the pixels / first rows are stored in sort_hpix.npy and 
+    sort_offsets.npy (see rows_in_disc). 
+    Skipped if already done for the same file checksum and sorting. 
+
+    Args:
+        cat (dict): galcat or footprint specs
+        entry (np.void): mosaic index entry
+    """
+    pixdir = npy_file_dir(cat, entry)
+    if stage_done(pixdir, 'npy', npy_file_hash(cat, entry)):
+        return
+    create_directory(pixdir)
+    dat = read_FitsCat(
+        os.path.join(cat['mosaic']['dir'], str(entry['filename'])), 
+        columns=mosaic_columns(cat)
+    )
+    sort_nside = npy_sort_nside(cat)
+    if sort_nside is not None:
+        ra, dec = mosaic_centers(cat, dat)
+        hpix = hp.ang2pix(sort_nside, ra, dec, True, lonlat=True)
+        order = np.argsort(hpix, kind='stable')
+        dat, hpix = dat[order], hpix[order]
+        sort_hpix, first = np.unique(hpix, return_index=True)
+        save_npy(os.path.join(pixdir, 'sort_hpix.npy'), sort_hpix)
+        save_npy(
+            os.path.join(pixdir, 'sort_offsets.npy'), 
+            np.append(first, len(hpix)).astype('i8')
+        )
+    for c in dat.dtype.names:
+        save_npy(
+            os.path.join(pixdir, c+'.npy'), 
+            dat[c].astype(npy_dtype(cat, c, dat.dtype[c]))
+        )
+    commit_stage(pixdir, 'npy', npy_file_hash(cat, entry))
+    return
+
+
+def create_mosaic_npy_cache(cat, nthreads):
+    """Per pixel / per column .npy cache of a galcat or footprint 
+    mosaic in cat['mosaic']['npy_cache'], read instead of the fits 
+    files by the mosaic readers (see read_mosaic_file). Only new or 
+    modified files are converted. 
+
+    Args:
+        cat (dict): galcat (key_mag = all filters) or footprint specs 
+        nthreads (int): nr. of conversion threads
+    """
+    index = mosaic_index(cat['mosaic'], mosaic_suffix(cat))
+    os.makedirs(cat['mosaic']['npy_cache'], exist_ok=True)
+    print ('..... npy cache of ', cat['mosaic']['dir'], ' : ', 
+           len(index), ' files')
+    with ThreadPoolExecutor(max_workers=max(1, int(nthreads))) as executor:
+        list(executor.map(
+            lambda entry: mosaic_file_to_npy(cat, entry), index
+        ))
+    return
+
+
+def ranges_to_rows(first, last):
+    # row indices of the ranges [first, last[ 
+    n = last - first
+    return np.repeat(first - np.cumsum(n) + n, n) + np.arange(np.sum(n))
+
+
+def rows_in_disc(pixdir, sort_nside, racen, deccen, radius_deg):
+    """Rows of a NEST sorted cache file in the pixels intersecting 
+    a disc, as contiguous ranges. Rows of the pixels entirely inside 
+    the disc are returned apart since they do not need a distance test. 
+
+    Args:
+        pixdir (str): cache directory of the file
+        sort_nside (int): Nside of the sorting 
+        racen (float): disc center
+        deccen (float): disc center
+        radius_deg (float): disc radius
+
+    Returns:
+        tuple: rows inside the disc, rows of the boundary pixels
+    """
+    sort_hpix = np.load(os.path.join(pixdir, 'sort_hpix.npy'))
+    offsets = np.load(os.path.join(pixdir, 'sort_offsets.npy'))
+    vec = hp.ang2vec(racen, deccen, lonlat=True)
+    pixels = hp.query_disc(
+        sort_nside, vec, np.radians(radius_deg), inclusive=True, nest=True
+    )
+    # pixels with center closer than radius - pixel radius are inside 
+    radius_in = np.radians(radius_deg) - hp.max_pixrad(sort_nside)
+    inner = np.zeros(0, dtype=int)
+    if radius_in > 0.:
+        inner = hp.query_disc(sort_nside, vec, radius_in, nest=True)
+    k = np.searchsorted(sort_hpix, pixels)
+    found = k < len(sort_hpix)
+    found[found] = sort_hpix[k[found]] == pixels[found]
+    k, is_inner = k[found], np.isin(pixels[found], inner, assume_unique=True)
+    return ranges_to_rows(offsets[k[is_inner]], offsets[k[is_inner]+1]),\
+           ranges_to_rows(offsets[k[~is_inner]], offsets[k[~is_inner]+1])
+
+
+def read_mosaic_file(cat, entry, racen=None, deccen=None, radius_deg=None):
+    """Reads the used columns of a galcat / footprint mosaic file (entry 
+    of mosaic_index), from the .npy cache (memory mapped) if it exists 
+    and is up to date, from the fits file otherwise (then with the 
+    dtypes of the cache). If a disc is given, only the rows at less 
+    than radius_deg from (racen, deccen) are returned ; with a NEST 
+    sorted cache, only the rows of the pixels intersecting the disc are 
+    read and only those of the boundary pixels are tested. 
+
+    Args:
+        cat (dict): galcat or footprint specs
+        entry (np.void): mosaic index entry
+        racen (float, optional): disc center. Defaults to None.
+        deccen (float, optional): disc center. Defaults to None.
+        radius_deg (float, optional): disc radius. Defaults to None.
+
+    Returns:
+        ndarray: rows of the file (in the disc)
+    """
+    columns = mosaic_columns(cat)
+    fitsname = os.path.join(cat['mosaic']['dir'], str(entry['filename']))
+    dat = None
+    if cat['mosaic'].get('npy_cache') in (None, 'None'):
+        dat = read_FitsCat(fitsname, columns=columns)
+    else:
+        pixdir = npy_file_dir(cat, entry)
+        col_files = [os.path.join(pixdir, c+'.npy') for c in columns]
+        if not stage_done(pixdir, 'npy', npy_file_hash(cat, entry)) or \
+           not all(os.path.isfile(f) for f in col_files):
+            dat = read_FitsCat(fitsname, columns=columns)
+            dat = dat.astype(
+                [(c, npy_dtype(cat, c, dat.dtype[c])) for c in columns]
+            )
+
+    if dat is None: # from the cache 
+        cols = [np.load(f, mmap_mode='r') for f in col_files]
+        sort_nside = npy_sort_nside(cat)
+        if radius_deg is not None and sort_nside is not None:
+            rows_in, rows_bound = rows_in_disc(
+                pixdir, sort_nside, racen, deccen, radius_deg
+            )
+            bound = np.zeros(len(rows_bound), dtype=[
+                (c, col.dtype) for c, col in zip(columns, cols)
+            ])
+            for c, col in zip(columns, cols):
+                bound[c] = col[rows_bound]
+            ra, dec = mosaic_centers(cat, bound)
+            dcen = np.degrees(dist_ang(ra, dec, racen, deccen))
+            rows = np.sort(np.append(rows_in, rows_bound[dcen<radius_deg]))
+            radius_deg = None # selection done 
+        else:
+            rows = slice(None)
+        cols = [col[rows] for col in cols]
+        dat = np.empty(
+            len(cols[0]), 
+            dtype=[(c, col.dtype) for c, col in zip(columns, cols)]
+        )
+        for c, col in zip(columns, cols):
+            dat[c] = col
+
+    if radius_deg is not None:
+        ra, dec = mosaic_centers(cat, dat)
+        dcen = np.degrees(dist_ang(ra, dec, racen, deccen))
+        dat = dat[dcen<radius_deg]
+    return dat
+
+
+def read_mosaic_files(cat, entries, racen=None, deccen=None, 
+                      radius_deg=None):
+    """Reads several mosaic files (entries of mosaic_index, optionally 
+    restricted to a disc, see read_mosaic_file) on 
+    cat['mosaic']['nthreads_read'] threads, and merges them in a 
+    single array allocated once, in the order of entries. 
+
+    Args:
+        cat (dict): galcat or footprint specs
+        entries (ndarray): mosaic index entries
+        racen (float, optional): disc center. Defaults to None.
+        deccen (float, optional): disc center. Defaults to None.
+        radius_deg (float, optional): disc radius. Defaults to None.
+
+    Returns:
+        ndarray: merged rows (None if no entries)
+    """
+    if len(entries) == 0:
+        return None
+    nthreads = max(1, min(int(cat['mosaic'].get('nthreads_read', 1)), 
+                          len(entries)))
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        parts = list(executor.map(
+            lambda entry: read_mosaic_file(
+                cat, entry, racen, deccen, radius_deg
+            ), entries
+        ))
+    data = np.empty(sum(len(part) for part in parts), dtype=parts[0].dtype)
+    i0 = 0
+    for part in parts:
+        data[i0:i0+len(part)] = part
+        i0 += len(part)
+    return data
+
+
 def read_mosaicFitsCat_in_disc (galcat, tile, radius_deg):
     """From a list of galcat files, selects objects in a cone centered 
     on racen, deccen Output is a structured array
@@ -77,13 +585,8 @@ def read_mosaicFitsCat_in_disc (galcat, tile, radius_deg):
 
     # tile 
     racen, deccen = tile['ra'], tile['dec']
-    # list of available galcats => healpix pixels 
-    gdir = galcat['mosaic']['dir']
-    raw_list = np.array(os.listdir(gdir))
-    hpix_fits = np.array(
-        [os.path.splitext(x)[0] for x in raw_list]
-    ).astype(int)
-    extension = os.path.splitext(raw_list[0])[1]
+    # available galcats => healpix pixels 
+    index = mosaic_index(galcat['mosaic'])
 
     # find list of fits intersection cluster field
     Nside_fits, nest_fits = galcat['mosaic']['Nside'],\
@@ -93,36 +596,14 @@ def read_mosaicFitsCat_in_disc (galcat, tile, radius_deg):
         vec=hp.ang2vec(racen, deccen, lonlat=True),
         radius = np.radians(radius_deg), inclusive=True
     )
-    relevant_fits_pixels = fits_pixels_in_disc\
-                           [np.isin(
-                               fits_pixels_in_disc, 
-                               hpix_fits, 
-                               assume_unique=True
-                           )]
-
-    if len(relevant_fits_pixels) > 0:
-        # merge intersecting fits 
-        for i in range (0, len(relevant_fits_pixels)):
-            dat_disc = read_FitsCat(
-                os.path.join(gdir, str(relevant_fits_pixels[i])+extension)
-            )
-            dcen = np.degrees( 
-                dist_ang(
-                    dat_disc[galcat['keys']['key_ra']], 
-                    dat_disc[galcat['keys']['key_dec']],
-                    racen, deccen
-                )
-            )
-            if i == 0:
-                data_gal_disc = np.copy(dat_disc[dcen<radius_deg])
-            else:
-                data_gal_disc = np.append(
-                    data_gal_disc, 
-                    dat_disc[dcen<radius_deg]
-                )
-    else:
-        data_gal_disc = None
-    return data_gal_disc
+    relevant_files = index[np.isin(
+        index['hpix'], fits_pixels_in_disc, assume_unique=True
+    )]
+
+    # merge intersecting fits 
+    return read_mosaic_files(
+        galcat, relevant_files, racen, deccen, radius_deg
+    )
 
 
 def read_mosaicFootprint_in_disc (footprint, tile, radius_deg):
@@ -141,13 +622,8 @@ def read_mosaicFootprint_in_disc (footprint, tile, radius_deg):
 
     # tile 
     racen, deccen = tile['ra'], tile['dec']
-    # list of available galcats => healpix pixels 
-    gdir = footprint['mosaic']['dir']
-    raw_list = np.array(os.listdir(gdir))
-    hpix_fits = np.array(
-        [os.path.splitext(x)[0].replace('_footprint','') for x in raw_list]
-    ).astype(int)
-    extension = os.path.splitext(raw_list[0])[1]
+    # available footprints => healpix pixels 
+    index = mosaic_index(footprint['mosaic'], '_footprint')
     # find list of fits intersection cluster field
     Nside_fits, nest_fits = footprint['mosaic']['Nside'],\
                             footprint['mosaic']['nest']
@@ -157,39 +633,224 @@ def read_mosaicFootprint_in_disc (footprint, tile, radius_deg):
         radius = np.radians(radius_deg), 
         inclusive=True
     )
-    relevant_fits_pixels = fits_pixels_in_disc\
-                           [np.isin(
-                               fits_pixels_in_disc, 
-                               hpix_fits, 
-                               assume_unique=True
-                           )]
-    if len(relevant_fits_pixels) > 0:
-        # merge intersecting fits 
-        for i in range (0, len(relevant_fits_pixels)):
-            dat_disc = read_FitsCat(
-                os.path.join(
-                    gdir, 
-                    str(relevant_fits_pixels[i])+'_footprint'+extension
+    relevant_files = index[np.isin(
+        index['hpix'], fits_pixels_in_disc, assume_unique=True
+    )]
+    # merge intersecting fits 
+    return read_mosaic_files(
+        footprint, relevant_files, racen, deccen, radius_deg
+    )
+
+
+def read_tile_data(galcat, footprint, tile, radius_deg, maglim, 
+                   cache_dir=None, cache_specs=None):
+    """Reads the galaxies (mag <= maglim) and the footprint pixels 
+    of a tile within radius_deg. If cache_specs is given, the 
+    superset defined by cache_specs (radius_deg, maglim) is read once 
+    from the mosaics and stored in cache_dir. Later calls (e.g. pmem 
+    after detection) slice their subset from this cache. 
+
+    Args:
+        galcat (dict): galaxy catalog specs 
+        footprint (dict): footprint specs 
+        tile (FITS_rec): tile (ra, dec)
+        radius_deg (float): radius of the tile disc 
+        maglim (float): faintest magnitude 
+        cache_dir (str): directory of the tile cache 
+        cache_specs (dict): radius_deg and maglim of the cache 
+
+    Returns:
+        tuple: galaxies and footprint structured arrays
+    """
+    if cache_specs is None:
+        data_gal = read_mosaicFitsCat_in_disc(galcat, tile, radius_deg)
+        data_fp = read_mosaicFootprint_in_disc(footprint, tile, radius_deg)
+    else:
+        gal_file = os.path.join(cache_dir, 'galcat_cache.npy')
+        fp_file = os.path.join(cache_dir, 'footprint_cache.npy')
+        specs_file = os.path.join(cache_dir, 'tile_cache.json')
+        data_hash = stage_hash(
+            galcat, footprint, float(tile['ra']), float(tile['dec']),
+            dir_signature(galcat['mosaic']['dir']), 
+            dir_signature(footprint['mosaic']['dir'])
+        )
+        cached_specs = None
+        if os.path.isfile(specs_file):
+            with open(specs_file) as fstream:
+                cached_specs = json.load(fstream)
+        if cached_specs is None or \
+           cached_specs['data_hash'] != data_hash or \
+           cached_specs['radius_deg'] < cache_specs['radius_deg'] or \
+           cached_specs['maglim'] < cache_specs['maglim']:
+            data_gal = read_mosaicFitsCat_in_disc(
+                galcat, tile, cache_specs['radius_deg']
+            )
+            data_gal = data_gal[
+                data_gal[galcat['keys']['key_mag']] <= cache_specs['maglim']
+            ]
+            data_fp = read_mosaicFootprint_in_disc(
+                footprint, tile, cache_specs['radius_deg']
+            )
+            # atomic writes : never leave a partial cache
+            save_npy(gal_file, data_gal)
+            save_npy(fp_file, data_fp)
+            with open(specs_file+'.tmp', 'w') as outfile:
+                json.dump(
+                    {'radius_deg':float(cache_specs['radius_deg']), 
+                     'maglim':float(cache_specs['maglim']), 
+                     'data_hash':data_hash}, outfile
+                )
+            os.replace(specs_file+'.tmp', specs_file)
+            cached_specs = cache_specs
+        else:
+            data_gal = np.load(gal_file)
+            data_fp = np.load(fp_file)
+
+        if radius_deg < cached_specs['radius_deg']:
+            dcen = np.degrees(
+                dist_ang(
+                    data_gal[galcat['keys']['key_ra']], 
+                    data_gal[galcat['keys']['key_dec']],
+                    tile['ra'], tile['dec']
                 )
             )
+            data_gal = data_gal[dcen<radius_deg]
             ra, dec = hp.pix2ang(
-                footprint['Nside'],
-                dat_disc[footprint['key_pixel']],
-                footprint['nest'], 
-                lonlat=True
+                footprint['Nside'], data_fp[footprint['key_pixel']],
+                footprint['nest'], lonlat=True
             )
-            dcen = np.degrees(dist_ang(ra, dec, racen, deccen))
-            if i == 0:
-                data_fp_disc = np.copy(dat_disc[dcen<radius_deg])
-            else:
-                data_fp_disc = np.append(
-                    data_fp_disc, 
-                    dat_disc[dcen<radius_deg]
-                )
-    else:
-        data_fp_disc = None
+            dcen = np.degrees(dist_ang(ra, dec, tile['ra'], tile['dec']))
+            data_fp = data_fp[dcen<radius_deg]
+
+    data_gal = data_gal[
+        data_gal[galcat['keys']['key_mag']] <= np.float64(maglim)
+    ]
+    return data_gal, data_fp
+
+
+# tile data read ahead by a queue worker for the tile it will 
+# likely claim next (one tile, see prefetch_next_tile)
+_next_tile = {'key':None, 'result':None}
+
+
+def tile_task_key(task):
+    # identifies the read_tile_data arguments of a tile 
+    return (int(task[2]['id']), float(task[3]), float(task[4]), 
+            str(task[5:]))
+
+
+def prefetch_next_tile(task, mem_budget_gb):
+    """Starts reading in background the data of the tile a worker 
+    will likely process next (replaces a previous read ahead). 
+    The data are kept only if they fit in mem_budget_gb. 
+
+    Args:
+        task (tuple): read_tile_data arguments of the tile 
+        mem_budget_gb (float): max memory of the prefetched tile 
+    """
+    result = {}
+    def loader():
+        t0 = time.time()
+        try:
+            tile_data = read_tile_data(*task)
+        except Exception:
+            tile_data = None # read again by the tile itself
+        if tile_data is not None and \
+           sum([d.nbytes for d in tile_data if d is not None]) <= \
+           mem_budget_gb * 1024.**3:
+            result['data'] = (tile_data, time.time() - t0)
+
+    thread = threading.Thread(target=loader, daemon=True)
+    thread.start()
+    _next_tile['key'] = tile_task_key(task)
+    _next_tile['result'] = (thread, result)
+    return
+
+
+def read_tile_task(task):
+    """read_tile_data of a task, taken from the read ahead of 
+    prefetch_next_tile if it was started for this task. 
+
+    Returns:
+        tuple: (galaxies, footprint), read time (s)
+    """
+    if _next_tile['key'] is not None and \
+       _next_tile['key'] == tile_task_key(task):
+        thread, result = _next_tile['result']
+        _next_tile['key'], _next_tile['result'] = None, None
+        thread.join()
+        if 'data' in result:
+            return result['data']
+    t0 = time.time()
+    tile_data = read_tile_data(*task)
+    return tile_data, time.time() - t0
+
+
+def prefetch_tile_data(tasks, nprefetch, mem_budget_gb):
+    """Generator over the tile data of a list of tiles processed in 
+    sequence. While the caller works on tile k, a background thread 
+    reads the data of the next tiles (up to nprefetch tiles ahead) 
+    as long as the prefetched data stay within mem_budget_gb. 
 
-    return data_fp_disc
+    Args:
+        tasks (list): read_tile_data arguments of each tile 
+        nprefetch (int): max nr. of tiles read ahead (0 = no prefetch)
+        mem_budget_gb (float): max memory of the prefetched tiles 
+
+    Yields:
+        tuple: (galaxies, footprint), read time (s) of each tile 
+    """
+    if nprefetch <= 0 or len(tasks) <= 1:
+        for task in tasks:
+            yield read_tile_task(task)
+        return
+
+    budget = mem_budget_gb * 1024.**3
+    cond = threading.Condition()
+    state = {'current':-1, 'nbytes':0, 'stop':False}
+    loaded = {}
+
+    def nbytes(tile_data):
+        return sum([d.nbytes for d in tile_data if d is not None])
+
+    def loader():
+        for it in range(0, len(tasks)):
+            with cond:
+                # the tile awaited by the caller is always read 
+                while not state['stop'] and it > state['current']+1 and \
+                      (it > state['current']+nprefetch or \
+                       state['nbytes'] >= budget):
+                    cond.wait()
+                if state['stop']:
+                    return
+            try:
+                (tile_data, read_time), error = read_tile_task(tasks[it]), None
+            except Exception as e:
+                tile_data, read_time, error = (None, None), 0., e
+            with cond:
+                loaded[it] = (tile_data, read_time, error)
+                state['nbytes'] += nbytes(tile_data)
+                cond.notify_all()
+
+    thread = threading.Thread(target=loader, daemon=True)
+    thread.start()
+    try:
+        for it in range(0, len(tasks)):
+            with cond:
+                while it not in loaded:
+                    cond.wait()
+                tile_data, read_time, error = loaded.pop(it)
+                state['nbytes'] -= nbytes(tile_data)
+                state['current'] = it
+                cond.notify_all()
+            if error is not None:
+                raise error
+            yield tile_data, read_time
+    finally:
+        with cond:
+            state['stop'] = True
+            cond.notify_all()
+        thread.join()
 
 
 def read_mosaicFitsCat_in_hpix (galcat, hpix_tile, Nside_tile, nest_tile):
@@ -209,38 +870,16 @@ def read_mosaicFitsCat_in_hpix (galcat, hpix_tile, Nside_tile, nest_tile):
     centered on racen, deccen
     Output is a structured array
     """
-    # list of available galcats => healpix pixels 
-    gdir = galcat['mosaic']['dir']
-    raw_list = np.array(os.listdir(gdir))
-    hpix_fits = np.array(
-        [os.path.splitext(x)[0] for x in raw_list]
-    ).astype(int)
-    extension = os.path.splitext(raw_list[0])[1]
-    Nside_fits, nest_fits = galcat['mosaic']['Nside'], galcat['mosaic']['nest']
+    # available galcats => healpix pixels and centers 
+    index = mosaic_index(galcat['mosaic'])
 
     # warning we assume Nside_tile > Nside_fits !!
-    ra_fits, dec_fits = hp.pix2ang(
-        Nside_fits, hpix_fits, nest_fits, lonlat=True 
-    )
     hpix_fits_tile = hp.ang2pix(
-        Nside_tile, ra_fits, dec_fits, nest_tile, lonlat=True
-    )
-    relevant_fits_pixels = np.unique(
-        hpix_fits[np.isin(hpix_fits_tile, hpix_tile)]
+        Nside_tile, index['ra'], index['dec'], nest_tile, lonlat=True
     )
-    if len(relevant_fits_pixels) > 0:
-        # merge intersecting fits 
-        for i in range (0, len(relevant_fits_pixels)):
-            dat = read_FitsCat(
-                os.path.join(gdir, str(relevant_fits_pixels[i])+extension)
-            )
-            if i == 0:
-                data_gal_hpix = np.copy(dat)
-            else:
-                data_gal_hpix = np.append(data_gal_hpix, dat)
-    else:
-        data_gal_hpix = None
-    return data_gal_hpix
+    relevant_files = index[np.isin(hpix_fits_tile, hpix_tile)]
+    # merge intersecting fits 
+    return read_mosaic_files(galcat, relevant_files)
 
 
 def read_mosaicFootprint_in_hpix (footprint, hpix_tile, Nside_tile, nest_tile):
@@ -256,44 +895,18 @@ def read_mosaicFootprint_in_hpix (footprint, hpix_tile, Nside_tile, nest_tile):
         _type_: _description_
     """
 
-    # list of available footprints => healpix pixels 
-    gdir = footprint['mosaic']['dir']
-    raw_list = np.array(os.listdir(gdir))
-    hpix_fits = np.array(
-        [os.path.splitext(x)[0].replace('_footprint','') for x in raw_list]
-    ).astype(int)
-    extension = os.path.splitext(raw_list[0])[1]
-    Nside_fits, nest_fits = footprint['mosaic']['Nside'],\
-                            footprint['mosaic']['nest']
+    # available footprints => healpix pixels and centers 
+    index = mosaic_index(footprint['mosaic'], '_footprint')
 
     # warning we assume Nside_tile > Nside_fits !!
-    ra_fits, dec_fits = hp.pix2ang(
-        Nside_fits, hpix_fits, nest_fits, lonlat=True 
-    )
     hpix_fits_tile = hp.ang2pix(
-        Nside_tile, ra_fits, dec_fits, nest_tile, lonlat=True
+        Nside_tile, index['ra'], index['dec'], nest_tile, lonlat=True
     )
 
-    relevant_fits_pixels = np.unique(
-        hpix_fits[np.isin(hpix_fits_tile, hpix_tile)]
-    )
+    relevant_files = index[np.isin(hpix_fits_tile, hpix_tile)]
 
-    if len(relevant_fits_pixels) > 0:
-        # merge intersecting fits 
-        for i in range (0, len(relevant_fits_pixels)):
-            dat = read_FitsCat(
-                os.path.join(
-                    gdir, 
-                    str(relevant_fits_pixels[i])+'_footprint'+extension
-                )
-            )
-            if i == 0:
-                data_fp_hpix = np.copy(dat)
-            else:
-                data_fp_hpix = np.append(data_fp_hpix, dat)
-    else:
-        data_fp_hpix = None
-    return data_fp_hpix
+    # merge intersecting fits 
+    return read_mosaic_files(footprint, relevant_files)
 
 
 def create_survey_footprint_from_mosaic(footprint, survey_footprint):
@@ -303,25 +916,16 @@ def create_survey_footprint_from_mosaic(footprint, survey_footprint):
         footprint (_type_): _description_
         fpath (_type_): _description_
     """
-    all_files = np.array(os.listdir(footprint['mosaic']['dir']))
-    flist = [os.path.join(footprint['mosaic']['dir'], f) for f in all_files]
-    concatenate_fits(flist, survey_footprint)
+    index = mosaic_index(footprint['mosaic'], '_footprint')
+    flist = [
+        os.path.join(footprint['mosaic']['dir'], f) for f in index['filename']
+    ]
+    concatenate_fits_stream(flist, survey_footprint)
     return
 
 
-def create_mosaic_footprint(footprint, fpath):
-    """_summary_
-
-    Args:
-        footprint (_type_): _description_
-        fpath (_type_): _description_
-    """
-    # from a survey footprint create a mosaic of footprints at lower resol.
-    if not os.path.exists(fpath):
-        os.mkdir(fpath)
-    hpix0, frac0 = read_FitsFootprint(
-        footprint['survey_footprint'], footprint
-    )
+def footprint_mosaic_pixels(footprint, hpix0):
+    # centers and mosaic pixels of survey footprint pixels 
     ra0, dec0 = hp.pix2ang(
         footprint['Nside'], hpix0, footprint['nest'], lonlat=True 
     )
@@ -329,34 +933,115 @@ def create_mosaic_footprint(footprint, fpath):
         footprint['mosaic']['Nside'], ra0, dec0, footprint['mosaic']['nest'], 
         lonlat=True
     )
-    for hpu in np.unique(hpix):
-        all_cols = fits.ColDefs([
-            fits.Column(
-                name = footprint['key_pixel'],  
-                format = 'K',
-                array = hpix0[np.isin(hpix, hpu)]
-            ),
-            fits.Column(
-                name='ra',       
-                format='E',
-                array= ra0[np.isin(hpix, hpu)]
-            ),
-            fits.Column(
-                name='dec',      
-                format='E',
-                array= dec0[np.isin(hpix, hpu)]
-            ),
-            fits.Column(
-                name=footprint['key_frac'],   
-                format='K',
-                array= frac0[np.isin(hpix, hpu)]
-            )
-        ])
-        hdu = fits.BinTableHDU.from_columns(all_cols)
-        hdu.writeto(
-            os.path.join(fpath, str(hpu)+'_footprint.fits'),
-            overwrite=True
+    return hpix, ra0, dec0
+
+
+def write_footprint_mosaic_file(footprint, fpath, hpu, hpix0, ra0, dec0, 
+                                frac0):
+    """Writes the footprint pixels of mosaic pixel hpu
+
+    Args:
+        footprint (dict): footprint specs
+        fpath (str): mosaic directory
+        hpu (int): mosaic pixel
+        hpix0 (ndarray): footprint pixels in hpu
+        ra0 (ndarray): their centers
+        dec0 (ndarray): their centers
+        frac0 (ndarray): their covered fractions
+    """
+    all_cols = fits.ColDefs([
+        fits.Column(
+            name = footprint['key_pixel'],  
+            format = 'K',
+            array = hpix0
+        ),
+        fits.Column(
+            name='ra',       
+            format='E',
+            array= ra0
+        ),
+        fits.Column(
+            name='dec',      
+            format='E',
+            array= dec0
+        ),
+        fits.Column(
+            name=footprint['key_frac'],   
+            format='K',
+            array= frac0
         )
+    ])
+    hdu = fits.BinTableHDU.from_columns(all_cols)
+    hdu.writeto(
+        os.path.join(fpath, str(hpu)+'_footprint.fits'),
+        overwrite=True
+    )
+    return
+
+
+def create_mosaic_footprint(footprint, fpath, nthreads=1, chunk_nrows=None):
+    """From a survey footprint create a mosaic of footprints at lower 
+    resolution (mosaic Nside). Pixels are grouped by mosaic pixel in 
+    a single sort and the mosaic files are written on nthreads threads. 
+    With chunk_nrows, the survey footprint is streamed by chunks of 
+    chunk_nrows rows whose groups are appended to temporary part files, 
+    so that the full map is never in memory. 
+
+    Args:
+        footprint (dict): footprint specs
+        fpath (str): mosaic directory
+        nthreads (int, optional): nr. of writing threads. Defaults to 1.
+        chunk_nrows (int, optional): streaming chunk. Defaults to None.
+    """
+    if not os.path.exists(fpath):
+        os.mkdir(fpath)
+    nthreads = max(1, int(nthreads))
+
+    if chunk_nrows is None:
+        hpix0, frac0 = read_FitsFootprint(
+            footprint['survey_footprint'], footprint
+        )
+        hpix, ra0, dec0 = footprint_mosaic_pixels(footprint, hpix0)
+        order = np.argsort(hpix, kind='stable') # keeps the survey order 
+        hpu, first = np.unique(hpix[order], return_index=True)
+        groups = np.split(order, first[1:])
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            list(executor.map(
+                lambda hpu, rows: write_footprint_mosaic_file(
+                    footprint, fpath, hpu, 
+                    hpix0[rows], ra0[rows], dec0[rows], frac0[rows]
+                ), hpu, groups
+            ))
+        return
+
+    # streamed : chunk groups appended to one part file / mosaic pixel 
+    parts_dir = os.path.join(fpath, 'parts')
+    if os.path.exists(parts_dir):
+        shutil.rmtree(parts_dir) # from an interrupted run 
+    os.mkdir(parts_dir)
+    part_dtype = [('hpix', 'i8'), ('ra', 'f4'), ('dec', 'f4'), ('frac', 'f8')]
+    for hpix0, frac0 in stream_FitsFootprint(
+            footprint['survey_footprint'], footprint, int(chunk_nrows)
+    ):
+        hpix, ra0, dec0 = footprint_mosaic_pixels(footprint, hpix0)
+        part = np.zeros(len(hpix0), dtype=part_dtype)
+        part['hpix'], part['ra'], part['dec'], part['frac'] = \
+            hpix0, ra0, dec0, frac0
+        order = np.argsort(hpix, kind='stable')
+        hpu, first = np.unique(hpix[order], return_index=True)
+        for h, rows in zip(hpu, np.split(order, first[1:])):
+            with open(os.path.join(parts_dir, str(h)), 'ab') as outfile:
+                part[rows].tofile(outfile)
+
+    def write_part(h):
+        part = np.fromfile(os.path.join(parts_dir, h), dtype=part_dtype)
+        write_footprint_mosaic_file(
+            footprint, fpath, h, 
+            part['hpix'], part['ra'], part['dec'], part['frac']
+        )
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        list(executor.map(write_part, os.listdir(parts_dir)))
+    shutil.rmtree(parts_dir)
     return
 
 
@@ -382,6 +1067,83 @@ def concatenate_fits(flist, output):
     return cdat
 
 
+def fits_table_layout(header):
+    # row layout of a binary table header (None if rows use a heap) 
+    if header.get('PCOUNT', 0) != 0:
+        return None
+    keys = ('TTYPE', 'TFORM', 'TDIM')
+    return (header['NAXIS1'],) + tuple(
+        header.get(k+str(i)) for i in range(1, header['TFIELDS']+1) 
+        for k in keys
+    )
+
+
+def fits_table_chunks(flist, chunk_nbytes):
+    # (file, data offset, nbytes) of chunks of whole rows of each table 
+    chunks = []
+    for f in flist:
+        with fits.open(f, memmap=True) as hdulist:
+            offset = hdulist[1].fileinfo()['datLoc']
+            row_nbytes = hdulist[1].header['NAXIS1']
+            nrows = hdulist[1].header['NAXIS2']
+        step = max(1, chunk_nbytes // max(1, row_nbytes))
+        for i0 in range(0, nrows, step):
+            chunks.append((
+                f, offset + i0*row_nbytes, 
+                (min(nrows, i0+step) - i0)*row_nbytes
+            ))
+    return chunks
+
+
+def read_bytes(filename, offset, nbytes):
+    with open(filename, 'rb') as infile:
+        infile.seek(offset)
+        return infile.read(nbytes)
+
+
+def concatenate_fits_stream(flist, output, nthreads=1, 
+                            chunk_nbytes=64*1024**2):
+    """Same output as concatenate_fits without holding the tables in 
+    memory. The rows of the tables (same column layout) are copied as 
+    raw FITS bytes, by chunks of ~chunk_nbytes, behind the header of 
+    the first table (without its CHECKSUM / DATASUM cards). Chunks are read on nthreads threads (at most 
+    2 x nthreads chunks ahead) and written in the order of flist. 
+    Falls back to concatenate_fits if the layouts differ. 
+
+    Args:
+        flist (list): fits tables
+        output (str): concatenated table
+        nthreads (int, optional): reading threads. Defaults to 1.
+        chunk_nbytes (int, optional): chunk size. Defaults to 64MB.
+    """
+    headers = [fits.getheader(f, 1) for f in flist]
+    layouts = set(fits_table_layout(h) for h in headers)
+    if len(layouts) != 1 or None in layouts:
+        concatenate_fits(flist, output)
+        return
+
+    header = headers[0].copy()
+    header['NAXIS2'] = sum(h['NAXIS2'] for h in headers)
+    for key in ('CHECKSUM', 'DATASUM'): # not valid for the output
+        header.remove(key, ignore_missing=True, remove_all=True)
+    nthreads = max(1, int(nthreads))
+    with open(atomic_path(output), 'wb') as outfile:
+        fits.PrimaryHDU().writeto(outfile)
+        outfile.write(header.tostring().encode('ascii'))
+        nbytes = 0
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            window = deque()
+            for chunk in fits_table_chunks(flist, chunk_nbytes):
+                window.append(executor.submit(read_bytes, *chunk))
+                if len(window) > 2*nthreads:
+                    nbytes += outfile.write(window.popleft().result())
+            while window:
+                nbytes += outfile.write(window.popleft().result())
+        outfile.write(b'\0' * (-nbytes % 2880))
+    os.replace(atomic_path(output), output)
+    return
+
+
 def concatenate_fits_with_label(flist, label_name, label, output):
     """_summary_
 
@@ -561,15 +1323,40 @@ def area_ann_deg2(theta_1, theta_2):
     return area
 
 
+@lru_cache(maxsize=None)
+def mstar_table(mstar_filename):
+    """
+    (z, mstar) table of an ascii file, read once per process
+    """
+    zst, mst = np.loadtxt(mstar_filename, usecols=(0, 1), unpack=True)
+    zst.flags.writeable, mst.flags.writeable = False, False
+    return zst, mst
+
+
 def _mstar_ (mstar_filename, zin):
     """
     from a given (z, mstar) ascii file
     interpolate to provide the mstar at a given z_in
     """
-    zst, mst = np.loadtxt(mstar_filename, usecols=(0, 1), unpack=True)
+    zst, mst = mstar_table(mstar_filename)
     return np.interp (zin,zst,mst)
 
 
+@lru_cache(maxsize=None)
+def _cosmology(H, omega_M_0):
+    return flat(H0=H, Om0=omega_M_0)
+
+
+def cosmology(cosmo_params):
+    """
+    FlatLambdaCDM instance of cosmo_params, created once per process 
+    (instances are immutable and keep their internal precomputations)
+    """
+    return _cosmology(
+        float(cosmo_params['H']), float(cosmo_params['omega_M_0'])
+    )
+
+
 def join_struct_arrays(arrays):
     """_summary_
 
@@ -687,18 +1474,114 @@ def all_hpx_in_annulus (ra, dec, radius_in_deg, radius_out_deg,
 
     return pixels_in_ann
 
+def pixel_lut(pixels, max_size=2**22):
+    """Lookup table of a list of unique healpix pixels : for any pixel, 
+    its row in the list (-1 if absent) by direct indexing of a dense 
+    int32 array covering [min(pixels), max(pixels)], or by a search in 
+    the sorted list if this range exceeds max_size entries. 
+
+    Args:
+        pixels (ndarray): unique pixels
+        max_size (int, optional): max size of the dense array 
+            (2**22 : 16 MB). 
+
+    Returns:
+        dict: lookup table (see lut_rows)
+    """
+    pixels = np.asarray(pixels).astype('i8')
+    lut = {'pixels':pixels, 'pix0':0, 'dense':None, 'order':None}
+    if len(pixels) == 0:
+        return lut
+    pix0, pix1 = np.amin(pixels), np.amax(pixels)
+    if pix1 - pix0 + 1 <= max_size:
+        lut['pix0'] = pix0
+        lut['dense'] = np.full(pix1 - pix0 + 1, -1, dtype='i4')
+        lut['dense'][pixels - pix0] = np.arange(len(pixels))
+    else:
+        lut['order'] = np.argsort(pixels)
+    return lut
+
+
+def lut_rows(lut, pix):
+    """Rows of pix (any shape) in the pixel list of lut (-1 if absent)
+
+    Args:
+        lut (dict): see pixel_lut
+        pix (ndarray): pixels
+
+    Returns:
+        ndarray: rows, same shape as pix
+    """
+    pix = np.asarray(pix).astype('i8')
+    rows = np.full(pix.shape, -1, dtype='i8')
+    if len(lut['pixels']) == 0:
+        return rows
+    if lut['dense'] is not None:
+        k = pix - lut['pix0']
+        ok = (k >= 0) & (k < len(lut['dense']))
+        rows[ok] = lut['dense'][k[ok]]
+    else:
+        sorted_pixels = lut['pixels'][lut['order']]
+        k = np.minimum(
+            np.searchsorted(sorted_pixels, pix), len(sorted_pixels)-1
+        )
+        ok = (sorted_pixels[k] == pix)
+        rows[ok] = lut['order'][k[ok]]
+    return rows
+
+
+# lookup tables of the last footprints converted by this process, as 
+# (footprint array, lookup table), see footprint_lut
+_footprint_luts = deque(maxlen=4)
+_footprint_luts_lock = threading.Lock()
+
+
+def footprint_lut(data_fp, footprint):
+    """Footprint of a tile / cluster field with its pixel lookup table 
+    (see pixel_lut) : membership and frac of any pixel array by direct 
+    indexing. Required by hpx_in_annulus and accepted instead of the 
+    footprint structured array by the other footprint membership 
+    tests. The tables of the last footprint arrays are cached : 
+    converting the same array again returns its table. 
+
+    Args:
+        data_fp (ndarray): footprint (unique pixels)
+        footprint (dict): footprint specs
+
+    Returns:
+        dict: lookup table + 'data' (data_fp), 'frac'
+    """
+    with _footprint_luts_lock:
+        for cached_fp, cached_lut in _footprint_luts:
+            if cached_fp is data_fp:
+                return cached_lut
+    lut = pixel_lut(data_fp[footprint['key_pixel']])
+    lut['frac'] = data_fp[footprint['key_frac']]
+    lut['data'] = data_fp
+    with _footprint_luts_lock:
+        _footprint_luts.append((data_fp, lut))
+    return lut
+
+
+def as_footprint_lut(data_fp, footprint):
+    # footprint lookup table from a footprint array or lookup table 
+    if isinstance(data_fp, dict):
+        return data_fp
+    return footprint_lut(data_fp, footprint)
+
+
 def hpx_in_annulus (ra, dec, radius_in_deg, radius_out_deg, 
-                    data_fp, hpx_meta, inclusive):
+                    fp_lut, hpx_meta, inclusive):
     """
-    Given an array of healpix pixels (hpix, frac) where frac is the 
-    covered fraction of each hpix pixel,
+    Given the footprint_lut of an array of healpix pixels (hpix, frac) 
+    where frac is the covered fraction of each hpix pixel, 
     computes the sub list of these pixels falling in an annulus around position 
     ra-dec (deg)
     the radii that define the annulus are in degrees
     hpx pixels are inclusive on radius_out but not radius_in
     """
     Nside, nest = hpx_meta['Nside'], hpx_meta['nest']
-    hpix, frac = data_fp[hpx_meta['key_pixel']], data_fp[hpx_meta['key_frac']]
+    hpix, frac = fp_lut['pixels'], fp_lut['frac']
 
     area_pix = hp.nside2pixarea(Nside, degrees=True)
     pixels_in_ann = all_hpx_in_annulus (
@@ -710,7 +1593,8 @@ def hpx_in_annulus (ra, dec, radius_in_deg, radius_out_deg,
     hpx_in_ann, frac_in_ann = [], []
 
     if npix_all > 0:
-        idx = np.isin(hpix, pixels_in_ann)
+        rows = lut_rows(fp_lut, pixels_in_ann)
+        idx = np.sort(rows[rows>=0]) # footprint order 
         hpx_in_ann = hpix[idx]  # visible pixels
         frac_in_ann = frac[idx] 
         npix = len(hpx_in_ann)
@@ -843,6 +1727,8 @@ def tile_radius(tiling):
 
 
 def disc_coverfrac(ra, dec, radius_deg, dat_footprint, footprint):
+    # dat_footprint = footprint or its footprint_lut
+    fp_lut = as_footprint_lut(dat_footprint, footprint)
     pixels_in_disc = hp.query_disc(
         nside = footprint['Nside'], 
         nest = footprint['nest'],  
@@ -850,8 +1736,7 @@ def disc_coverfrac(ra, dec, radius_deg, dat_footprint, footprint):
         radius = np.radians(radius_deg), 
         inclusive=True
     )
-    fhpx = dat_footprint[footprint['key_pixel']]
-    ind_in = np.isin (pixels_in_disc, fhpx)
+    ind_in = (lut_rows(fp_lut, pixels_in_disc) >= 0)
     return float(len(pixels_in_disc[ind_in])) / float(len(pixels_in_disc))
 
 
@@ -875,11 +1760,12 @@ def create_tile_specs(tile, tile_radius_deg, admin,
 
     if admin['target_mode']:
         # coverfrac in  30 and 5 arcmin
+        fp_lut = as_footprint_lut(dat_footprint, footprint)
         coverfrac_30 = disc_coverfrac(
-            tile['ra'], tile['dec'], 0.5, dat_footprint, footprint
+            tile['ra'], tile['dec'], 0.5, fp_lut, footprint
         )
         coverfrac_5 = disc_coverfrac(
-            tile['ra'], tile['dec'], 1./12., dat_footprint, footprint
+            tile['ra'], tile['dec'], 1./12., fp_lut, footprint
         )
         hpix = -1
         Nside, nest = -1, None
@@ -1124,6 +2010,17 @@ def get_footprint(input_data_structure, footprint, workdir):
     return survey_footprint
 
 
+def npy_cache_dir(param_cfg, param_data, product):
+    # npy cache of the galcat / footprint mosaic : 'mosaic / npy_cache' 
+    # in data.cfg or workdir/<product>_npy
+    mosaic = param_data[product][param_cfg['survey']]['mosaic']
+    if mosaic.get('npy_cache') in (None, 'None'):
+        mosaic['npy_cache'] = os.path.join(
+            param_cfg['out_paths']['workdir'], product+'_npy'
+        )
+    return mosaic['npy_cache']
+
+
 def update_data_structure(param_cfg, param_data):
 
     workdir = param_cfg['out_paths']['workdir']
@@ -1134,11 +2031,29 @@ def update_data_structure(param_cfg, param_data):
     # create required data structure if not exist and update config 
     if not input_data_structure[survey]['footprint_hpx_mosaic']:
         create_mosaic_footprint(
-            footprint[survey], os.path.join(workdir, 'footprint_mosaic')
+            footprint[survey], os.path.join(workdir, 'footprint_mosaic'), 
+            param_cfg['admin']['nthreads_max'], 
+            footprint[survey].get('stream_nrows')
         )
         param_data['footprint'][survey]['mosaic']['dir'] = os.path.join(
             workdir, 'footprint_mosaic'
         )
 
+    # persistent mosaic indexes (see mosaic_index)
+    create_directory(os.path.join(workdir, 'mosaic_index'))
+    for product in ('galcat', 'footprint'):
+        if 'index' not in param_data[product][survey]['mosaic']:
+            param_data[product][survey]['mosaic']['index'] = os.path.join(
+                workdir, 'mosaic_index', product+'_'+survey+'.fits'
+            )
+
+    # galcat / footprint mosaics => per pixel / column npy cache 
+    for product in ('galcat', 'footprint'):
+        if input_data_structure[survey].get(product+'_npy_cache', False):
+            npy_cache_dir(param_cfg, param_data, product)
+            create_mosaic_npy_cache(
+                param_data[product][survey], 
+                param_cfg['admin']['nthreads_max']
+            )
     return param_data
 
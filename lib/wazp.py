@@ -8,7 +8,6 @@ import  astropy.coordinates
 from astropy.table import Table
 from astropy.coordinates import SkyCoord
 from astropy.convolution import convolve, Gaussian1DKernel
-from astropy.cosmology.core import FlatLambdaCDM as flat
 from astropy import units as u
 import numpy as np
 import matplotlib.pyplot as plt
@@ -21,18 +20,33 @@ from scipy import interpolate
 from scipy.interpolate import griddata
 from skimage.feature import peak_local_max
 import logging 
-import yaml
 import subprocess
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from .utils import join_struct_arrays, dist_ang
 from .utils import _mstar_, makeHealpixMap, radec_window_area
 from .utils import area_ann_deg2, hpx_in_annulus, sub_hpix, cond_in_disc
 from .utils import create_directory, tile_radius, concatenate_clusters
-from .utils import read_mosaicFitsCat_in_disc, read_mosaicFootprint_in_disc
 from .utils import read_FitsCat, read_mosaicFitsCat_in_hpix
 from .utils import read_mosaicFootprint_in_hpix, add_hpx_to_cat
 from .utils import add_clusters_unique_id, create_tile_specs
-from .utils import hpx_degrade
+from .utils import hpx_degrade, prefetch_tile_data, prefetch_next_tile
+from .utils import cosmology, pixel_lut, lut_rows, read_stage_table
+from .utils import footprint_lut, as_footprint_lut
+from .context import get_run_context
+from .starlet import starlet_filter
+from .weights import zp_weight
+from .weights import map_detlum_weight, map_lum_weight
+from .manifest import stage_done, commit_stage, stage_hash, config_section
+from .manifest import file_hash, dir_signature, save_npy, write_table
+from .manifest import load_artifact, artifact_filename
+from .manifest import atomic_path
+from .pmem import tile_radius_pmem
+from .multithread import merge_tiles_info
 
 def tile_dir_name(workdir, tile_nr):
     return os.path.join(workdir, 'tiles', 'tile_'+str(tile_nr).zfill(3))
@@ -113,44 +127,16 @@ def compute_zpslices(zp_metrics, wazp_cfg, zs_targ, output):
     return read_FitsCat(output)
 
 
-def zp_weight_fct(zsl, zsl_min, zsl_max, x):
-    sig = (zsl_max - zsl_min)/4.
-    if x < zsl-sig:
-        weight =  (1./sig)*x + 2. - (1./sig)*zsl
-    if x > zsl+sig:
-        weight = -(1./sig)*x + 2. + (1./sig)*zsl
-    if (x >= zsl-sig) &  (x <= zsl+sig):
-        weight = 1.
-    return weight
-
-def zp_weight (zsl, zsl_min, zsl_max, zp):
-    weight_fct_vec = np.vectorize(zp_weight_fct)
-    weight = weight_fct_vec(zsl, zsl_min, zsl_max,zp)
-    return weight
-
-def detlum_weight(mag, mstar, power):
-    weight = np.ones(len(mag))
-    mag1 = mag[(mag<mstar)]
-    weight[(mag<mstar)] = 10**((-mag1 + mstar)/power)
-    return weight
-
-
-def lum_weight(mag, mstar, power):
-    weight = np.ones(len(mag))
-    weight = 10**((-mag + mstar)/power)
-    return weight
-
-
 def bkg_from_hpx_counts (dat_footprint, footprint, ra, dec, weights):
 
     Nside, nest = footprint['Nside'], footprint['nest']
+    fp_lut = as_footprint_lut(dat_footprint, footprint)
     ghpx = hp.ang2pix(Nside, ra, dec, nest, lonlat=True)
-    fhpx = dat_footprint[footprint['key_pixel']]
-    idkept = np.isin(ghpx, fhpx)
-    ghpx_kept_unique = np.unique(ghpx[idkept])
-    id_count0 = np.isin(
-        fhpx, ghpx_kept_unique, assume_unique=True, invert=True
-    )
+    fhpx = fp_lut['pixels']
+    grows = lut_rows(fp_lut, ghpx)
+    idkept = (grows >= 0)
+    id_count0 = np.ones(len(fhpx), dtype=bool)
+    id_count0[grows[idkept]] = False
     fhpx_count0 = fhpx[id_count0]
     counts0 = np.zeros(len(fhpx_count0))
     counts = makeHealpixMap(
@@ -166,7 +152,7 @@ def bkg_tile_slice (dat_galcat, dat_footprint, galcat, footprint,
                     zpslices, mstar_file, wazp_cfg, cosmo_params, 
                     dmag_faint, weight_mode):
 
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
     ra, dec, weight = select_galaxies_in_slice(
         dat_galcat, galcat, wazp_cfg, 
         zpslices, mstar_file, dmag_faint, weight_mode
@@ -213,10 +199,9 @@ def bkg_tile (dat_galcat, dat_footprint, galcat, footprint,
     return data_bkg
 
 
-def create_wcs_at_z(wazp_cfg, tile_specs, z, cosmo_params):
-
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
-    racen, deccen = tile_specs['ra'], tile_specs['dec']
+def pixel_scale_at_z(wazp_cfg, tile_specs, z, cosmo_params):
+    # pixel size (deg) and image size of the slice images at z
+    cosmo = cosmology(cosmo_params)
     pix_mpc = 1./float(wazp_cfg['resolution'])
     conv_factor = cosmo.angular_diameter_distance(z)# radian*conv=mpc    
     pix_deg = np.degrees( pix_mpc / conv_factor.value)
@@ -224,6 +209,15 @@ def create_wcs_at_z(wazp_cfg, tile_specs, z, cosmo_params):
     nxy = int(2.*tile_specs['radius_tile_deg']/pix_deg) + 1
     if (nxy % 2) == 0:
         nxy+=1
+    return pix_deg, nxy
+
+
+def create_wcs_at_z(wazp_cfg, tile_specs, z, cosmo_params):
+
+    racen, deccen = tile_specs['ra'], tile_specs['dec']
+    pix_deg, nxy = pixel_scale_at_z(
+        wazp_cfg, tile_specs, z, cosmo_params
+    )
 
     w = wcs.WCS(naxis=2)
     w.wcs.crpix = [nxy/2., nxy/2.]
@@ -236,7 +230,7 @@ def create_wcs_at_z(wazp_cfg, tile_specs, z, cosmo_params):
 def vmap_from_hpx (dat_hpx, footprint, tile_specs, wazp_cfg, cosmo_params, zsl):
 
     Nside, nest = footprint['Nside'], footprint['nest']
-    hpx = dat_hpx[footprint['key_pixel']]
+    fp_lut = as_footprint_lut(dat_hpx, footprint)
 
     # build vmap image header
     wvmap, nxy = create_wcs_at_z(wazp_cfg, tile_specs, zsl, cosmo_params)
@@ -251,7 +245,8 @@ def vmap_from_hpx (dat_hpx, footprint, tile_specs, wazp_cfg, cosmo_params, zsl):
 
     # get mask info for each pixel of vmap
     hpx_map = hp.ang2pix(Nside, ra_map0, dec_map0, nest, lonlat=True)
-    vmap[xvr0[np.isin(hpx_map, hpx)], yvr0[np.isin(hpx_map, hpx)]] = 1.
+    in_fp = (lut_rows(fp_lut, hpx_map) >= 0)
+    vmap[xvr0[in_fp], yvr0[in_fp]] = 1.
     return vmap
 
 def map2fits(imap, wazp_cfg, tile, zsl, cosmo_params, fitsname):
@@ -265,34 +260,111 @@ def map2fits(imap, wazp_cfg, tile, zsl, cosmo_params, fitsname):
     return
 
 
-def map_detlum_weight(mag, mstar, wazp_cfg):
-
-    weight = np.ones(len(mag))
-    if wazp_cfg['map_lum_weight_mode'] == True:
-        weight = detlum_weight(mag, mstar, wazp_cfg['lum_weight_map_power'])
-    return weight
-
-def map_lum_weight(mag, mstar, wazp_cfg):
-
-    weight = np.ones(len(mag))
-    if wazp_cfg['map_lum_weight_mode'] == True:
-        weight = lum_weight(mag, mstar, wazp_cfg['lum_weight_map_power'])
-    return weight
-
-
 def pixelized_radec(ra_map, dec_map, weight_map, w, nxy):
 
-    xmap=w.all_world2pix(ra_map,dec_map,1)[0] - 0.5
-    ymap=w.all_world2pix(ra_map,dec_map,1)[1] - 0.5
+    xmap, ymap = w.all_world2pix(ra_map,dec_map,1)
     xycat, xedges, yedges = np.histogram2d(
-        np.round(xmap, 1), np.round(ymap, 1), 
-        bins=nxy, range=((0,nxy),(0,nxy)), normed=None, weights=weight_map
+        np.round(xmap - 0.5, 1), np.round(ymap - 0.5, 1), 
+        bins=nxy, range=((0,nxy),(0,nxy)), weights=weight_map
     )
     return xycat
 
 
+def tile_iwc(ra, dec, tile_specs):
+    """
+    Intermediate world coordinates (deg) of the ZEA projection centred 
+    on the tile (RA---ZEA / DEC--ZEA, LONPOLE 180), common to all the 
+    slice wcs of create_wcs_at_z which only differ by their cdelt : 
+    pixel = crpix + iwc / cdelt. Computed with numpy (no wcs object).
+    """
+    ra0, dec0 = np.radians(tile_specs['ra']), np.radians(tile_specs['dec'])
+    ra, dec = np.radians(ra), np.radians(dec)
+    cos_dec, sin_dec, cos_dra = np.cos(dec), np.sin(dec), np.cos(ra - ra0)
+    # native spherical coordinates (pole of the projection = tile center)
+    sin_theta = np.clip(
+        sin_dec*math.sin(dec0) + cos_dec*math.cos(dec0)*cos_dra, -1., 1.
+    )
+    phi = np.arctan2(
+        -cos_dec*np.sin(ra - ra0), 
+        sin_dec*math.cos(dec0) - cos_dec*math.sin(dec0)*cos_dra
+    ) + np.pi
+    r_theta = np.degrees(np.sqrt(2.*(1. - sin_theta)))
+    return r_theta*np.sin(phi), -r_theta*np.cos(phi)
+
+
+def gridded_iwc(xiw, yiw, weight_map, pix_deg, nxy):
+    """
+    Weighted image of the slice (as pixelized_radec with the wcs of 
+    create_wcs_at_z) from the tile iwc : rescaled to pixels, rounded 
+    and binned with bincount (last bin closed as for histogram2d).
+    """
+    xmap = np.round(nxy/2. - xiw/pix_deg - 0.5, 1)
+    ymap = np.round(nxy/2. + yiw/pix_deg - 0.5, 1)
+    inside = (xmap >= 0.) & (xmap <= nxy) & (ymap >= 0.) & (ymap <= nxy)
+    ix = np.minimum(xmap[inside].astype(int), nxy-1)
+    iy = np.minimum(ymap[inside].astype(int), nxy-1)
+    weight = np.broadcast_to(weight_map, np.shape(xmap))[inside]
+    return np.bincount(
+        ix*nxy + iy, weights=weight, minlength=nxy*nxy
+    ).reshape(nxy, nxy)
+
+
+def galaxy_zp_index(dat_galcat, galcat, cache_size=256, tile_specs=None):
+    """
+    Index of the galaxies of a tile for select_galaxies_in_slice : 
+    zp sorted once (with the mags alongside), a slice is then a 
+    searchsorted range on which only the mag cuts are evaluated. 
+    The selections (rows + weights) are cached by slice, dmag and 
+    weight mode (cache_size most recent ones, shared by the threads). 
+    With tile_specs, the tile iwc of the galaxies (catalog order) are 
+    computed once for the slice images (slice_catimages). 
+    """
+    zp = np.asarray(dat_galcat[galcat['keys']['key_zp']], dtype='f8')
+    order = np.argsort(zp, kind='stable')
+    iwc = None
+    if tile_specs is not None:
+        iwc = tile_iwc(
+            dat_galcat[galcat['keys']['key_ra']], 
+            dat_galcat[galcat['keys']['key_dec']], tile_specs
+        )
+    return {
+        'data':dat_galcat, 
+        'order':order, 
+        'zp':zp[order], 
+        'mag':np.asarray(
+            dat_galcat[galcat['keys']['key_mag']], dtype='f8'
+        )[order],
+        'iwc':iwc, 
+        'cache':OrderedDict(), 
+        'cache_size':cache_size, 
+        'lock':threading.Lock()
+    }
+
+
 def select_galaxies_in_slice(dat_galcat, galcat, wazp_cfg, zpslices, 
-                             mstar_file, dmag_faint, weight_mode):
+                             mstar_file, dmag_faint, weight_mode, 
+                             return_rows=False):
+    # dat_galcat = galaxies or their galaxy_zp_index
+    # return_rows => also the selection (mask or rows) in dat_galcat
+    index = dat_galcat if isinstance(dat_galcat, dict) else None
+    if index is not None:
+        dat_galcat = index['data']
+        key = (float(zpslices['zsl']), float(zpslices['zsl_min']), 
+               float(zpslices['zsl_max']), float(dmag_faint), weight_mode, 
+               mstar_file, float(wazp_cfg['dmag_bright']))
+        with index['lock']:
+            selection = index['cache'].get(key)
+            if selection is not None:
+                index['cache'].move_to_end(key)
+        if selection is not None:
+            rows, weight_map = selection
+            if return_rows:
+                return dat_galcat[galcat['keys']['key_ra']][rows],\
+                    dat_galcat[galcat['keys']['key_dec']][rows],\
+                    weight_map, rows
+            return dat_galcat[galcat['keys']['key_ra']][rows],\
+                dat_galcat[galcat['keys']['key_dec']][rows], weight_map
+
     ra, dec = dat_galcat[galcat['keys']['key_ra']],\
               dat_galcat[galcat['keys']['key_dec']]
     mag = dat_galcat[galcat['keys']['key_mag']]
@@ -304,10 +376,19 @@ def select_galaxies_in_slice(dat_galcat, galcat, wazp_cfg, zpslices,
     dmag_bright = wazp_cfg['dmag_bright']
     mag_min, mag_max_det = mstar - dmag_bright, mstar + dmag_faint
 
-    cond_for_wmap = ((zp<np.float64(zsl_max)) & 
-                     (zp>np.float64(zsl_min)) &
-                     (mag<=np.float64(mag_max_det)) & 
-                     (mag>np.float64(mag_min)))  
+    if index is None:
+        cond_for_wmap = ((zp<np.float64(zsl_max)) & 
+                         (zp>np.float64(zsl_min)) &
+                         (mag<=np.float64(mag_max_det)) & 
+                         (mag>np.float64(mag_min)))  
+    else: # rows in catalog order => same outputs as the mask
+        i0 = np.searchsorted(index['zp'], np.float64(zsl_min), 'right')
+        i1 = np.searchsorted(index['zp'], np.float64(zsl_max), 'left')
+        mag_zp = index['mag'][i0:i1]
+        cond_for_wmap = np.sort(index['order'][i0:i1][
+            (mag_zp<=np.float64(mag_max_det)) & 
+            (mag_zp>np.float64(mag_min))
+        ])
     ra_map, dec_map = ra[cond_for_wmap], dec[cond_for_wmap]
     mag_map, zp_map = mag[cond_for_wmap], zp[cond_for_wmap]
     
@@ -321,10 +402,18 @@ def select_galaxies_in_slice(dat_galcat, galcat, wazp_cfg, zpslices,
         weight_map = zp_weight(
             zpslices['zsl'], 
             zsl_min, zsl_max, zp_map
-        ) * map_lum_weight(mag_map, mstar, wazp_cfg)
+        )
+        weight_map *= map_lum_weight(mag_map, mstar, wazp_cfg)
     if weight_mode == "zp":
         weight_map = zp_weight(zpslices['zsl'], zsl_min, zsl_max, zp_map)
 
+    if index is not None:
+        with index['lock']:
+            index['cache'][key] = (cond_for_wmap, weight_map)
+            if len(index['cache']) > index['cache_size']:
+                index['cache'].popitem(last=False)
+    if return_rows:
+        return ra_map, dec_map, weight_map, cond_for_wmap
     return ra_map, dec_map, weight_map
 
 
@@ -355,9 +444,9 @@ def select_zps_cylinder(dcyl, dgal, galcat, zpslices, mstar_file, cosmo, wazp_sp
 
 
 def select_cells_from_footprint(Nside_cell, data_fp, footprint):
-
-    hpix_map, frac_map = data_fp[footprint['key_pixel']],\
-                         data_fp[footprint['key_frac']]
+    # data_fp = footprint or its footprint_lut
+    fp_lut = as_footprint_lut(data_fp, footprint)
+    hpix_map, frac_map = fp_lut['pixels'], fp_lut['frac']
     pix_out, pix_val = hpx_degrade(
         hpix_map, footprint['Nside'], footprint['nest'], 
         Nside_cell, footprint['nest']
@@ -389,15 +478,17 @@ def stats_counts_in_cells(counts, ncmax):
 
 
 def counts_in_cells(ra, dec, Nside, data_fp, footprint, ncmax):
+    # data_fp = footprint or its footprint_lut
 
     # select galaxies in cells 
-    hpix_cells_inf = select_cells_from_footprint(Nside, data_fp, footprint)
+    hpix_cells_inf = np.sort(
+        select_cells_from_footprint(Nside, data_fp, footprint)
+    )
     hpixg = hp.ang2pix(Nside, ra, dec, footprint['nest'], lonlat=True)
-    hpixgc = hpixg[np.isin(hpixg, hpix_cells_inf)]
-    # counts in cells 
-    hpixgc_unique, counts = np.unique(hpixgc, return_counts=True)
-    hpixgc_nogal = hpix_cells_inf[np.isin(hpix_cells_inf, hpixgc_unique, invert=True)]
-    counts_all = np.hstack((counts, np.zeros(len(hpixgc_nogal)).astype(int)))
+    rows = lut_rows(pixel_lut(hpix_cells_inf), hpixg)
+    # counts in cells (cells with galaxies by increasing pixel, then empty)
+    counts = np.bincount(rows[rows>=0], minlength=len(hpix_cells_inf))
+    counts_all = np.hstack((counts[counts>0], counts[counts==0]))
     return  stats_counts_in_cells(counts_all, ncmax)
 
 
@@ -406,7 +497,7 @@ def bkg_global_survey(galcat, footprint, tiles_filename, zpslices_filename,
 
     area_min = wazp_cfg['gbkg_area']
     # select galcat and associated footprint to reach some minimum area in the survey 
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
     tiles = read_FitsCat(tiles_filename)
     zpslices = read_FitsCat(zpslices_filename)
     irev = np.argsort(-tiles['eff_area_deg2'])
@@ -448,7 +539,7 @@ def bkg_global(data_gal, galcat, data_fp, footprint,
     radius_snr_mpc = wazp_cfg['radius_snr_mpc']
     # select galcat and associated footprint to reach 
     # some minimum area in the survey 
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
     zpslices = read_FitsCat(zpslices_filename)
 
     beta_snr, ksi2_snr = np.zeros(len(zpslices)), np.zeros(len(zpslices))
@@ -460,6 +551,7 @@ def bkg_global(data_gal, galcat, data_fp, footprint,
     # effective used area 
     area_eff = float(len(data_fp)) *\
                hp.nside2pixarea(footprint['Nside'], degrees=True)
+    fp_lut = footprint_lut(data_fp, footprint) # for the counts in cells
 
     # loop over zsl and select resolution 
     jinf, jsup = np.zeros(len(zpslices)).astype(int),\
@@ -476,15 +568,16 @@ def bkg_global(data_gal, galcat, data_fp, footprint,
                 break
 
     # degrade footprint to cell Nside and keep hpixels with detfrac = 1
+    gal_index = galaxy_zp_index(data_gal, galcat) # zp sorted once 
     for i in range(0, len(zpslices)):
         # stats - for wazp_snr
         # weight modes should be same as in add_peaks_attributes 
         ra, dec, Nweight = select_galaxies_in_slice(
-            data_gal, galcat, wazp_cfg, zpslices[i], 
+            gal_index, galcat, wazp_cfg, zpslices[i], 
             mstar_file, wazp_cfg['dmag_rich'], 'none'
         )
         ra, dec, Lweight = select_galaxies_in_slice(
-            data_gal, galcat, wazp_cfg, zpslices[i], 
+            gal_index, galcat, wazp_cfg, zpslices[i], 
             mstar_file, wazp_cfg['dmag_rich'], 'lum'
         )
         #   mean number of galaxies / cell weighted by lum or not
@@ -494,11 +587,11 @@ def bkg_global(data_gal, galcat, data_fp, footprint,
         # stats - for wazp_richness
         # weight modes should be same as in add_peaks_attributes 
         ra, dec, Nweight = select_galaxies_in_slice(
-            data_gal, galcat, wazp_cfg, zpslices[i], 
+            gal_index, galcat, wazp_cfg, zpslices[i], 
             mstar_file, wazp_cfg['dmag_det'], 'zp'
         )
         ra, dec, Lweight = select_galaxies_in_slice(
-            data_gal, galcat, wazp_cfg, zpslices[i], 
+            gal_index, galcat, wazp_cfg, zpslices[i], 
             mstar_file, wazp_cfg['dmag_det'], 'zplum'
         )
         lbar0_snr[i] = cell_area[i] *  np.sum(Lweight)/area_eff
@@ -509,16 +602,16 @@ def bkg_global(data_gal, galcat, data_fp, footprint,
         # used to compute SNR @ dmag_det
         # select galaxies in slice with dmag_rich and no lum weight
         ra, dec, weight = select_galaxies_in_slice(
-            data_gal, galcat, wazp_cfg, zpslices[i], 
+            gal_index, galcat, wazp_cfg, zpslices[i], 
             mstar_file, wazp_cfg['dmag_det'], 'none'
         )
 
         #stats Counts in Cells 
         nbar_inf, ksi2_inf = counts_in_cells(
-            ra, dec, 2**jinf[i], data_fp, footprint, wazp_cfg['ncmax']
+            ra, dec, 2**jinf[i], fp_lut, footprint, wazp_cfg['ncmax']
         )
         nbar_sup, ksi2_sup = counts_in_cells(
-            ra, dec, 2**jsup[i], data_fp, footprint, wazp_cfg['ncmax']
+            ra, dec, 2**jsup[i], fp_lut, footprint, wazp_cfg['ncmax']
         )
 
         #interpolate at nominal aperture area
@@ -557,9 +650,14 @@ def bkg_global(data_gal, galcat, data_fp, footprint,
 
 
 def compute_catimage(ra_map, dec_map, weight_map, zpslices, wazp_cfg, tile_specs, 
-                     cosmo_params):
-    w, nxy = create_wcs_at_z(wazp_cfg, tile_specs, zpslices['zsl'], cosmo_params)
-    xycat = pixelized_radec (ra_map, dec_map, weight_map, w, nxy)
+                     cosmo_params, iwc=None):
+    # iwc = tile iwc of the galaxies if already known (tile_iwc)
+    pix_deg, nxy = pixel_scale_at_z(
+        wazp_cfg, tile_specs, zpslices['zsl'], cosmo_params
+    )
+    if iwc is None:
+        iwc = tile_iwc(ra_map, dec_map, tile_specs)
+    xycat = gridded_iwc(iwc[0], iwc[1], weight_map, pix_deg, nxy)
     return xycat
 
 
@@ -586,15 +684,16 @@ def randoms_in_spherical_cap(tile, bkg_arcmin2):
 
 
 def compute_filled_catimage(ra_map, dec_map, weight_map, zpslices, wazp_cfg, tile, 
-                            cosmo_params, data_footprint, footprint, bkg_arcmin2):
+                            cosmo_params, data_footprint, footprint, bkg_arcmin2,
+                            iwc=None):
 
     # find edge pixels of the footprint 
+    fp_lut = as_footprint_lut(data_footprint, footprint)
     nlist = hp.get_all_neighbours(
-        footprint['Nside'], 
-        data_footprint[footprint['key_pixel']], None, footprint['nest']
+        footprint['Nside'], fp_lut['pixels'], None, footprint['nest']
     )
-    mask = np.isin(nlist, data_footprint[footprint['key_pixel']])
-    edge_pixels = data_footprint[footprint['key_pixel']][(np.sum(mask, axis=0)<8)]
+    mask = (lut_rows(fp_lut, nlist) >= 0)
+    edge_pixels = fp_lut['pixels'][(np.sum(mask, axis=0)<8)]
 
     # find empty footprint pixels at resolution Nside*2
     sub_edge_hpix = sub_hpix(edge_pixels, footprint['Nside'], footprint['nest'])
@@ -628,12 +727,9 @@ def compute_filled_catimage(ra_map, dec_map, weight_map, zpslices, wazp_cfg, til
         footprint['Nside'], 
         ra_ran, dec_ran, footprint['nest'], lonlat=True
     )
-    ra_ranf1 = ra_ran[np.isin(
-        hpx_ran1, data_footprint[footprint['key_pixel']], invert=True
-    )]
-    dec_ranf1 = dec_ran[np.isin(
-        hpx_ran1, data_footprint[footprint['key_pixel']], invert=True
-    )]
+    out_fp = (lut_rows(fp_lut, hpx_ran1) < 0)
+    ra_ranf1 = ra_ran[out_fp]
+    dec_ranf1 = dec_ran[out_fp]
     hpx_ran2 = hp.ang2pix(
         footprint['Nside']*2, 
         ra_ran, dec_ran, footprint['nest'], lonlat=True
@@ -644,13 +740,18 @@ def compute_filled_catimage(ra_map, dec_map, weight_map, zpslices, wazp_cfg, til
     # stack galaxies + randoms 
     ra_ranf1, dec_ranf1 = np.hstack((ra_ranf1, ra_ranf2)),\
                           np.hstack((dec_ranf1, dec_ranf2))
-    ra_all, dec_all   = np.hstack((ra_ranf1,  ra_map)),\
-                        np.hstack((dec_ranf1,  dec_map))
+    if iwc is None:
+        iwc = tile_iwc(ra_map, dec_map, tile)
+    iwc_ran = tile_iwc(ra_ranf1, dec_ranf1, tile)
+    xiw_all, yiw_all = np.hstack((iwc_ran[0], iwc[0])),\
+                       np.hstack((iwc_ran[1], iwc[1]))
     weight_all = np.hstack((np.ones(len(ra_ranf1)), weight_map))
 
     # build catalogue image 
-    w, nxy = create_wcs_at_z(wazp_cfg, tile, zpslices['zsl'], cosmo_params)
-    xycat = pixelized_radec (ra_all, dec_all, weight_all, w, nxy)
+    pix_deg, nxy = pixel_scale_at_z(
+        wazp_cfg, tile, zpslices['zsl'], cosmo_params
+    )
+    xycat = gridded_iwc(xiw_all, yiw_all, weight_all, pix_deg, nxy)
     
     return xycat
 
@@ -708,8 +809,9 @@ def fits2map(wmap):
 
 
 def wmap2peaks(wmap, wazp_specs, tile_specs, zsl, cosmo_params):
+    # wmap = wavelet map fits file or map (in memory engine) 
     wmap_thresh = wazp_specs['wmap_thresh']
-    wmap_data = fits2map(wmap)
+    wmap_data = fits2map(wmap) if isinstance(wmap, str) else wmap
     w, nxy = create_wcs_at_z(wazp_specs, tile_specs, zsl, cosmo_params)
 
     # peak detection on wmap 
@@ -726,7 +828,7 @@ def wmap2peaks(wmap, wazp_specs, tile_specs, zsl, cosmo_params):
 def filter_peaks(tile, zsl, cosmo_params, resolution, ra0, dec0, ip0, jp0):
 
     if tile['hpix']>0: # not target mode
-        cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+        cosmo = cosmology(cosmo_params)
         err_mpc = (2./float(resolution))   # +/- 2 pixels around the tile 
         conv_factor = cosmo.angular_diameter_distance(zsl)
         err_deg = np.degrees( err_mpc/ conv_factor.value)
@@ -763,11 +865,12 @@ def filter_peaks(tile, zsl, cosmo_params, resolution, ra0, dec0, ip0, jp0):
 
 def coverfrac_disc(ra, dec, data_fp, footprint, radius_deg):
     
+    fp_lut = as_footprint_lut(data_fp, footprint)
     coverfrac = np.zeros(len(ra))
     for i in range(0, len(ra)):
         hpx_in_ann, frac_in_ann, area_deg2, coverfrac[i] = hpx_in_annulus (
             ra[i], dec[i], 0., radius_deg, 
-            data_fp, footprint, False
+            fp_lut, footprint, False
         )
     return coverfrac
 
@@ -1024,7 +1127,7 @@ def append_peaks_infos_to_cylinders(data_cylinders_init, peaks_list, zpslices_sp
 def make_cylinders(peaks_list, zpslices_specs, wazp_specs, cosmo_params ):
 
     rad_mpc = wazp_specs['radius_slice_matching']
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
     zsl = zpslices_specs['zsl']
 
     flag_min = 0
@@ -1420,7 +1523,7 @@ def cylinders2clusters (zpslices_specs, wazp_specs, tile_specs, clcat, data_cyl,
                         data_gal, galcat, out_paths, hpx_meta, verbose):
 
     clkeys = clcat['wazp']['keys']
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
 
     ip_fcyl = data_cyl['ip_cyl']
     ra_fcyl, dec_fcyl = data_cyl['ra_cyl'], data_cyl['dec_cyl']
@@ -1548,7 +1651,7 @@ def cl_duplicates_filtering(data_clusters_in, wazp_specs, clcat,
     clkeys = clcat['wazp']['keys']
     dmpc = wazp_specs['duplic_dist_mpc']
     nsigdz = wazp_specs['duplic_nsigdz']
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
 
     idecr = np.argsort(-data_clusters_in[clkeys['key_snr']])
     data_cl = data_clusters_in[idecr]
@@ -1599,7 +1702,7 @@ def cl_duplicates_filtering(data_clusters_in, wazp_specs, clcat,
 def append_infos_to_clusters(target, data_clusters_init, cosmo_params):
     # add distance to center for each cluster 
 
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
 
     ra_target, dec_target = target['ra'], target['dec']
     zcl = data_clusters_init['z']
@@ -1637,12 +1740,43 @@ def wave_radius(wmap_data, ip, jp, wazp_cfg):
     return radius_mpc
 
 
+def slice_catimages(tile, dat_galcat, dat_footprint, galcat, footprint,
+                    zpslices, mstar_file, wazp_cfg, cosmo_params):
+    # select objects for computing density maps 
+    ra_map, dec_map, weight_map, rows = select_galaxies_in_slice(
+        dat_galcat, galcat, wazp_cfg, zpslices, mstar_file, 
+        wazp_cfg['dmag_det'], 'detlum', return_rows=True
+    )
+    iwc = None # tile iwc projected once by galaxy_zp_index
+    if isinstance(dat_galcat, dict) and dat_galcat['iwc'] is not None:
+        iwc = dat_galcat['iwc'][0][rows], dat_galcat['iwc'][1][rows]
+    xycat = compute_catimage(
+        ra_map, dec_map, weight_map, 
+        zpslices, wazp_cfg, tile, cosmo_params, iwc
+    ) 
+    # compute bkg without weights for filling image holes => mr_filter
+    if wazp_cfg['map_filling']:
+        bkg_arcmin2, bkg_mpc2 = bkg_tile_slice(
+            dat_galcat, dat_footprint, galcat, footprint, 
+            zpslices, mstar_file, wazp_cfg, cosmo_params, 
+            wazp_cfg['dmag_det'], 'none'
+        )
+        xycat_fi = compute_filled_catimage(
+            ra_map, dec_map, weight_map, 
+            zpslices, wazp_cfg, tile, cosmo_params, 
+            dat_footprint, footprint, bkg_arcmin2, iwc
+        )
+    else:
+        xycat_fi = np.copy(xycat)
+    return ra_map, xycat, xycat_fi
+
+
 def wazp_tile_slice(tile, dat_galcat, dat_footprint, galcat, footprint,
                     zpslices, gbkg, mstar_file, wazp_cfg, cosmo_params, 
                     paths, verbose):
     
     isl = zpslices['id']                                 
-    cosmo = flat(H0=cosmo_params['H'], Om0=cosmo_params['omega_M_0'])
+    cosmo = cosmology(cosmo_params)
     conv_factor = cosmo.angular_diameter_distance( zpslices['zsl']) 
     xycat_fitsname = os.path.join(
         paths['workdir_loc'], paths['wazp']['files'], 
@@ -1661,39 +1795,38 @@ def wazp_tile_slice(tile, dat_galcat, dat_footprint, galcat, footprint,
         "peaks_"+str(isl)+".fits"
     )
 
-    # select objects for computing density maps 
-    ra_map, dec_map, weight_map = select_galaxies_in_slice(
-        dat_galcat, galcat, wazp_cfg, zpslices, mstar_file, 
-        wazp_cfg['dmag_det'], 'detlum'
+    ra_map, xycat, xycat_fi = slice_catimages(
+        tile, dat_galcat, dat_footprint, galcat, footprint, 
+        zpslices, mstar_file, wazp_cfg, cosmo_params
     )
-    xycat = compute_catimage(
-        ra_map, dec_map, weight_map, 
-        zpslices, wazp_cfg, tile, cosmo_params
-    ) 
-    # compute bkg without weights for filling image holes => mr_filter
-    if wazp_cfg['map_filling']:
-        bkg_arcmin2, bkg_mpc2 = bkg_tile_slice(
-            dat_galcat, dat_footprint, galcat, footprint, 
-            zpslices, mstar_file, wazp_cfg, cosmo_params, 
-            wazp_cfg['dmag_det'], 'none'
-        )
-        xycat_fi = compute_filled_catimage(
-            ra_map, dec_map, weight_map, 
-            zpslices, wazp_cfg, tile, cosmo_params, 
-            dat_footprint, footprint, bkg_arcmin2
-        )
-    else:
-        xycat_fi = np.copy(xycat)
 
     # build density map /  extract peaks /compute attributes and filter 
-    if not os.path.isfile(wmap_fitsname):
-        map2fits(
-            xycat_fi, wazp_cfg, tile, zpslices['zsl'], cosmo_params, xycat_fi_fitsname
+    if wazp_cfg['wavelet_engine'] == 'starlet': # in memory, no re-entry
+        wmap_data = starlet_filter(
+            xycat_fi, wazp_cfg, dtype=wazp_cfg['wavelet_dtype']
         )
-        run_mr_filter(xycat_fi_fitsname, wmap_fitsname, wazp_cfg)
-    wmap_data = fits2map(wmap_fitsname)
+        if verbose >=2:
+            map2fits(
+                wmap_data, wazp_cfg, tile, zpslices['zsl'], cosmo_params, 
+                wmap_fitsname
+            )
+    else:
+        if not stage_done(paths['workdir_loc'], 'wmap_'+str(isl), 
+                          paths['stage_hash']):
+            map2fits(
+                xycat_fi, wazp_cfg, tile, zpslices['zsl'], cosmo_params, 
+                xycat_fi_fitsname
+            )
+            run_mr_filter(
+                xycat_fi_fitsname, atomic_path(wmap_fitsname), wazp_cfg
+            )
+            os.replace(atomic_path(wmap_fitsname), wmap_fitsname)
+            commit_stage(
+                paths['workdir_loc'], 'wmap_'+str(isl), paths['stage_hash']
+            )
+        wmap_data = fits2map(wmap_fitsname)
     rap0, decp0, ip0, jp0 = wmap2peaks(
-        wmap_fitsname, wazp_cfg, tile, zpslices['zsl'], cosmo_params
+        wmap_data, wazp_cfg, tile, zpslices['zsl'], cosmo_params
     )
     rap, decp, ip, jp = filter_peaks(
         tile, zpslices['zsl'], cosmo_params, wazp_cfg['resolution'], 
@@ -1759,6 +1892,75 @@ def wazp_tile_slice(tile, dat_galcat, dat_footprint, galcat, footprint,
     return data_peaks[data_peaks['snr']>=wazp_cfg['snr_min']]
 
 
+def wazp_slice_peaks(isl, tile_specs, data_gal_tile, data_fp_tile, 
+                     galcat, footprint, zpslices, gbkg, mstar_file, 
+                     wazp_cfg, cosmo_params, out_paths, verbose):
+    # peaks of slice isl with re-entry on peaks_<isl>.npy
+    peaks_file = os.path.join(
+        out_paths['workdir_loc'], out_paths['wazp']['files'], 
+        'peaks_'+str(isl)+'.npy'
+    )
+    if not stage_done(
+            out_paths['workdir_loc'], 'peaks_'+str(isl), 
+            out_paths['stage_hash']
+    ):
+        print ('.............. Detection in slice ', isl)
+        data_peaks = wazp_tile_slice(
+            tile_specs, data_gal_tile, data_fp_tile, galcat, footprint,
+            zpslices[isl], gbkg[isl], mstar_file, wazp_cfg, cosmo_params, 
+            out_paths, verbose)
+        save_npy(peaks_file, data_peaks)
+        commit_stage(
+            out_paths['workdir_loc'], 'peaks_'+str(isl), 
+            out_paths['stage_hash']
+        )
+        return data_peaks, False
+    print ('.............. Use existing detections in slice ', isl)
+    return load_artifact(peaks_file), True
+
+
+# tile inputs shared by the forked slice workers (set by wazp_slices_peaks)
+_slice_args = None 
+
+
+def wazp_slice_peaks_forked(isl):
+    return wazp_slice_peaks(isl, *_slice_args)
+
+
+def wazp_slices_peaks(nslices, slice_args, wazp_cfg):
+    """
+    Runs wazp_slice_peaks on all slices of a tile, sequentially or 
+    on wazp_cfg['nthreads_slices'] threads / forked processes. 
+    Workers share the tile galaxies and footprint (no copy) : 
+    threads by construction, processes through fork. 
+    Results are returned in slice order. 
+    """
+    global _slice_args
+    nworkers = min(int(wazp_cfg['nthreads_slices']), nslices)
+    if nworkers <= 1:
+        return [wazp_slice_peaks(isl, *slice_args) for isl in range(nslices)]
+
+    if wazp_cfg['slices_parallel_mode'] == 'processes':
+        _slice_args = slice_args
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=nworkers, 
+                    mp_context=multiprocessing.get_context('fork')
+            ) as executor:
+                slices_peaks = list(
+                    executor.map(wazp_slice_peaks_forked, range(nslices))
+                )
+        finally:
+            _slice_args = None
+        return slices_peaks
+
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        slices_peaks = list(executor.map(
+            lambda isl: wazp_slice_peaks(isl, *slice_args), range(nslices)
+        ))
+    return slices_peaks
+
+
 def add_hpx_to_cat(data_gal, ra, dec, Nside_tmp, nest_tmp, keyname):
     ghpx = hp.ang2pix(Nside_tmp, ra, dec, nest_tmp, lonlat=True)
     t = Table (data_gal)
@@ -1783,42 +1985,30 @@ def wazp_tile(tile_specs, data_gal_tile, data_fp_tile, galcat, footprint,
     #                     zpslices, mstar_file, wazp_cfg, cosmo_params, wazp_cfg['dmag_det'], 'lum')
 
     Nclusters = 0
-    if not os.path.isfile(
-            os.path.join(
-                out_paths['workdir_loc'], out_paths['wazp']['results'], 
-                'clusters0.npy'
-            )
+    # detection statistics for the tile cost model (-1 = unknown)
+    npeaks_tot, nslices_peaks, resumed = -1, -1, False 
+    if not stage_done(
+            out_paths['workdir_loc'], 'clusters0', out_paths['stage_hash']
     ):
         peaks_list = []
-        npeaks_tot = 0
-        for isl in range (0, len(zpslices)):
-            if not os.path.isfile(
-                    os.path.join(
-                        out_paths['workdir_loc'], out_paths['wazp']['files'], 
-                        'peaks_'+str(isl)+'.npy'
-                    )
-            ):
-                print ('.............. Detection in slice ', isl)
-                data_peaks = wazp_tile_slice(
-                    tile_specs, data_gal_tile, data_fp_tile, galcat, footprint,
-                    zpslices[isl], gbkg[isl], mstar_file, wazp_cfg, cosmo_params, 
-                    out_paths, verbose)
-                np.save(
-                    os.path.join(
-                        out_paths['workdir_loc'], out_paths['wazp']['files'], 
-                        'peaks_'+str(isl)+'.npy'
-                    ), data_peaks
-                )
-                npeaks_tot += len(data_peaks)
-            else:
-                print ('.............. Use existing detections in slice ', isl)
-                data_peaks = np.load(
-                    os.path.join(
-                        out_paths['workdir_loc'], out_paths['wazp']['files'], 
-                        'peaks_'+str(isl)+'.npy'
-                    )
-                )
-                npeaks_tot += len(data_peaks)
+        npeaks_tot, nslices_peaks = 0, 0
+        # zp index of the galaxies / footprint lookup table shared by 
+        # all slices 
+        slices_peaks = wazp_slices_peaks(
+            len(zpslices), 
+            (tile_specs, 
+             galaxy_zp_index(data_gal_tile, galcat, tile_specs=tile_specs), 
+             footprint_lut(data_fp_tile, footprint), 
+             galcat, footprint,
+             zpslices, gbkg, mstar_file, wazp_cfg, cosmo_params, 
+             out_paths, verbose), 
+            wazp_cfg
+        )
+        for data_peaks, slice_resumed in slices_peaks:
+            npeaks_tot += len(data_peaks)
+            resumed = resumed or slice_resumed
+            if len(data_peaks) > 0:
+                nslices_peaks += 1
             peaks_list.append(data_peaks)        
 
         if npeaks_tot>0:
@@ -1840,12 +2030,16 @@ def wazp_tile(tile_specs, data_gal_tile, data_fp_tile, galcat, footprint,
                     mstar_file, cosmo_params, 
                     data_gal_tile, galcat, out_paths, footprint, verbose
                 )
-                np.save(
+                save_npy(
                     os.path.join(
                         out_paths['workdir_loc'], out_paths['wazp']['results'], 
                         'clusters0.npy'
                     ), data_clusters0
                 )
+                commit_stage(
+                    out_paths['workdir_loc'], 'clusters0', 
+                    out_paths['stage_hash']
+                )
                 if verbose >=1:
                     t = Table (data_clusters0)
                     t.write(os.path.join(
@@ -1858,7 +2052,8 @@ def wazp_tile(tile_specs, data_gal_tile, data_fp_tile, galcat, footprint,
             print ('..........No clusters in this tile')
     else:
         print ('..........Use existing clusters')
-        data_clusters0 = np.load(
+        resumed = True
+        data_clusters0 = load_artifact(
             os.path.join(
                 out_paths['workdir_loc'], out_paths['wazp']['results'], 
                 'clusters0.npy'
@@ -1876,28 +2071,79 @@ def wazp_tile(tile_specs, data_gal_tile, data_fp_tile, galcat, footprint,
         Nclusters = 0
 
     # write final tile recap for final concatenation of clusters
+    # and for the tile cost model (wall time filled by the caller) 
     tile_info = np.zeros( 1, 
-                          dtype={'names':('id', 'eff_area_deg2', 'Nclusters'),
-                                 'formats':('i8', 'f8', 'i8')}) 
+                          dtype={'names':('id', 'eff_area_deg2', 'Nclusters',
+                                          'Ngal', 'Nslices', 'Npeaks', 
+                                          'resumed', 'wall_time_s'),
+                                 'formats':('i8', 'f8', 'i8', 
+                                            'i8', 'i8', 'i8', 
+                                            'bool', 'f8')}) 
     tile_info['id'] = tile_specs['id']
     tile_info['eff_area_deg2'] = tile_specs['eff_area_deg2']
     tile_info['Nclusters'] = Nclusters
+    tile_info['Ngal'] = len(data_gal_tile)
+    tile_info['Nslices'] = nslices_peaks
+    tile_info['Npeaks'] = npeaks_tot
+    tile_info['resumed'] = resumed
     
     return data_clusters, tile_info 
 
 
 def run_wazp_tile(config, dconfig, thread_id):
-    # read config file
-    with open(config) as fstream:
-        param_cfg = yaml.load(fstream)
-    with open(dconfig) as fstream:
-        param_data = yaml.load(fstream)
+    # all tiles of a static thread group
+    run_wazp_tiles(config, dconfig, 'thread_id', thread_id)
+    return
+
+
+def run_wazp_1tile(config, dconfig, tile_id):
+    # single tile - entry point of the tile pool 
+    run_wazp_tiles(config, dconfig, 'id', tile_id)
+    return
+
+
+def wazp_tile_tasks(param_cfg, param_data, tiles):
+    # read_tile_data arguments of the detection in tiles 
+    survey = param_cfg['survey']
+    tile_radius_deg = tile_radius(param_cfg['admin']['tiling'])
+    tasks = []
+    for it in range(0, len(tiles)):
+        tile_dir = tile_dir_name(
+            param_cfg['out_paths']['workdir'], int(tiles['id'][it])
+        )
+        create_directory(tile_dir)
+        tasks.append((param_data['galcat'][survey], 
+                      param_data['footprint'][survey], 
+                      tiles[it], tile_radius_deg, param_cfg['maglim_det'], 
+                      tile_dir, param_cfg['tile_cache']))
+    return tasks
+
+
+def prefetch_wazp_1tile(config, dconfig, tile_id):
+    # background read of a tile a queue worker will likely claim next
+    ctx = get_run_context(config, dconfig, required=('tiles',))
+    admin = ctx['param_cfg']['admin']
+    if admin['prefetch']['ntiles'] <= 0:
+        return
+    tiles = ctx['tiles'][ctx['tiles']['id'] == int(tile_id)]
+    prefetch_next_tile(
+        wazp_tile_tasks(ctx['param_cfg'], ctx['param_data'], tiles)[0], 
+        admin['prefetch']['mem_budget_gb']
+    )
+    return
+
+
+def run_wazp_tiles(config, dconfig, tile_key, tile_value):
+    # configs + survey level inputs of the run 
+    ctx = get_run_context(
+        config, dconfig, required=('tiles', 'zpslices', 'gbkg')
+    )
+    param_cfg, param_data = ctx['param_cfg'], ctx['param_data']
 
     survey, ref_filter  = param_cfg['survey'], param_cfg['ref_filter']
-    maglim = param_cfg['maglim_det']
     galcat = param_data['galcat'][survey]
     clcat = param_cfg['clcat']
-    out_paths = param_cfg['out_paths']
+    out_paths = dict(param_cfg['out_paths']) # locally updated 
     admin = param_cfg['admin']
     footprint = param_data['footprint'][survey]
     zp_metrics = param_data['zp_metrics'][survey][ref_filter]
@@ -1905,39 +2151,28 @@ def run_wazp_tile(config, dconfig, thread_id):
     wazp_cfg = param_cfg['wazp_cfg']
 
     workdir = out_paths['workdir']
-    all_tiles = read_FitsCat(
-        os.path.join(workdir, admin['tiling']['tiles_filename'])
-    )
-    tiles = all_tiles[(all_tiles['thread_id']==int(thread_id))]    
-    print ('THREAD ', int(thread_id))
-
-    zpslices = read_FitsCat(
-        os.path.join(workdir, param_cfg['wazp_cfg']['zpslices_filename'])
-    )
-    gbkg = read_FitsCat(
-        os.path.join(workdir, 'gbkg', param_cfg['wazp_cfg']['gbkg_filename'])
+    all_tiles = ctx['tiles']
+    tiles = all_tiles[(all_tiles[tile_key]==int(tile_value))]    
+    print (tile_key, ' = ', int(tile_value))
+
+    zpslices, gbkg = ctx['zpslices'], ctx['gbkg']
+    det_hash = detection_hash(param_cfg, param_data)
+
+    # tile data of the next tile(s) read in background 
+    tile_radius_deg = tile_radius(admin['tiling'])
+    tiles_data = prefetch_tile_data(
+        wazp_tile_tasks(param_cfg, param_data, tiles), 
+        admin['prefetch']['ntiles'], admin['prefetch']['mem_budget_gb']
     )
 
     for it in range(0, len(tiles)):
-        tile_dir = os.path.join(
-            workdir, 'tiles', 
-            'tile_'+str(int(tiles['id'][it])).zfill(3)
-        )
+        (data_gal_tile, data_fp_tile), read_time = next(tiles_data)
+        t0 = time.time() - read_time
+        tile_dir = tile_dir_name(workdir, int(tiles['id'][it]))
         print ('..... Tile ', int(tiles['id'][it]))
 
-        create_directory(tile_dir)
         create_tile_directories(tile_dir, out_paths['wazp'])
         out_paths['workdir_loc'] = tile_dir # local update 
-        tile_radius_deg = tile_radius(admin['tiling'])
-        data_gal_tile = read_mosaicFitsCat_in_disc(
-            galcat, tiles[it], tile_radius_deg
-        )   
-        data_gal_tile = data_gal_tile\
-                        [data_gal_tile[galcat['keys']['key_mag']]<=\
-                         np.float64(maglim)]
-        data_fp_tile = read_mosaicFootprint_in_disc(
-            footprint, tiles[it], tile_radius_deg
-        )
         tile_specs = create_tile_specs(
             tiles[it], tile_radius_deg, admin, 
             None, None, 
@@ -1950,34 +2185,78 @@ def run_wazp_tile(config, dconfig, thread_id):
             t = Table (data_fp_tile)
             t.write(os.path.join(tile_dir, "footprint.fits"),overwrite=True)
         
-        if not os.path.isfile(
-                os.path.join(
-                    tile_dir, out_paths['wazp']['results'], 
-                    "clusters.fits"
-                )
-        ):
+        out_paths['stage_hash'] = stage_hash(det_hash, int(tiles['id'][it]))
+        if not stage_done(tile_dir, 'clusters', out_paths['stage_hash']):
             data_clusters, tile_info = wazp_tile(
                 tile_specs, data_gal_tile, data_fp_tile, galcat, footprint, 
                 zpslices, gbkg, zp_metrics, magstar_file, 
                 wazp_cfg, clcat, param_cfg['cosmo_params'], 
                 out_paths, param_cfg['verbose'] ) 
 
+            clusters_file = os.path.join(
+                tile_dir, out_paths['wazp']['results'], "clusters.fits"
+            )
             if data_clusters is not None:
-                t = Table (data_clusters)#, names=names)
-                t.write(
-                    os.path.join(
-                        tile_dir, out_paths['wazp']['results'], 
-                        "clusters.fits"
-                    ),overwrite=True
-                )
-            tile_info = Table(tile_info)
-            tile_info.write(os.path.join(
-                out_paths['workdir_loc'], out_paths['wazp']['results'], 
-                "tile_info.fits"
-            ), overwrite=True)
+                write_table(clusters_file, data_clusters, artifact=True)
+            else: # from a previous config
+                for f in (clusters_file, artifact_filename(clusters_file)):
+                    if os.path.isfile(f):
+                        os.remove(f)
+            tile_info['wall_time_s'] = time.time() - t0
+            write_table(
+                os.path.join(
+                    out_paths['workdir_loc'], out_paths['wazp']['results'], 
+                    "tile_info.fits"
+                ), tile_info, artifact=True
+            )
+            commit_stage(tile_dir, 'clusters', out_paths['stage_hash'])
     return
 
 
+def detection_hash(param_cfg, param_data):
+    """
+    Hash of all parameters and inputs the detection in a tile 
+    depends on (execution only keys and verbosity excluded)
+    """
+    survey, ref_filter  = param_cfg['survey'], param_cfg['ref_filter']
+    workdir = param_cfg['out_paths']['workdir']
+    galcat = param_data['galcat'][survey]
+    footprint = param_data['footprint'][survey]
+    return stage_hash(
+        config_section(param_cfg['wazp_cfg']), param_cfg['cosmo_params'], 
+        param_cfg['admin']['tiling'], param_cfg['maglim_det'], 
+        param_cfg['clcat'], galcat, footprint, 
+        param_data['zp_metrics'][survey][ref_filter],
+        file_hash(os.path.join(
+            workdir, param_cfg['wazp_cfg']['zpslices_filename']
+        )), 
+        file_hash(os.path.join(
+            workdir, 'gbkg', param_cfg['wazp_cfg']['gbkg_filename']
+        )), 
+        file_hash(param_data['magstar_file'][survey][ref_filter]), 
+        dir_signature(galcat['mosaic']['dir']), 
+        dir_signature(footprint['mosaic']['dir'])
+    )
+
+
+def gbkg_hash(param_cfg, param_data):
+    # hash of the parameters / inputs of the global background 
+    survey, ref_filter  = param_cfg['survey'], param_cfg['ref_filter']
+    workdir = param_cfg['out_paths']['workdir']
+    galcat = param_data['galcat'][survey]
+    footprint = param_data['footprint'][survey]
+    return stage_hash(
+        config_section(param_cfg['wazp_cfg']), param_cfg['cosmo_params'], 
+        param_cfg['admin']['tiling'], galcat, footprint, 
+        file_hash(os.path.join(
+            workdir, param_cfg['wazp_cfg']['zpslices_filename']
+        )), 
+        file_hash(param_data['magstar_file'][survey][ref_filter]), 
+        dir_signature(galcat['mosaic']['dir']), 
+        dir_signature(footprint['mosaic']['dir'])
+    )
+
+
 def tiles_with_clusters(out_paths, all_tiles):
     flag = np.zeros(len(all_tiles))
     for it in range(0, len(all_tiles)):
@@ -1990,7 +2269,7 @@ def tiles_with_clusters(out_paths, all_tiles):
                     "tile_info.fits"
                 )
         ):
-            if read_FitsCat(
+            if read_stage_table(
                     os.path.join(
                         tile_dir, out_paths['wazp']['results'], 
                         "tile_info.fits"
@@ -2004,6 +2283,24 @@ def tiles_with_clusters(out_paths, all_tiles):
     return all_tiles[flag==1]
 
 
+def wazp_tiles_info(out_paths, all_tiles, outfile):
+    # gather tile recaps (timings + detection stats) for the cost model
+    # (merged per tile with the timed records already in outfile)
+    tiles_info = []
+    for it in range(0, len(all_tiles)):
+        info_file = os.path.join(
+            tile_dir_name(out_paths['workdir'], int(all_tiles['id'][it])), 
+            out_paths['wazp']['results'], "tile_info.fits"
+        )
+        if os.path.isfile(info_file):
+            tile_info = read_stage_table(info_file)
+            if 'wall_time_s' in tile_info.dtype.names:
+                tiles_info.append(tile_info)
+    if len(tiles_info) > 0:
+        merge_tiles_info(tiles_info, outfile)
+    return
+
+
 def wazp_concatenate(all_tiles, zpslices_filename, wazp_cfg, clcat, 
                      cosmo_params, out_paths):
 
@@ -2150,9 +2447,15 @@ def wmap_at_zcl(target, data_primary_clusters, r200_mpc, cluster_keys,
             ra_map, dec_map, weight_map, 
             zslice, wazp_specs, tile_specs, cosmo_params
         ) 
-        map2fits(xycat_fi, wazp_specs, tile_specs, zcl[i], cosmo_params, 
-                 xycat_fi_fitsname)
-        run_mr_filter(xycat_fi_fitsname, wmap_fitsname, wazp_specs) 
+        if wazp_specs['wavelet_engine'] == 'starlet':
+            map2fits(starlet_filter(xycat_fi, wazp_specs, 
+                                    dtype=wazp_specs['wavelet_dtype']), 
+                     wazp_specs, 
+                     tile_specs, zcl[i], cosmo_params, wmap_fitsname)
+        else:
+            map2fits(xycat_fi, wazp_specs, tile_specs, zcl[i], cosmo_params, 
+                     xycat_fi_fitsname)
+            run_mr_filter(xycat_fi_fitsname, wmap_fitsname, wazp_specs) 
         wmap_list.append(wmap_fitsname)
 
     return wmap_list
@@ -2189,6 +2492,19 @@ def update_config(param_cfg, param_data):
     param_cfg['maglim_det'] = np.float64(maglim_det)
     param_cfg['maglim_pmem'] = np.float64(maglim_pmem)
 
+    # tile cache = superset of the detection and pmem tile data 
+    param_cfg['tile_cache'] = None
+    if param_cfg['admin']['tile_cache']:
+        param_cfg['tile_cache'] = {
+            'radius_deg': np.float64(max(
+                tile_radius(param_cfg['admin']['tiling']), 
+                tile_radius_pmem(
+                    param_cfg['admin'], param_cfg['pmem_cfg'], cosmo_params
+                )
+            )),
+            'maglim': np.float64(max(maglim_det, maglim_pmem))
+        }
+
     # zmax is set to allow pmem to work on all wazp detections 
     param_cfg['pmem_cfg']['global_conditions']['zcl_max'] = np.float64(zmax+0.2)
     param_cfg['pmem_cfg']['mag_bin_specs']['max'] = np.float64(
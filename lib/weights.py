@@ -0,0 +1,87 @@
+import numpy as np
+
+# photo-z and luminosity weights of the galaxies of a slice.
+# Vectorised kernels computed in place in one float64 buffer (out,
+# allocated if not given), with the same operations and rounding
+# order as the scalar expressions they replace.
+
+
+def zp_weight_fct(zsl, zsl_min, zsl_max, x):
+    # scalar reference of zp_weight
+    sig = (zsl_max - zsl_min)/4.
+    if x < zsl-sig:
+        weight =  (1./sig)*x + 2. - (1./sig)*zsl
+    if x > zsl+sig:
+        weight = -(1./sig)*x + 2. + (1./sig)*zsl
+    if (x >= zsl-sig) &  (x <= zsl+sig):
+        weight = 1.
+    return weight
+
+
+def weight_buffer(n, out):
+    if out is None:
+        return np.empty(n)
+    return out[:n]
+
+
+def zp_weight(zsl, zsl_min, zsl_max, zp, out=None):
+    """
+    Triangular zp weight of a slice : 1 within +/- sig of zsl
+    (sig = (zsl_max - zsl_min)/4), decreasing linearly by 1 / sig
+    outside, i.e. min(1, 2 - |zp - zsl|/sig).
+    """
+    zp = np.asarray(zp)
+    sig = (zsl_max - zsl_min)/4.
+    inv, t = 1./sig, (1./sig)*zsl
+    weight = weight_buffer(len(zp), out)
+    np.multiply(zp, inv, out=weight)
+    low, high = zp < zsl-sig, zp > zsl+sig
+    np.add(weight, 2., out=weight, where=low)
+    np.subtract(weight, t, out=weight, where=low)
+    np.subtract(2., weight, out=weight, where=high)
+    np.add(weight, t, out=weight, where=high)
+    np.logical_or(low, high, out=low)
+    np.copyto(weight, 1., where=~low)
+    return weight
+
+
+def lum_weight(mag, mstar, power, out=None):
+    # 10**((mstar - mag)/power)
+    mag = np.asarray(mag)
+    weight = weight_buffer(len(mag), out)
+    np.negative(mag, out=weight)
+    weight += mstar
+    weight /= power
+    np.power(10., weight, out=weight)
+    return weight
+
+
+def detlum_weight(mag, mstar, power, out=None):
+    # lum_weight for galaxies brighter than mstar, 1 for the others
+    mag = np.asarray(mag)
+    weight = weight_buffer(len(mag), out)
+    bright = mag < mstar
+    np.negative(mag, out=weight)
+    weight += mstar
+    weight /= power
+    np.power(10., weight, out=weight, where=bright)
+    np.copyto(weight, 1., where=~bright)
+    return weight
+
+
+def map_detlum_weight(mag, mstar, wazp_cfg, out=None):
+    if wazp_cfg['map_lum_weight_mode'] == True:
+        return detlum_weight(
+            mag, mstar, wazp_cfg['lum_weight_map_power'], out
+        )
+    weight = weight_buffer(len(mag), out)
+    weight.fill(1.)
+    return weight
+
+
+def map_lum_weight(mag, mstar, wazp_cfg, out=None):
+    if wazp_cfg['map_lum_weight_mode'] == True:
+        return lum_weight(mag, mstar, wazp_cfg['lum_weight_map_power'], out)
+    weight = weight_buffer(len(mag), out)
+    weight.fill(1.)
+    return weight
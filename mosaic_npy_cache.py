@@ -0,0 +1,29 @@
+import yaml, sys
+
+from lib.utils import npy_cache_dir, create_mosaic_npy_cache
+
+# converts the galcat and footprint mosaics of the survey of wazp.cfg 
+# into the per pixel / column .npy caches read by wazp_main.py 
+#   > python mosaic_npy_cache.py wazp.cfg data.cfg
+# each cache goes to '<product> / mosaic / npy_cache' if given in 
+# data.cfg (can be shared by several runs on the same survey), 
+# in workdir/<product>_npy otherwise  
+config = sys.argv[1]
+dconfig = sys.argv[2]
+
+with open(config) as fstream:
+    param_cfg = yaml.load(fstream)
+with open(dconfig) as fstream:
+    param_data = yaml.load(fstream)
+
+survey = param_cfg['survey']
+products = ['galcat']
+if param_data['input_data_structure'][survey]['footprint_hpx_mosaic']:
+    products.append('footprint')
+for product in products:
+    print (product, ' npy cache in ', 
+           npy_cache_dir(param_cfg, param_data, product))
+    create_mosaic_npy_cache(
+        param_data[product][survey], param_cfg['admin']['nthreads_max']
+    )
+print ('all done folks !')
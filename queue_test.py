@@ -0,0 +1,133 @@
+import numpy as np
+import yaml, sys, os, glob, time, random, signal, subprocess, tempfile
+
+from lib.multithread import queue_dir, queue_file, queue_list_file
+from lib.multithread import current_run_id, reset_queue, publish_queue
+from lib.multithread import run_queue_worker
+
+# local test of the 'queue' mode : several workers on one workdir with
+# a short lease, one of them killed while it holds a tile
+#   > python queue_test.py wazp.cfg data.cfg [nworkers] [lease_s]
+# runs the coordinator and nworkers 'wazp_main.py ... worker' processes
+# on a copy of wazp.cfg (parallel_mode 'queue', short lease / poll) and
+# checks that every tile of each stage is done or failed and that no
+# lock is left
+#   > python queue_test.py dummy [nworkers] [lease_s]
+# same on the queue alone, with tiles that only sleep : also checks
+# that the surviving workers ran each tile exactly once (no tile run
+# concurrently by two workers)
+# exits with status 1 if a check fails
+
+
+def dummy_tile(config, dconfig, tile_id):
+    # sleeps and records (tile, start, end) for this worker
+    t0 = time.time()
+    time.sleep(random.uniform(0.2, 0.6))
+    with open(os.path.join(config, 'runs_'+str(os.getpid())+'.txt'),
+              'a') as outfile:
+        outfile.write(str(tile_id)+' '+str(t0)+' '+str(time.time())+'\n')
+    return
+
+
+def kill_first_claimer(workers, workdir, timeout_s=600.):
+    # kills the first worker seen holding a lock (returns its pid)
+    t0 = time.time()
+    while time.time() - t0 < timeout_s:
+        for lock in glob.glob(os.path.join(queue_dir(workdir), '*.lock')):
+            try:
+                with open(lock) as fstream:
+                    token = fstream.readline()
+            except FileNotFoundError:
+                continue
+            for worker in workers:
+                if '_'+str(worker.pid)+'_' in token:
+                    worker.send_signal(signal.SIGKILL)
+                    print ('worker ', worker.pid, ' killed while holding ',
+                           os.path.basename(lock))
+                    return worker.pid
+        time.sleep(0.05)
+    return None
+
+
+def check_stage(workdir, stage):
+    # every tile of the stage done or failed, no lock left
+    run_id = current_run_id(workdir)
+    tile_ids = np.load(queue_list_file(workdir, stage, run_id))
+    ok = True
+    for tile_id in tile_ids:
+        markers = [ext for ext in ('.done', '.failed', '.lock')
+                   if os.path.isfile(queue_file(workdir, stage, tile_id, ext))]
+        if markers not in (['.done'], ['.failed']):
+            print ('..... stage ', stage, ' tile ', tile_id, ' : ', markers)
+            ok = False
+    print ('stage ', stage, ' : ', len(tile_ids), ' tiles ',
+           'ok' if ok else 'FAILED')
+    return ok
+
+
+if len(sys.argv) > 1 and sys.argv[1] == 'dummy-worker':
+    queue_cfg = {'lease_s':float(sys.argv[3]), 'poll_s':0.1, 'wait_s':60.}
+    run_queue_worker(
+        dummy_tile, sys.argv[2], None, sys.argv[2], 'wazp', queue_cfg
+    )
+    sys.exit()
+
+dummy = sys.argv[1] == 'dummy'
+iarg = 2 if dummy else 3
+nworkers = int(sys.argv[iarg]) if len(sys.argv) > iarg else 3
+lease_s = float(sys.argv[iarg+1]) if len(sys.argv) > iarg+1 else 2.
+
+if dummy:
+    workdir = tempfile.mkdtemp(prefix='wazp_queue_')
+    reset_queue(workdir)
+    publish_queue(workdir, 'wazp', np.arange(1, 41))
+    workers = [subprocess.Popen(
+        [sys.executable, __file__, 'dummy-worker', workdir, str(lease_s)]
+    ) for i in range(0, nworkers)]
+    killed = kill_first_claimer(workers, workdir)
+    for worker in workers:
+        worker.wait()
+    ok = check_stage(workdir, 'wazp')
+
+    # surviving workers : each tile run exactly once
+    runs = []
+    for runs_file in glob.glob(os.path.join(workdir, 'runs_*.txt')):
+        if runs_file.endswith('_'+str(killed)+'.txt'):
+            continue
+        runs.append(np.loadtxt(runs_file, ndmin=2))
+    runs = np.vstack(runs)
+    tiles, counts = np.unique(runs[:, 0], return_counts=True)
+    if len(tiles) != 40 or np.any(counts != 1):
+        print ('..... tiles run more than once : ', tiles[counts > 1],
+               ' / never : ', np.setdiff1d(np.arange(1, 41), tiles))
+        ok = False
+    print ('workdir ', workdir)
+else:
+    with open(sys.argv[1]) as fstream:
+        param_cfg = yaml.load(fstream)
+    workdir = param_cfg['out_paths']['workdir']
+    param_cfg['admin']['parallel_mode'] = 'queue'
+    param_cfg['admin']['queue'].update(
+        {'lease_s':lease_s, 'poll_s':min(1., lease_s/4.)}
+    )
+    config = os.path.join(
+        tempfile.mkdtemp(prefix='wazp_queue_'), 'wazp_queue.cfg'
+    )
+    with open(config, 'w') as outfile:
+        yaml.dump(param_cfg, outfile)
+
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'wazp_main.py')
+    coordinator = subprocess.Popen([sys.executable, main, config, sys.argv[2]])
+    workers = [subprocess.Popen(
+        [sys.executable, main, config, sys.argv[2], 'worker']
+    ) for i in range(0, nworkers)]
+    kill_first_claimer(workers, workdir)
+    ok = coordinator.wait() == 0
+    for worker in workers:
+        worker.wait()
+    for stage in ('wazp', 'pmem'):
+        ok = check_stage(workdir, stage) and ok
+
+print ('queue test ', 'passed' if ok else 'FAILED')
+sys.exit(0 if ok else 1)
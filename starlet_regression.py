@@ -0,0 +1,67 @@
+import numpy as np
+import yaml, sys, os, glob
+
+from lib.starlet import compare_with_mr_filter
+
+# regression of the in memory starlet engine against the mr_filter
+# outputs of a run made with wavelet_engine 'mr_filter'
+#   > python starlet_regression.py wazp.cfg [max_rel_l2] [min_matched] 
+#                                           [max_spurious]
+# each xycat_fi_<isl>.fits / wmap_<isl>.fits pair found in the tiles
+# of workdir is filtered again with lib.starlet and compared. 
+# Passes (exit status 0) if the median relative l2 difference of the 
+# maps is <= max_rel_l2 (default 0.05) and if, in every map, at least 
+# a fraction min_matched (default 1.) of the mr_filter peaks is found 
+# and at most a fraction max_spurious (default 0.) of the starlet 
+# peaks has no mr_filter counterpart. 
+# The measures of all the maps are written to 
+# workdir/starlet_regression.txt (to be reported with the tolerances
+# when the defaults are revised)
+config = sys.argv[1]
+max_rel_l2 = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+min_matched = float(sys.argv[3]) if len(sys.argv) > 3 else 1.
+max_spurious = float(sys.argv[4]) if len(sys.argv) > 4 else 0.
+
+with open(config) as fstream:
+    param_cfg = yaml.load(fstream)
+
+out_paths, wazp_cfg = param_cfg['out_paths'], param_cfg['wazp_cfg']
+keys = ('rel_l2', 'npeaks_ref', 'npeaks', 'matched_frac', 'spurious_frac')
+names, measures = [], []
+for xycat_fi in sorted(glob.glob(os.path.join(
+        out_paths['workdir'], 'tiles', 'tile_*', out_paths['wazp']['files'],
+        'xycat_fi_*.fits'
+))):
+    wmap = xycat_fi.replace('xycat_fi_', 'wmap_')
+    if not os.path.isfile(wmap):
+        continue
+    res = compare_with_mr_filter(xycat_fi, wmap, wazp_cfg)
+    print (xycat_fi, ' rel. l2 ', np.round(res['rel_l2'], 3),
+           ' peaks ref / starlet ', res['npeaks_ref'], res['npeaks'], 
+           ' matched / spurious ', np.round(res['matched_frac'], 3), 
+           np.round(res['spurious_frac'], 3))
+    names.append(os.path.relpath(xycat_fi, out_paths['workdir']))
+    measures.append([res[key] for key in keys])
+
+if len(measures) == 0:
+    print ('no xycat_fi / wmap pair in the tiles of workdir : FAILED')
+    sys.exit(1)
+measures = np.array(measures)
+rel_l2, matched, spurious = measures[:, 0], measures[:, 3], measures[:, 4]
+passed = np.median(rel_l2) <= max_rel_l2 and \
+         np.min(matched) >= min_matched and \
+         np.max(spurious) <= max_spurious
+with open(os.path.join(out_paths['workdir'], 'starlet_regression.txt'), 
+          'w') as outfile:
+    outfile.write('# file '+' '.join(keys)+'\n')
+    for name, row in zip(names, measures):
+        outfile.write(name+' '+' '.join(str(v) for v in row)+'\n')
+print ('median / max rel. l2 ', np.round(np.median(rel_l2), 3), 
+       ' / ', np.round(np.max(rel_l2), 3), ' (max median ', max_rel_l2, ')')
+print ('median / min matched peaks frac. ', np.round(np.median(matched), 3), 
+       ' / ', np.round(np.min(matched), 3), ' (min ', min_matched, ')')
+print ('median / max spurious peaks frac. ', 
+       np.round(np.median(spurious), 3), ' / ', np.round(np.max(spurious), 3),
+       ' (max ', max_spurious, ')')
+print ('starlet regression ', 'passed' if passed else 'FAILED')
+sys.exit(0 if passed else 1)
@@ -1,20 +1,32 @@
 import numpy as np
 import yaml, os, sys, json
-from astropy.table import join
+from astropy.table import join, Table
 
-from lib.multithread import split_survey
+from lib.multithread import split_survey, run_tiles_in_pool
+from lib.multithread import predict_tile_costs, order_tiles_by_cost
+from lib.multithread import predict_pmem_tile_costs
+from lib.multithread import reset_queue, publish_queue, run_queue_worker
 from lib.utils import create_directory
+from lib.context import build_run_context
+from lib.manifest import stage_done, commit_stage, atomic_path, write_table
 from lib.utils import update_data_structure, get_footprint
 from lib.wazp import compute_zpslices, bkg_global_survey
-from lib.wazp import run_wazp_tile, wazp_concatenate
+from lib.wazp import run_wazp_tile, run_wazp_1tile, wazp_concatenate
+from lib.wazp import prefetch_wazp_1tile
 from lib.wazp import update_config, create_wazp_directories
 from lib.wazp import tiles_with_clusters, official_wazp_cat
-from lib.pmem import run_pmem_tile, pmem_concatenate_tiles
+from lib.wazp import wazp_tiles_info, gbkg_hash
+from lib.pmem import run_pmem_tile, run_pmem_1tile, pmem_concatenate_tiles
+from lib.pmem import prefetch_pmem_1tile
 from lib.pmem import concatenate_calib_dz, eff_tiles_for_pmem
+from lib.pmem import nclusters_in_tiles, pmem_tiles_info
+from lib.members_store import write_members_store
 
 # read config files as online arguments 
 config = sys.argv[1]
 dconfig = sys.argv[2]
+# optional 3rd argument 'worker' : join a run in admin/parallel_mode 'queue'
+role = sys.argv[3] if len(sys.argv) > 3 else 'coordinator'
 
 # open config files
 with open(config) as fstream:
@@ -30,7 +42,26 @@ print ('Workdir = ', param_cfg['out_paths']['workdir'])
 
 # create directory structure 
 workdir = param_cfg['out_paths']['workdir']
+
+# queue worker : process tiles published by the coordinator and exit
+if role == 'worker':
+    config = os.path.join(workdir, 'config', 'wazp.cfg')    
+    dconfig = os.path.join(workdir, 'config', 'data.cfg')    
+    queue_cfg = param_cfg['admin']['queue']
+    run_queue_worker(
+        run_wazp_1tile, config, dconfig, workdir, 'wazp', queue_cfg, 
+        prefetch_wazp_1tile
+    )
+    run_queue_worker(
+        run_pmem_1tile, config, dconfig, workdir, 'pmem', queue_cfg, 
+        prefetch_pmem_1tile
+    )
+    print ('worker done')
+    sys.exit()
+
 create_wazp_directories(workdir)
+if param_cfg['admin']['parallel_mode'] == 'queue':
+    reset_queue(workdir)
 
 # create required data structure if not exist and update params
 param_data = update_data_structure(param_cfg, param_data)
@@ -61,6 +92,8 @@ zpslices_filename = os.path.join(
     workdir, wazp_cfg['zpslices_filename']
 )
 gbkg_filename = os.path.join(workdir, 'gbkg', wazp_cfg['gbkg_filename'])
+cost_filename = os.path.join(workdir, admin['cost_model_file'])
+pmem_cost_filename = os.path.join(workdir, admin['pmem_cost_model_file'])
 cosmo_params = param_cfg['cosmo_params']
 survey = param_cfg['survey']
 ref_filter = param_cfg['ref_filter']
@@ -74,7 +107,7 @@ survey_footprint = get_footprint(
 )
 all_tiles = split_survey(
     survey_footprint, param_data['footprint'][survey], 
-    admin, tiles_filename
+    admin, tiles_filename, cost_filename
 )
 
 # compute zp slicing 
@@ -84,19 +117,55 @@ compute_zpslices(
 )
 
 # compute global bkg ppties 
-if not os.path.isfile(gbkg_filename):
+if not stage_done(workdir, 'gbkg', gbkg_hash(param_cfg, param_data)):
     print ('Global bkg computation')
     bkg_global_survey(
         param_data['galcat'][survey], param_data['footprint'][survey], 
         tiles_filename, zpslices_filename, 
         admin['tiling'], cosmo_params, 
         param_data['magstar_file'][survey][ref_filter], 
-        wazp_cfg, gbkg_filename)
+        wazp_cfg, atomic_path(gbkg_filename))
+    os.replace(atomic_path(gbkg_filename), gbkg_filename)
+    commit_stage(workdir, 'gbkg', gbkg_hash(param_cfg, param_data))
+
+# configs, slices, global bkg... parsed once, inherited by the workers
+build_run_context(config, dconfig)
 
 # detect clusters on all tiles 
 print ('Run wazp in tiles')
-for ith in np.unique(all_tiles['thread_id']): 
-    run_wazp_tile(config, dconfig, ith)
+if admin['parallel_mode'] == 'pool':
+    report = run_tiles_in_pool(
+        run_wazp_1tile, config, dconfig, 
+        all_tiles['id'], admin['nthreads_max'], 
+        tile_costs=predict_tile_costs(all_tiles, cost_filename)
+    )
+    Table(report).write(
+        os.path.join(workdir, 'tmp', 'wazp_tiles_report.fits'), 
+        overwrite=True
+    )
+elif admin['parallel_mode'] == 'queue':
+    publish_queue(
+        workdir, 'wazp', order_tiles_by_cost(
+            all_tiles['id'], predict_tile_costs(all_tiles, cost_filename)
+        )
+    )
+    report = run_queue_worker(
+        run_wazp_1tile, config, dconfig, workdir, 'wazp', admin['queue'], 
+        prefetch_wazp_1tile
+    )
+    Table(report).write(
+        os.path.join(workdir, 'tmp', 'wazp_tiles_report.fits'), 
+        overwrite=True
+    )
+else:
+    for ith in np.unique(all_tiles['thread_id']): 
+        run_wazp_tile(config, dconfig, ith)
+
+# record tile timings / stats for the cost model of the next run
+wazp_tiles_info(
+    param_cfg['out_paths'], all_tiles, 
+    os.path.join(workdir, 'tiles_info.fits')
+)
 
 # tiles with clusters 
 eff_tiles = tiles_with_clusters(param_cfg['out_paths'], all_tiles)
@@ -106,7 +175,7 @@ data_clusters = wazp_concatenate(
     eff_tiles, zpslices_filename, wazp_cfg, param_cfg['clcat'], 
     cosmo_params, param_cfg['out_paths']
 )
-data_clusters.write(param_cfg['clcat']['wazp']['cat'], overwrite=True)
+write_table(param_cfg['clcat']['wazp']['cat'], data_clusters, artifact=True)
 
 # eff tiles for Pmems (not necessarily = as for wazp because of overlap)
 eff_tiles_pmem = eff_tiles_for_pmem(
@@ -115,8 +184,44 @@ eff_tiles_pmem = eff_tiles_for_pmem(
 
 # Run pmem on each tile 
 print ('Pmem starts')
-for ith in np.unique(all_tiles['thread_id']):
-    run_pmem_tile(config, dconfig, ith)
+build_run_context(config, dconfig) # with the new cluster catalog
+pmem_costs = predict_pmem_tile_costs(
+    nclusters_in_tiles(
+        data_clusters, param_cfg['clcat']['wazp'], eff_tiles_pmem
+    ), pmem_cost_filename
+)
+if admin['parallel_mode'] == 'pool':
+    report = run_tiles_in_pool(
+        run_pmem_1tile, config, dconfig, 
+        eff_tiles_pmem['id'], admin['nthreads_max'], 
+        tile_costs=pmem_costs
+    )
+    Table(report).write(
+        os.path.join(workdir, 'tmp', 'pmem_tiles_report.fits'), 
+        overwrite=True
+    )
+elif admin['parallel_mode'] == 'queue':
+    publish_queue(
+        workdir, 'pmem', 
+        order_tiles_by_cost(eff_tiles_pmem['id'], pmem_costs)
+    )
+    report = run_queue_worker(
+        run_pmem_1tile, config, dconfig, workdir, 'pmem', admin['queue'], 
+        prefetch_pmem_1tile
+    )
+    Table(report).write(
+        os.path.join(workdir, 'tmp', 'pmem_tiles_report.fits'), 
+        overwrite=True
+    )
+else:
+    for ith in np.unique(all_tiles['thread_id']):
+        run_pmem_tile(config, dconfig, ith)
+
+# record pmem tile timings for the pmem cost model of the next run
+pmem_tiles_info(
+    param_cfg['out_paths'], eff_tiles_pmem, 
+    os.path.join(workdir, 'pmem_tiles_info.fits')
+)
 
 # concatenate calib_dz file 
 if pmem_cfg['calib_dz']['mode']:
@@ -131,9 +236,18 @@ if pmem_cfg['calib_dz']['mode']:
 data_richness, data_members = pmem_concatenate_tiles(
     eff_tiles_pmem, param_cfg['out_paths'], 
     os.path.join(workdir, 'tmp', 'pmem_richness.fits'),
-    os.path.join(workdir, 'wazp_members.fits')
+    os.path.join(workdir, 'wazp_members.fits'), admin['nthreads_max']
 )
 
+# optional indexed store of the members (random access by id / region)
+if pmem_cfg['members_store']['mode']:
+    write_members_store(
+        os.path.join(workdir, 'wazp_members.fits'), 
+        os.path.join(workdir, 'tmp', 'pmem_richness.fits'), 
+        os.path.join(workdir, pmem_cfg['members_store']['dirname']), 
+        param_cfg['clcat'][clusters]['keys'], pmem_cfg['members_store']
+    )
+
 # merge clusters + richness  
 data_clusters_with_rich = join(data_clusters, data_richness)
 
@@ -0,0 +1,40 @@
+import numpy as np
+import sys, time
+
+from lib.weights import zp_weight_fct, zp_weight, map_lum_weight
+
+# per galaxy throughput of the zp x luminosity weights of a slice :
+# np.vectorize of the scalar weight (former implementation), 
+# vectorised kernels of lib/weights.py and unweighted selection
+#   > python weights_benchmark.py [ngals]
+ngals = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+rng = np.random.default_rng(0)
+zp = rng.uniform(0., 1.5, ngals)
+mag = rng.uniform(16., 25., ngals)
+zsl, zsl_min, zsl_max, mstar = 0.5, 0.46, 0.54, 21.
+wazp_cfg = {'map_lum_weight_mode':True, 'lum_weight_map_power':2.5}
+
+def vectorized():
+    return np.vectorize(zp_weight_fct)(zsl, zsl_min, zsl_max, zp) * \
+        10**((-mag + mstar)/wazp_cfg['lum_weight_map_power'])
+
+def kernels():
+    weight = zp_weight(zsl, zsl_min, zsl_max, zp)
+    weight *= map_lum_weight(mag, mstar, wazp_cfg)
+    return weight
+
+def unweighted():
+    return np.ones(ngals)
+
+ref = vectorized()
+print ('.....identical weights ', np.array_equal(ref, kernels()))
+for name, fct in [('np.vectorize', vectorized), ('kernels', kernels),
+                  ('unweighted', unweighted)]:
+    nrep = 1 if name == 'np.vectorize' else 10
+    t0 = time.time()
+    for i in range(0, nrep):
+        fct()
+    dt = (time.time() - t0) / nrep
+    print (name, ' ', np.round(dt, 4), ' s  ', 
+           np.round(ngals / max(dt, 1.e-9) / 1.e6, 2), ' Mgals/s')
+print ('all done folks !')